@@ -0,0 +1,135 @@
+import json
+import time
+import random
+import asyncio
+import itertools
+from collections import Counter
+from typing import Any, AsyncIterator, Iterator, List, Optional
+from telegram.request import BaseRequest
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Game Master", "username": "benchmark_bot"}
+
+
+class FakeBotRequest(BaseRequest):
+    """
+    Answers Bot API calls locally, after `latency` seconds, and counts them.
+
+    Only the methods the bot uses get realistic results (sent and edited
+    messages); anything else succeeds with `True`.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        parameters = request_data.parameters if request_data is not None else {}
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return 200, json.dumps({"ok": True, "result": self._result(endpoint, parameters)}).encode("utf-8")
+
+    def _result(self, endpoint: str, parameters: dict):
+        if endpoint == "getMe":
+            return BOT_USER
+        if endpoint == "getUpdates":
+            return []
+        if endpoint in ("sendMessage", "editMessageText"):
+            message_id = parameters.get("message_id") or next(self._message_ids)
+            return {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": parameters["chat_id"], "type": "private"},
+                "from": BOT_USER,
+                "text": parameters.get("text", ""),
+            }
+        return True
+
+
+class FakeModelError(Exception):
+    """An injected LLM failure."""
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    A chat model that waits `first_token_latency` seconds, then streams
+    `answer` at `tokens_per_second`. A `slow_rate` share of calls waits
+    `slow_latency` seconds instead, and a `failure_rate` share raises
+    FakeModelError after the wait.
+    """
+
+    answer: str = (
+        "In Sea Salt & Paper, each pair of duo cards is worth 1 point, and collector cards "
+        "score more the more of them you hold."
+    )
+    first_token_latency: float = 0.5
+    tokens_per_second: float = 50.0
+    slow_rate: float = 0.0
+    slow_latency: float = 10.0
+    failure_rate: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def _first_token_delay(self):
+        """Picks this call's latency and whether it fails."""
+        delay = self.slow_latency if random.random() < self.slow_rate else self.first_token_latency
+        return delay, random.random() < self.failure_rate
+
+    def _tokens(self) -> list:
+        words = self.answer.split(" ")
+        return [word + " " for word in words[:-1]] + words[-1:]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        delay, fails = self._first_token_delay()
+        time.sleep(delay)
+        if fails:
+            raise FakeModelError("Injected LLM failure.")
+        time.sleep(len(self._tokens()) / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.answer))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        delay, fails = self._first_token_delay()
+        await asyncio.sleep(delay)
+        if fails:
+            raise FakeModelError("Injected LLM failure.")
+        await asyncio.sleep(len(self._tokens()) / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.answer))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        delay, fails = self._first_token_delay()
+        time.sleep(delay)
+        if fails:
+            raise FakeModelError("Injected LLM failure.")
+        for token in self._tokens():
+            time.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        delay, fails = self._first_token_delay()
+        await asyncio.sleep(delay)
+        if fails:
+            raise FakeModelError("Injected LLM failure.")
+        for token in self._tokens():
+            await asyncio.sleep(1 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager is not None:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
@@ -0,0 +1,106 @@
+"""
+Measures the memory chat histories take, the old way and the new way.
+
+Fills the history of many chats with questions and answers from the load
+test corpus, once as lists of LangChain messages (as chat_data used to hold
+them) and once as ChatHistory ring buffers, and reports the bytes traced by
+tracemalloc per chat. The texts are created before tracing starts, so this is
+what each layout adds on top of them. Also times HistoryStore's bookkeeping.
+
+    python -m benchmarks.history_memory
+    python -m benchmarks.history_memory --chats 10000 --exchanges 20
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+from langchain_core.messages import AIMessage, HumanMessage
+from utils.chat_history import HISTORY_MAX_MESSAGES, ChatHistory, HistoryStore
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), "corpus.jsonl")
+# Typical answers are a few sentences of rules text
+ANSWER_WORDS = (40, 160)
+
+
+def load_questions(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    return [e["text"] for e in entries if e["kind"] == "message" and not e["text"].startswith("/")]
+
+
+def make_answer(rng: random.Random, vocabulary: list) -> str:
+    return " ".join(rng.choice(vocabulary) for _ in range(rng.randint(*ANSWER_WORDS)))
+
+
+def fill_lists(exchanges: list) -> dict:
+    """The old layout: a list of messages per chat, trimmed to the latest ones."""
+    chats = {}
+    for chat_id, question, answer in exchanges:
+        history = chats.setdefault(chat_id, {}).setdefault("history", [])
+        history.extend([HumanMessage(content=question), AIMessage(content=answer)])
+        if len(history) > HISTORY_MAX_MESSAGES:
+            chats[chat_id]["history"] = history[-HISTORY_MAX_MESSAGES:]
+    return chats
+
+
+def fill_ring_buffers(exchanges: list) -> dict:
+    chats = {}
+    for chat_id, question, answer in exchanges:
+        history = chats.setdefault(chat_id, {}).setdefault("history", ChatHistory())
+        history.add_exchange(question, answer)
+    return chats
+
+
+def traced_bytes(fill, exchanges: list):
+    """Returns the bytes still allocated by `fill` once it returns, and its result."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        chats = fill(exchanges)
+        return tracemalloc.get_traced_memory()[0] - before, chats
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the memory of chat history layouts.")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="JSONL file whose messages are used as questions.")
+    parser.add_argument("--chats", type=int, default=10000)
+    parser.add_argument("--exchanges", type=int, default=10, help="Questions asked per chat.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    questions = load_questions(args.corpus)
+    vocabulary = " ".join(questions).split()
+    # Fresh strings per exchange, like messages arriving from Telegram and the LLM
+    exchanges = [
+        (chat_id, rng.choice(questions) + " ", make_answer(rng, vocabulary))
+        for _ in range(args.exchanges)
+        for chat_id in range(args.chats)
+    ]
+
+    results = {}
+    for name, fill in (("message lists", fill_lists), ("ring buffers", fill_ring_buffers)):
+        size, chats = traced_bytes(fill, exchanges)
+        results[name] = size
+        print(f"{name:>14}: {size / 1024 / 1024:8.1f} MiB, {size / args.chats:8.0f} bytes per chat on top of the texts")
+        del chats
+    print(f"Ring buffers add {results['ring buffers'] / results['message lists']:.0%} of the overhead of message lists.")
+
+    store = HistoryStore()
+    chats = {}
+    started = time.perf_counter()
+    for chat_id, question, answer in exchanges:
+        chat_data = chats.setdefault(chat_id, {})
+        store.add_exchange(chat_id, chat_data, question, answer)
+    elapsed = time.perf_counter() - started
+    print(f"HistoryStore: {elapsed / len(exchanges) * 1e6:.1f} us per exchange, "
+          f"{store.nbytes / len(store):.0f} bytes per chat (texts included) counted against the memory cap.")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
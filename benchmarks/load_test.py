@@ -0,0 +1,238 @@
+"""
+Replays a message corpus through the bot's real handlers, offline.
+
+Telegram is replaced by a local fake Bot API and Gemini by a fake chat
+model with configurable latency and token rate, so runs are repeatable and
+free. Reports throughput and p50/p95/p99 latency per handler plus peak RSS,
+and writes everything to a JSON file that later runs can be compared with.
+
+    python -m benchmarks.load_test --messages 500 --rate 50 --chats 100
+    python -m benchmarks.load_test --baseline benchmarks/results/<earlier run>.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import resource
+import itertools
+from datetime import datetime, timezone
+import numpy as np
+
+# The fake model is used instead of Gemini, but the module reads the key on import
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+
+from telegram import Update
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from benchmarks.fakes import FakeBotRequest, FakeChatModel
+from game_registry import GameRegistry
+from telegram_handlers import build_application
+from utils.concurrency import COALESCED_CALLS
+from utils.resilience import LLM_CIRCUIT_REJECTED, LLM_HEDGED
+from utils.tracing import RAG_FALLBACKS
+from utils.intent_router import INTENT_ROUTES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), "corpus.jsonl")
+RESULTS_PATH = os.path.join(os.path.dirname(__file__), "results")
+# Dimension of the committed FAISS indexes (all-MiniLM-L6-v2)
+EMBEDDING_SIZE = 384
+
+
+def load_corpus(path: str) -> list:
+    """
+    Reads (kind, text) pairs from a JSONL file. Lines are either
+    {"kind": ..., "text": ...} or backlog entries with a "title", which are
+    replayed as plain questions.
+    """
+    corpus = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "text" in entry:
+                corpus.append((entry.get("kind", "message"), entry["text"]))
+            elif "title" in entry:
+                corpus.append(("message", entry["title"]))
+    if not corpus:
+        raise ValueError(f"No messages found in '{path}'.")
+    return corpus
+
+
+def make_update(bot, update_id: int, chat_id: int, text: str, inline: bool = False) -> Update:
+    """Builds the Update Telegram would send for a user typing `text` (after the bot's name if `inline`)."""
+    user = {"id": chat_id, "is_bot": False, "first_name": "Player"}
+    if inline:
+        inline_query = {"id": str(update_id), "from": user, "query": text, "offset": ""}
+        return Update.de_json({"update_id": update_id, "inline_query": inline_query}, bot)
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": user,
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split(" ", 1)[0])}]
+    return Update.de_json({"update_id": update_id, "message": message}, bot)
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": round(float(p50), 4), "p95": round(float(p95), 4), "p99": round(float(p99), 4)}
+
+
+async def run(args) -> dict:
+    request = FakeBotRequest(latency=args.telegram_latency)
+    llm = FakeChatModel(
+        first_token_latency=args.llm_latency,
+        tokens_per_second=args.llm_token_rate,
+        slow_rate=args.llm_slow_rate,
+        slow_latency=args.llm_slow_latency,
+        failure_rate=args.llm_failure_rate,
+    )
+    embeddings = DeterministicFakeEmbedding(size=EMBEDDING_SIZE) if args.fake_embeddings else None
+    registry = GameRegistry(embeddings=embeddings, llm=llm)
+    app = build_application("123456:BENCHMARK", registry, request=request)
+
+    errors = {}
+    kinds = {}
+
+    async def count_error(update, context):
+        kind = kinds.get(update.update_id, "unknown") if isinstance(update, Update) else "unknown"
+        errors[kind] = errors.get(kind, 0) + 1
+
+    app.add_error_handler(count_error)
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    # Running, as in production, so background tasks (e.g. history summaries) are awaited on stop
+    await app.start()
+
+    started = time.perf_counter()
+    # post_init started the background warm-up; wait for it like a first question would
+    await registry.ready.wait()
+    warmup_seconds = time.perf_counter() - started
+
+    corpus = load_corpus(args.corpus)
+    messages = list(itertools.islice(itertools.cycle(corpus), args.messages))
+    latencies = {}
+
+    async def process(update_id: int, kind: str, text: str):
+        chat_id = 1000 + update_id % args.chats
+        update = make_update(app.bot, update_id, chat_id, text, inline=kind.startswith("inline"))
+        kinds[update_id] = kind
+        sent_at = time.perf_counter()
+        # The same path PTB takes for incoming updates, including the per-chat ordering
+        await app.update_processor.process_update(update, app.process_update(update))
+        latencies.setdefault(kind, []).append(time.perf_counter() - sent_at)
+
+    tasks = []
+    started = time.perf_counter()
+    for update_id, (kind, text) in enumerate(messages, start=1):
+        if args.rate > 0:
+            # Open loop: messages arrive on schedule whether or not earlier ones are done
+            delay = started + (update_id - 1) / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(process(update_id, kind, text)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    await app.stop()
+    await app.shutdown()
+
+    handlers = {}
+    for kind, values in sorted(latencies.items()):
+        handlers[kind] = {
+            "count": len(values),
+            "errors": errors.get(kind, 0),
+            "throughput": round(len(values) / elapsed, 2),
+            **percentiles(values),
+        }
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "elapsed_seconds": round(elapsed, 3),
+        "warmup_seconds": round(warmup_seconds, 3),
+        "throughput": round(len(messages) / elapsed, 2),
+        "handlers": handlers,
+        "telegram_calls": dict(request.calls),
+        "coalesced_requests": int(COALESCED_CALLS.value()),
+        "hedged_requests": {winner: int(LLM_HEDGED.value(winner=winner)) for winner in ("primary", "hedge")},
+        "circuit_rejections": int(LLM_CIRCUIT_REJECTED.value()),
+        "fallback_answers": {reason: int(RAG_FALLBACKS.value(reason=reason)) for reason in ("deadline", "circuit_open")},
+        "routed_messages": {
+            intent: int(INTENT_ROUTES.value(intent=intent))
+            for intent in ("rules", "score", "greeting", "thanks", "off_topic")
+        },
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def compare(result: dict, baseline: dict):
+    """Prints how each handler's latency moved against an earlier run."""
+    print(f"\nCompared with the run of {baseline.get('timestamp')}:")
+    for kind, stats in result["handlers"].items():
+        before = baseline.get("handlers", {}).get(kind)
+        if not before:
+            print(f"  {kind}: not in baseline")
+            continue
+        changes = []
+        for key in ("p50", "p95", "p99", "throughput"):
+            if before.get(key) and stats.get(key) is not None:
+                changes.append(f"{key} {(stats[key] - before[key]) / before[key]:+.1%}")
+        print(f"  {kind}: {', '.join(changes)}")
+    print(f"  peak RSS: {result['peak_rss_mb']} MB (was {baseline.get('peak_rss_mb')} MB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test of the Telegram handlers.")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="JSONL file of messages to replay.")
+    parser.add_argument("--messages", type=int, default=200, help="Messages to send (the corpus is repeated).")
+    parser.add_argument("--rate", type=float, default=20.0, help="Messages per second (0 = all at once).")
+    parser.add_argument("--chats", type=int, default=50, help="Distinct chats the messages come from.")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Seconds before the fake model's first token.")
+    parser.add_argument("--llm-token-rate", type=float, default=50.0, help="Tokens per second streamed by the fake model.")
+    parser.add_argument("--llm-slow-rate", type=float, default=0.0, help="Share of LLM calls that take --llm-slow-latency.")
+    parser.add_argument("--llm-slow-latency", type=float, default=10.0, help="Seconds before the first token of a slow call.")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0, help="Share of LLM calls that fail.")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="Seconds per fake Bot API call.")
+    parser.add_argument("--real-embeddings", dest="fake_embeddings", action="store_false",
+                        help="Use the configured embedding model instead of deterministic fake vectors.")
+    parser.add_argument("--output", help="Where to write the JSON results (default: benchmarks/results/<time>.json).")
+    parser.add_argument("--baseline", help="Earlier results file to compare against.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    result = asyncio.run(run(args))
+
+    output = args.output or os.path.join(RESULTS_PATH, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+
+    print(f"{len(result['handlers'])} handler(s), {result['throughput']} msg/s overall, peak RSS {result['peak_rss_mb']} MB, "
+          f"{result['coalesced_requests']} request(s) coalesced")
+    for kind, stats in result["handlers"].items():
+        print(f"  {kind:12} n={stats['count']:<5} err={stats['errors']:<3} "
+              f"p50={stats['p50']}s p95={stats['p95']}s p99={stats['p99']}s")
+    print(f"Hedged LLM requests: {result['hedged_requests']}; circuit rejections: {result['circuit_rejections']}; "
+          f"fallback answers: {result['fallback_answers']}")
+    print(f"Messages by intent: {result['routed_messages']}")
+    print(f"Results saved to '{output}'.")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
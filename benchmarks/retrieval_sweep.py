@@ -0,0 +1,234 @@
+"""
+Sweeps chunking and retrieval settings against a labeled question set.
+
+Each question lists short passages of the rules that answer it. For every
+combination of chunk size, chunk overlap, retriever mode and k, the rules
+are split and indexed in memory (one worker process per chunking setting)
+and every question is retrieved. Reports recall@k (share of the relevant
+passages found in a retrieved chunk), context tokens sent to the LLM
+before and after packing, and retrieval latency, then picks the cheapest
+configuration that meets the recall floor.
+
+    python -m benchmarks.retrieval_sweep
+    python -m benchmarks.retrieval_sweep --chunk-sizes 400 700 1000 --overlaps 0 150 --k 2 3 4 --min-recall 0.9
+"""
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import importlib
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from utils.context_packer import estimate_tokens, pack_documents
+from utils.create_vectorestore import CHUNK_SIZE, CHUNK_OVERLAP, chunk_id
+from utils.embeddings import get_embeddings
+from utils.hybrid_retriever import HybridRetriever, LexicalIndex
+from knowledge_base_manager import HYBRID_VECTOR_WEIGHT, LEXICAL_SHORTCUT_SCORE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EVAL_SET = os.path.join(os.path.dirname(__file__), "retrieval_eval.jsonl")
+RESULTS_PATH = os.path.join(os.path.dirname(__file__), "results")
+# Dimension of the committed FAISS indexes (all-MiniLM-L6-v2)
+EMBEDDING_SIZE = 384
+# Large enough that packing only removes overlap, never whole chunks
+UNLIMITED_TOKENS = 10 ** 9
+
+WHITESPACE = re.compile(r"\s+")
+
+# Embedding model of this worker process, loaded on its first task
+_embeddings = None
+
+
+def load_eval_set(path: str) -> dict:
+    """Reads {"game", "question", "relevant": [passages]} lines into {game: [(question, passages)]}."""
+    questions = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                questions.setdefault(entry["game"], []).append((entry["question"], entry["relevant"]))
+    if not questions:
+        raise ValueError(f"No questions found in '{path}'.")
+    return questions
+
+
+def _normalize(text: str) -> str:
+    return WHITESPACE.sub(" ", text).strip().lower()
+
+
+def _worker_embeddings(fake: bool):
+    global _embeddings
+    if _embeddings is None:
+        _embeddings = DeterministicFakeEmbedding(size=EMBEDDING_SIZE) if fake else get_embeddings()
+    return _embeddings
+
+
+def _build_index(rules_text: str, chunk_size: int, chunk_overlap: int, embeddings):
+    """Splits and indexes the rules the way utils/create_vectorestore.py does, in memory."""
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = {}
+    for chunk in splitter.split_text(rules_text):
+        chunks.setdefault(chunk_id(chunk), chunk)
+    texts = list(chunks.values())
+    vectorstore = FAISS.from_embeddings(
+        list(zip(texts, embeddings.embed_documents(texts))), embeddings, ids=list(chunks)
+    )
+    return vectorstore, LexicalIndex.build(chunks)
+
+
+def _retriever(mode: str, vectorstore, lexical_index, k: int):
+    if mode == "hybrid":
+        return HybridRetriever(
+            vectorstore=vectorstore,
+            lexical_index=lexical_index,
+            k=k,
+            vector_weight=HYBRID_VECTOR_WEIGHT,
+            lexical_shortcut_score=LEXICAL_SHORTCUT_SCORE,
+        )
+    return vectorstore.as_retriever(search_kwargs={"k": k})
+
+
+def evaluate_chunking(game_id: str, chunk_size: int, chunk_overlap: int, k_values: list, modes: list,
+                      questions: list, fake_embeddings: bool = False) -> list:
+    """Indexes one game with one chunking setting and scores every (mode, k) on its questions."""
+    embeddings = _worker_embeddings(fake_embeddings)
+    rules_text = importlib.import_module(f"games.{game_id}").RULES_TEXT
+    started = time.perf_counter()
+    vectorstore, lexical_index = _build_index(rules_text, chunk_size, chunk_overlap, embeddings)
+    build_seconds = time.perf_counter() - started
+
+    rows = []
+    for mode in modes:
+        for k in k_values:
+            retriever = _retriever(mode, vectorstore, lexical_index, k)
+            # The first call pays for lazy initialization; keep it out of the timings
+            retriever.invoke(questions[0][0])
+            recalls, raw_tokens, packed_tokens, latencies = [], [], [], []
+            for question, relevant in questions:
+                started = time.perf_counter()
+                documents = retriever.invoke(question)
+                latencies.append(time.perf_counter() - started)
+                retrieved = [_normalize(doc.page_content) for doc in documents]
+                found = sum(any(_normalize(passage) in text for text in retrieved) for passage in relevant)
+                recalls.append(found / len(relevant))
+                raw_tokens.append(sum(estimate_tokens(doc.page_content) for doc in documents))
+                packed_tokens.append(pack_documents(documents, UNLIMITED_TOKENS)[2])
+            rows.append({
+                "game": game_id,
+                "chunk_size": chunk_size,
+                "chunk_overlap": chunk_overlap,
+                "mode": mode,
+                "k": k,
+                "chunks": vectorstore.index.ntotal,
+                "build_seconds": round(build_seconds, 3),
+                "recall": round(float(np.mean(recalls)), 4),
+                "context_tokens": round(float(np.mean(raw_tokens)), 1),
+                "packed_tokens": round(float(np.mean(packed_tokens)), 1),
+                "latency_p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 2),
+                "latency_p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 2),
+            })
+    return rows
+
+
+def summarize(rows: list) -> list:
+    """Averages the per-game rows of each configuration, weighting every game equally."""
+    configurations = {}
+    for row in rows:
+        key = (row["chunk_size"], row["chunk_overlap"], row["mode"], row["k"])
+        configurations.setdefault(key, []).append(row)
+    summary = []
+    for (chunk_size, chunk_overlap, mode, k), group in sorted(configurations.items()):
+        summary.append({
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "mode": mode,
+            "k": k,
+            **{
+                key: round(float(np.mean([row[key] for row in group])), 4 if key == "recall" else 2)
+                for key in ("recall", "context_tokens", "packed_tokens", "latency_p50_ms", "latency_p95_ms")
+            },
+        })
+    return summary
+
+
+def pick_configuration(summary: list, min_recall: float):
+    """
+    The configuration that sends the LLM the fewest tokens (the main cost in
+    answer latency) while meeting `min_recall`; ties go to faster retrieval.
+    """
+    eligible = [row for row in summary if row["recall"] >= min_recall]
+    if not eligible:
+        return None
+    return min(eligible, key=lambda row: (row["packed_tokens"], row["latency_p50_ms"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweeps chunking and k settings for retrieval quality and cost.")
+    parser.add_argument("--eval-set", default=DEFAULT_EVAL_SET, help="JSONL file of labeled questions.")
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[300, 500, 750, CHUNK_SIZE, 1500])
+    parser.add_argument("--overlaps", type=int, nargs="+", default=[0, CHUNK_OVERLAP])
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 2, 3, 4, 5], help="Numbers of chunks retrieved.")
+    parser.add_argument("--modes", nargs="+", default=["hybrid", "vector"], choices=["hybrid", "vector"])
+    parser.add_argument("--min-recall", type=float, default=0.9, help="Quality floor for the recommendation.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Chunking settings indexed in parallel.")
+    parser.add_argument("--fake-embeddings", action="store_true",
+                        help="Use deterministic fake vectors (checks the pipeline; recall is meaningless).")
+    parser.add_argument("--output", help="Where to write the JSON results (default: benchmarks/results/sweep-<time>.json).")
+    args = parser.parse_args()
+
+    # utils.create_vectorestore configures INFO logging on import; per-query log lines would drown the table
+    logging.getLogger().setLevel(logging.WARNING)
+    questions = load_eval_set(args.eval_set)
+    tasks = [
+        (game_id, chunk_size, chunk_overlap)
+        for game_id in questions
+        for chunk_size in args.chunk_sizes
+        for chunk_overlap in args.overlaps
+        if chunk_overlap < chunk_size
+    ]
+
+    started = time.perf_counter()
+    rows = []
+    # Each worker loads its own copy of the embedding model
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(tasks)))) as executor:
+        futures = [
+            executor.submit(evaluate_chunking, game_id, chunk_size, chunk_overlap, args.k, args.modes,
+                            questions[game_id], args.fake_embeddings)
+            for game_id, chunk_size, chunk_overlap in tasks
+        ]
+        for future in futures:
+            rows.extend(future.result())
+    summary = summarize(rows)
+    best = pick_configuration(summary, args.min_recall)
+
+    print(f"{len(summary)} configuration(s), {sum(len(q) for q in questions.values())} question(s), "
+          f"{time.perf_counter() - started:.1f}s")
+    print(f"{'size':>6} {'overlap':>7} {'mode':>7} {'k':>3} {'recall':>7} {'tokens':>7} {'packed':>7} {'p50 ms':>7} {'p95 ms':>7}")
+    for row in summary:
+        marker = " <" if row is best else ""
+        print(f"{row['chunk_size']:>6} {row['chunk_overlap']:>7} {row['mode']:>7} {row['k']:>3} {row['recall']:>7.2f} "
+              f"{row['context_tokens']:>7.0f} {row['packed_tokens']:>7.0f} {row['latency_p50_ms']:>7.2f} "
+              f"{row['latency_p95_ms']:>7.2f}{marker}")
+    if best is None:
+        print(f"No configuration reaches a recall of {args.min_recall}.")
+    else:
+        print(f"Cheapest configuration with recall >= {args.min_recall}: chunk_size={best['chunk_size']}, "
+              f"chunk_overlap={best['chunk_overlap']}, RETRIEVER_MODE={best['mode']}, RETRIEVER_K={best['k']}.")
+
+    output = args.output or os.path.join(RESULTS_PATH, datetime.now().strftime("sweep-%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"config": vars(args), "summary": summary, "best": best, "rows": rows}, f, indent=2)
+    print(f"Results saved to '{output}'.")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
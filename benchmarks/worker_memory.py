@@ -0,0 +1,115 @@
+"""
+Measures how memory grows with the number of web workers.
+
+Forks 1, 2, 4, ... workers the way WorkerSupervisor does. Each one loads
+what a worker loads after the fork (the embedding model and the default
+game's index and chain) and runs a search, then waits while the parent
+reads every worker's memory from /proc (Linux only). PSS splits shared pages
+between the processes sharing them, so the total PSS is what the workers
+really cost together. The memory-mapped index vectors (vectors.npy) are
+reported separately: their PSS per worker falls as workers are added.
+
+    python -m benchmarks.worker_memory
+    python -m benchmarks.worker_memory --workers 1 2 4 8 --fake-embeddings
+"""
+import gc
+import sys
+import queue
+import argparse
+import multiprocessing
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from benchmarks.fakes import FakeChatModel
+from game_registry import GameRegistry
+from utils.mmap_index import VECTORS_FILE
+
+EMBEDDING_SIZE = 384
+# Seconds a worker may take to load the model and the index
+LOAD_TIMEOUT = 300
+
+
+def memory_kb(pid: int) -> dict:
+    """Rss, Pss and private memory of a process, in kB."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if value.strip().endswith("kB"):
+                fields[name] = int(value.split()[0])
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def mapping_kb(pid: int, suffix: str) -> dict:
+    """Rss and Pss of the process's mappings of files whose path ends with `suffix`, in kB."""
+    totals = {"rss": 0, "pss": 0}
+    in_mapping = False
+    with open(f"/proc/{pid}/smaps") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if not name.isidentifier():
+                # A mapping header: "start-end perms offset dev inode [path]"
+                in_mapping = line.rstrip().endswith(suffix)
+            elif in_mapping and name in ("Rss", "Pss"):
+                totals[name.lower()] += int(value.split()[0])
+    return totals
+
+
+def load_worker(fake_embeddings: bool, results, done):
+    try:
+        embeddings = DeterministicFakeEmbedding(size=EMBEDDING_SIZE) if fake_embeddings else None
+        registry = GameRegistry(embeddings=embeddings, llm=FakeChatModel())
+        registry.get().vectorstore.similarity_search("How do I score points?")
+    except Exception as e:
+        results.put(("error", f"{type(e).__name__}: {e}"))
+        return
+    results.put(("ready", None))
+    done.wait()
+
+
+def measure(workers: int, fake_embeddings: bool) -> list:
+    context = multiprocessing.get_context("fork")
+    done = context.Event()
+    results = context.Queue()
+    processes = [context.Process(target=load_worker, args=(fake_embeddings, results, done)) for _ in range(workers)]
+    gc.freeze()
+    for process in processes:
+        process.start()
+    try:
+        for _ in processes:
+            try:
+                status, error = results.get(timeout=LOAD_TIMEOUT)
+            except queue.Empty:
+                raise SystemExit(f"A worker didn't finish loading within {LOAD_TIMEOUT}s.")
+            if status == "error":
+                raise SystemExit(f"A worker failed to load: {error}")
+        return [{**memory_kb(process.pid), "index": mapping_kb(process.pid, VECTORS_FILE)} for process in processes]
+    finally:
+        done.set()
+        for process in processes:
+            process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reports worker memory for several worker counts.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--fake-embeddings", action="store_true",
+                        help="Use a fake embedding model instead of all-MiniLM-L6-v2.")
+    args = parser.parse_args()
+
+    print(f"{'workers':>7} {'RSS MB/worker':>14} {'private MB/worker':>18} {'total PSS MB':>13} "
+          f"{'index RSS kB/worker':>20} {'index PSS kB/worker':>20}")
+    for workers in args.workers:
+        results = measure(workers, args.fake_embeddings)
+        rss = sum(result["rss"] for result in results) / workers / 1024
+        private = sum(result["private"] for result in results) / workers / 1024
+        pss = sum(result["pss"] for result in results) / 1024
+        index_rss = sum(result["index"]["rss"] for result in results) / workers
+        index_pss = sum(result["index"]["pss"] for result in results) / workers
+        print(f"{workers:>7} {rss:>14.1f} {private:>18.1f} {pss:>13.1f} {index_rss:>20.1f} {index_pss:>20.1f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
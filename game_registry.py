@@ -0,0 +1,212 @@
+import os
+import time
+import asyncio
+import threading
+import logging
+from collections import OrderedDict
+from games import DEFAULT_GAME, GameInfo, discover_games
+from utils.embeddings import get_embeddings
+from utils.embedding_batcher import BatchingEmbeddings
+from utils.startup import startup_stage
+from utils.resilience import ResilientChatModel
+from knowledge_base_manager import (
+    load_vectorstore,
+    get_conversation_chain,
+    create_semantic_cache,
+    create_retriever,
+    create_llm,
+    create_history_summarizer,
+)
+
+logger = logging.getLogger(__name__)
+
+# Loaded game indexes are evicted (least recently used first) above this budget
+GAME_INDEX_MEMORY_BUDGET_MB = float(os.getenv("GAME_INDEX_MEMORY_BUDGET_MB", "256"))
+
+# Concurrent query embeddings are grouped into batches of up to this size...
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "16"))
+# ...waiting at most this long for the batch to fill (0 disables batching)
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+
+# Send one tiny request to the LLM during warm-up, so the first question doesn't pay for the connection
+WARMUP_LLM = os.getenv("WARMUP_LLM", "true").lower() == "true"
+
+
+class GameKnowledgeBase:
+    """Everything needed to answer questions about one loaded game."""
+
+    def __init__(self, info: GameInfo, vectorstore, retriever, rag_chain, semantic_cache):
+        self.info = info
+        self.vectorstore = vectorstore
+        # Also used on its own to show the relevant rules when the LLM can't answer
+        self.retriever = retriever
+        self.rag_chain = rag_chain
+        self.semantic_cache = semantic_cache
+        self.last_used = time.monotonic()
+        self.size_bytes = self._estimate_size()
+
+    def _estimate_size(self) -> int:
+        """Approximate memory held by this game: vectors, chunk text and the answer cache budget."""
+        index = self.vectorstore.index
+        size = index.ntotal * index.d * 4
+        size += sum(len(doc.page_content.encode("utf-8")) for doc in self.vectorstore.docstore._dict.values())
+        if self.semantic_cache is not None:
+            size += self.semantic_cache.max_bytes
+        return size
+
+
+class GameRegistry:
+    """
+    Discovers games and loads each game's index and RAG chain on first use.
+
+    All games share one embedding model, so only the per-game FAISS index,
+    chunk text and answer cache add memory. When the loaded games exceed
+    `memory_budget_bytes`, the least recently used ones are dropped and
+    reloaded from disk the next time they are needed. `embeddings` and `llm`
+    replace the configured models (e.g. with fakes for benchmarks).
+    """
+
+    def __init__(self, memory_budget_bytes: int = int(GAME_INDEX_MEMORY_BUDGET_MB * 1024 * 1024),
+                 default_game: str = DEFAULT_GAME, embeddings=None, llm=None):
+        self.games = discover_games()
+        if default_game not in self.games:
+            raise ValueError(f"Default game '{default_game}' not found under games/.")
+        self.default_game = default_game
+        self.memory_budget_bytes = memory_budget_bytes
+        # Every LLM call (answers, rewrites, summaries) is hedged and behind one circuit breaker
+        self.llm = ResilientChatModel(model=llm or create_llm())
+        self._summarizer = None
+        # Set once the default game is loaded and the models have answered a first request
+        self.ready = asyncio.Event()
+        self._warm_up_task = None
+
+        self._base_embeddings = embeddings
+        self._embeddings = None
+        self._embeddings_lock = threading.Lock()
+        self._loaded = OrderedDict()
+        self._load_locks = {}
+        logger.info(f"Discovered {len(self.games)} game(s): {', '.join(sorted(self.games))}.")
+
+    @property
+    def embeddings(self):
+        """The embedding model shared by every game, created on first use."""
+        with self._embeddings_lock:
+            if self._embeddings is None:
+                embeddings = self._base_embeddings or get_embeddings()
+                if EMBEDDING_BATCH_WAIT_MS > 0:
+                    embeddings = BatchingEmbeddings(embeddings, EMBEDDING_BATCH_MAX_SIZE, EMBEDDING_BATCH_WAIT_MS / 1000)
+                self._embeddings = embeddings
+        return self._embeddings
+
+    @property
+    def summarizer(self):
+        """The chain that compacts old chat history into a summary, created on first use."""
+        if self._summarizer is None:
+            self._summarizer = create_history_summarizer(self.llm)
+        return self._summarizer
+
+    def start_warm_up(self):
+        """Starts loading the default game and warming up the models in the background (once)."""
+        if self._warm_up_task is None:
+            self._warm_up_task = asyncio.get_running_loop().create_task(self.warm_up())
+        return self._warm_up_task
+
+    async def warm_up(self):
+        """Loads the embedding model and the default game, then sends each model a first request."""
+        try:
+            with startup_stage("embedding_model"):
+                await asyncio.to_thread(lambda: self.embeddings)
+            with startup_stage("knowledge_base"):
+                await self.aget()
+            with startup_stage("warmup_embedding"):
+                await self.embeddings.aembed_query("How do I score points?")
+            if WARMUP_LLM:
+                with startup_stage("warmup_llm"):
+                    await self.llm.ainvoke("Reply with OK.")
+        except Exception as e:
+            # Questions then load what they need themselves, as before
+            logger.error(f"Warm-up failed: {e}")
+        finally:
+            self.ready.set()
+
+    def find(self, query: str):
+        """Looks a game up by id or display name, case-insensitively."""
+        query = query.strip().lower()
+        for info in self.games.values():
+            if query in (info.game_id.lower(), info.name.lower()):
+                return info
+        return None
+
+    def is_loaded(self, game_id: str) -> bool:
+        return game_id in self._loaded
+
+    def resolve(self, game_id: str = None) -> str:
+        """Returns the game id to use for a chat's stored game: the default if unset or no longer available."""
+        if game_id is None:
+            return self.default_game
+        if game_id not in self.games:
+            logger.warning(f"Game '{game_id}' no longer exists; using '{self.default_game}' instead.")
+            return self.default_game
+        return game_id
+
+    def get(self, game_id: str = None) -> GameKnowledgeBase:
+        """Returns a game's knowledge base, loading it from disk if needed. Blocking."""
+        game_id = self.resolve(game_id)
+        knowledge_base = self._loaded.get(game_id)
+        if knowledge_base is None:
+            knowledge_base = self._register(self._build(game_id))
+        self._loaded.move_to_end(game_id)
+        knowledge_base.last_used = time.monotonic()
+        return knowledge_base
+
+    async def aget(self, game_id: str = None) -> GameKnowledgeBase:
+        """Async version of get(); loading runs in a thread and happens once per game."""
+        game_id = self.resolve(game_id)
+        if game_id in self._loaded:
+            return self.get(game_id)
+        lock = self._load_locks.setdefault(game_id, asyncio.Lock())
+        async with lock:
+            if game_id not in self._loaded:
+                # Only the disk/model work runs in the thread; bookkeeping stays on the event loop
+                self._register(await asyncio.to_thread(self._build, game_id))
+        return self.get(game_id)
+
+    def _build(self, game_id: str) -> GameKnowledgeBase:
+        info = self.games.get(game_id)
+        if info is None:
+            raise KeyError(f"Unknown game '{game_id}'.")
+
+        started = time.perf_counter()
+        vectorstore = load_vectorstore(game_id, embeddings=self.embeddings)
+        loaded = time.perf_counter()
+        retriever = create_retriever(vectorstore, info.index_path)
+        knowledge_base = GameKnowledgeBase(
+            info,
+            vectorstore,
+            retriever,
+            get_conversation_chain(vectorstore, game_name=info.name, retriever=retriever, llm=self.llm),
+            create_semantic_cache(vectorstore, info.index_path),
+        )
+        logger.info(
+            f"Loaded knowledge base for '{info.name}' ({knowledge_base.size_bytes / 1024:.0f} KiB): "
+            f"index {loaded - started:.2f}s, chain {time.perf_counter() - loaded:.2f}s."
+        )
+        return knowledge_base
+
+    def _register(self, knowledge_base: GameKnowledgeBase) -> GameKnowledgeBase:
+        game_id = knowledge_base.info.game_id
+        self._loaded[game_id] = knowledge_base
+        self._evict(keep=game_id)
+        return knowledge_base
+
+    def _evict(self, keep: str):
+        """Drops least recently used games until the loaded ones fit in the memory budget."""
+        total = sum(kb.size_bytes for kb in self._loaded.values())
+        for game_id in list(self._loaded):
+            if total <= self.memory_budget_bytes:
+                break
+            if game_id == keep:
+                continue
+            evicted = self._loaded.pop(game_id)
+            total -= evicted.size_bytes
+            logger.info(f"Evicted knowledge base for '{evicted.info.name}' to stay within the memory budget.")
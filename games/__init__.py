@@ -0,0 +1,64 @@
+import os
+import ast
+import pkgutil
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Folder holding the pre-built indexes, one sub-folder per game
+FAISS_INDEX_PATH = "faiss_index"
+# Game used by chats that haven't picked one with /game
+DEFAULT_GAME = os.getenv("DEFAULT_GAME", "sea_salt_and_paper")
+
+
+def get_index_path(game_id: str) -> str:
+    """Returns the folder holding a game's FAISS index."""
+    return os.path.join(FAISS_INDEX_PATH, game_id)
+
+
+class GameInfo:
+    """A game found under games/: a module defining RULES_TEXT (and optionally GAME_NAME)."""
+    __slots__ = ("game_id", "name", "module_name")
+
+    def __init__(self, game_id: str, name: str, module_name: str):
+        self.game_id = game_id
+        self.name = name
+        self.module_name = module_name
+
+    @property
+    def index_path(self) -> str:
+        return get_index_path(self.game_id)
+
+
+def _module_names(path: str) -> dict:
+    """Top-level names a module assigns, with their values when they are literals."""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    names = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    try:
+                        names[target.id] = ast.literal_eval(node.value)
+                    except ValueError:
+                        names[target.id] = None
+    return names
+
+
+def discover_games() -> dict:
+    """
+    Finds every game module in this package and returns them by game id (the
+    module name). Modules are parsed rather than imported, so a game's rules
+    text is only loaded once something needs it.
+    """
+    found = {}
+    for module_info in pkgutil.iter_modules(__path__):
+        path = os.path.join(module_info.module_finder.path, module_info.name)
+        path = os.path.join(path, "__init__.py") if module_info.ispkg else f"{path}.py"
+        names = _module_names(path)
+        if "RULES_TEXT" not in names:
+            continue
+        name = names.get("GAME_NAME") or module_info.name.replace("_", " ").title()
+        found[module_info.name] = GameInfo(module_info.name, name, f"{__name__}.{module_info.name}")
+    return found
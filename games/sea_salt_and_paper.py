@@ -1,6 +1,9 @@
 # This file contains the rules for the game "Sea, Salt & Paper".
 # The text has been cleaned, corrected, and reformatted for clarity and optimal AI processing.
 
+# Display name used in prompts and the /game command
+GAME_NAME = "Sea Salt & Paper"
+
 RULES_TEXT = """
 
 ## GAME TITLE
@@ -123,4 +126,59 @@ The Color Bonus is mainly scored when "LAST CHANCE" is called.
     - **2 Mermaids:** Score the bonus for your two most numerous qualifying colors.
     - (And so on for 3 or 4 Mermaids).
 
-"""
\ No newline at end of file
+"""
+# Scoring tables used by /score and /color_bonus (see utils/game_logic.ScoringEngine).
+# Labels are format strings; {n} is the number of cards, pairs or combos scored.
+SCORING_RULES = {
+    # Names players may use for each card (plural, long forms)
+    "aliases": {
+        "crab": "crab", "crabs": "crab",
+        "boat": "boat", "boats": "boat",
+        "fish": "fish",
+        "swimmer": "swimmer",
+        "shark": "shark",
+        "shell": "shell", "shells": "shell",
+        "octopus": "octopus", "octopuses": "octopus",
+        "penguin": "penguin", "penguins": "penguin",
+        "sailor": "sailor", "sailors": "sailor",
+        "lighthouse": "lighthouse",
+        "shoal": "shoal", "shoal of fish": "shoal",
+        "colony": "colony", "penguin colony": "colony",
+        "captain": "captain",
+        "mermaid": "mermaid", "mermaids": "mermaid",
+    },
+    # Number of copies of each card in the 58-card deck (used by /odds)
+    "deck": {
+        "mermaid": 4, "octopus": 5, "shell": 6, "penguin": 3, "sailor": 2,
+        "fish": 7, "boat": 8, "crab": 9, "shark": 5, "swimmer": 5,
+        "lighthouse": 1, "shoal": 1, "colony": 1, "captain": 1,
+    },
+    # Points by number of cards held (index 0 is for 0 cards); extra cards score nothing
+    "collectors": [
+        {"card": "shell", "label": "{n} Shells", "points": [0, 0, 2, 4, 6, 8, 10]},
+        {"card": "octopus", "label": "{n} Octopuses", "points": [0, 0, 3, 6, 9, 12]},
+        {"card": "penguin", "label": "{n} Penguins", "points": [0, 1, 3, 5]},
+        {"card": "sailor", "label": "{n} Sailors", "points": [0, 0, 5]},
+    ],
+    # Points per set: two of the same card, or one of each listed card. `action` is what
+    # playing the pair gets you (used by /hint): pick any card, draw one, steal one, or a new turn.
+    "duos": [
+        {"cards": ["crab"], "label": "{n} pair(s) of Crabs", "points": 1,
+         "name": "Crabs", "action": "pick", "effect": "take any card from a discard pile"},
+        {"cards": ["boat"], "label": "{n} pair(s) of Boats", "points": 1,
+         "name": "Boats", "action": "turn", "effect": "take another full turn"},
+        {"cards": ["fish"], "label": "{n} pair(s) of Fish", "points": 1,
+         "name": "Fish", "action": "draw", "effect": "draw the top card of the deck"},
+        {"cards": ["shark", "swimmer"], "label": "{n} Shark+Swimmer combo(s)", "points": 1,
+         "name": "Shark + Swimmer", "action": "steal", "effect": "steal a random card from an opponent"},
+    ],
+    # Points per `card` for each `target` card held
+    "multipliers": [
+        {"card": "lighthouse", "target": "boat", "label": "Lighthouse + Boats", "points": 1},
+        {"card": "shoal", "target": "fish", "label": "Shoal + Fish", "points": 1},
+        {"card": "colony", "target": "penguin", "label": "Colony + Penguins", "points": 2},
+        {"card": "captain", "target": "sailor", "label": "Captain + Sailors", "points": 3},
+    ],
+    # Each of these cards lets the player score one color group
+    "color_bonus": {"card": "mermaid"},
+}
@@ -1,57 +1,228 @@
 import os
+import re
+import pickle
+import asyncio
 import logging
+import faiss
+import numpy as np
 from dotenv import load_dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
+from langchain.chains import create_history_aware_retriever
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableBranch, RunnableLambda, RunnablePassthrough
+from games import DEFAULT_GAME, FAISS_INDEX_PATH, get_index_path
+from utils.embeddings import get_embeddings
+from utils.semantic_cache import SemanticCache
+from utils.hybrid_retriever import HybridRetriever, LexicalIndex
+from utils.mmap_index import VECTORS_FILE, MmapFlatIndex
+from utils.context_packer import pack_documents
 
 load_dotenv()
 google_api_key = os.getenv("GOOGLE_API_KEY")
 
 logger = logging.getLogger(__name__)
 
-# Define the path to the pre-built index
-FAISS_INDEX_PATH = "faiss_index"
 
-def load_vectorstore():
-    """Loads the pre-built FAISS vector store from the local disk."""
-    logger.info(f"Loading vector store from '{FAISS_INDEX_PATH}'...")
-    if not os.path.exists(FAISS_INDEX_PATH):
+# Semantic answer cache settings (see utils/semantic_cache.py)
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+SEMANTIC_CACHE_MAX_BYTES = int(os.getenv("SEMANTIC_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+
+# Retrieval: "hybrid" fuses BM25 keyword scores with FAISS (needs lexical_index.json), "vector" is FAISS only
+RETRIEVER_MODE = os.getenv("RETRIEVER_MODE", "hybrid").lower()
+RETRIEVER_K = int(os.getenv("RETRIEVER_K", "3"))
+# Weight of the FAISS score in the hybrid score (the BM25 score gets the rest)
+HYBRID_VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", "0.5"))
+# If set, a BM25 score at least this high is answered from keyword hits alone, without embedding the query
+LEXICAL_SHORTCUT_SCORE = float(os.environ["LEXICAL_SHORTCUT_SCORE"]) if os.getenv("LEXICAL_SHORTCUT_SCORE") else None
+
+# Fast path: skip the LLM query rewrite when the question doesn't depend on the chat history
+RAG_FAST_PATH = os.getenv("RAG_FAST_PATH", "true").lower() == "true"
+# A question that doesn't look like a follow-up is still rewritten if it is at
+# least this similar to the user's previous message (it probably continues it).
+FAST_PATH_SIMILARITY_THRESHOLD = float(os.getenv("FAST_PATH_SIMILARITY_THRESHOLD", "0.5"))
+
+# Words and openings that usually mean a question refers back to the conversation
+FOLLOW_UP_PATTERN = re.compile(
+    r"\b(it|its|that|this|these|those|they|them|their|he|she|his|her|one|ones|there|same|else)\b"
+    r"|^\s*(and|but|also|so|what about|how about|then)\b",
+    re.IGNORECASE
+)
+# Very short messages ("and for 3?") are elliptical and need the history to make sense
+FOLLOW_UP_MAX_WORDS = 3
+
+# Tokens of retrieved rules text put in the prompt, after removing the overlap between chunks
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+
+def load_vectorstore(game_id: str = DEFAULT_GAME, embeddings=None):
+    """
+    Loads a game's pre-built FAISS vector store from the local disk.
+
+    The vectors are memory-mapped from vectors.npy (see MmapFlatIndex), so
+    every worker process shares the same pages instead of holding its own
+    copy. Index folders built before vectors.npy existed fall back to
+    reading index.faiss into memory.
+    """
+    index_path = get_index_path(game_id)
+    logger.info(f"Loading vector store from '{index_path}'...")
+    if not os.path.exists(index_path):
         raise FileNotFoundError(
-            f"FAISS index not found at '{FAISS_INDEX_PATH}'. "
+            f"FAISS index not found at '{index_path}'. "
             "Please run 'create_vectorstore.py' first to generate it."
         )
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-    vectorstore = FAISS.load_local(
-        FAISS_INDEX_PATH,
-        embeddings,
-        allow_dangerous_deserialization=True
-    )
+    if embeddings is None:
+        embeddings = get_embeddings()
+    index = MmapFlatIndex.load(index_path)
+    if index is None:
+        logger.warning(f"No {VECTORS_FILE} in '{index_path}'; loading a private copy of index.faiss instead.")
+        index = faiss.read_index(os.path.join(index_path, "index.faiss"))
+    # Same layout as FAISS.save_local: the docstore and the index -> docstore id mapping
+    with open(os.path.join(index_path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    vectorstore = FAISS(embeddings, index, docstore, index_to_docstore_id)
     logger.info("Vector store loaded successfully.")
     return vectorstore
 
-def get_conversation_chain(vectorstore):
+def create_semantic_cache(vectorstore, index_path: str):
+    """Creates the semantic answer cache for a game's vector store, or None if it is disabled."""
+    if not SEMANTIC_CACHE_ENABLED:
+        logger.info("Semantic cache is disabled.")
+        return None
+    return SemanticCache(
+        vectorstore.embeddings,
+        index_path,
+        threshold=SEMANTIC_CACHE_THRESHOLD,
+        max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+        max_bytes=SEMANTIC_CACHE_MAX_BYTES,
+        ttl_seconds=SEMANTIC_CACHE_TTL_SECONDS,
+    )
+
+def create_retriever(vectorstore, index_path: str):
+    """Creates the retriever for a game's vector store: hybrid BM25 + FAISS if possible, FAISS otherwise."""
+    if RETRIEVER_MODE == "hybrid":
+        lexical_index = LexicalIndex.load(index_path)
+        if lexical_index is not None:
+            return HybridRetriever(
+                vectorstore=vectorstore,
+                lexical_index=lexical_index,
+                k=RETRIEVER_K,
+                vector_weight=HYBRID_VECTOR_WEIGHT,
+                lexical_shortcut_score=LEXICAL_SHORTCUT_SCORE,
+            )
+        logger.warning(f"No lexical index in '{index_path}'; falling back to vector-only retrieval.")
+    return vectorstore.as_retriever(search_kwargs={"k": RETRIEVER_K})
+
+def looks_like_follow_up(question: str) -> bool:
+    """Returns True if the question probably can't be understood without the chat history."""
+    return bool(FOLLOW_UP_PATTERN.search(question)) or len(question.split()) <= FOLLOW_UP_MAX_WORDS
+
+def _last_human_message(chat_history):
+    for message in reversed(chat_history):
+        if message.type == "human":
+            return message.content
+    return None
+
+async def choose_retrieval_path(inputs: dict, embeddings, fast_path: bool = True):
     """
-    Creates a sophisticated, history-aware conversational retrieval chain.
+    Decides whether a question can be sent straight to the retriever ("direct")
+    or must first be rewritten by the LLM using the chat history ("rewrite").
+
+    Returns the path and the question's vector: the `question_vector` input
+    if given (it is not embedded again), the one computed for the similarity
+    check, or None, so the retriever can reuse it.
     """
-    llm = ChatGoogleGenerativeAI(
+    question_vector = inputs.get("question_vector")
+    chat_history = inputs.get("chat_history")
+    if not chat_history:
+        return "direct", question_vector
+    if not fast_path:
+        return "rewrite", question_vector
+
+    question = inputs["input"]
+    # Elliptical follow-ups ("and for 3?") share few words with what they refer to, so
+    # similarity says nothing about them: they always need the history
+    if looks_like_follow_up(question):
+        return "rewrite", question_vector
+
+    previous_question = _last_human_message(chat_history)
+    if previous_question is None:
+        return "direct", question_vector
+
+    # A question with no follow-up wording is standalone unless it is close to the last turn
+    if question_vector is None:
+        question_vector, previous_vector = await asyncio.gather(
+            embeddings.aembed_query(question), embeddings.aembed_query(previous_question)
+        )
+    else:
+        previous_vector = await embeddings.aembed_query(previous_question)
+    question_vector, previous_vector = (np.asarray(v, dtype=np.float32) for v in (question_vector, previous_vector))
+    norms = np.linalg.norm(question_vector) * np.linalg.norm(previous_vector)
+    similarity = float(question_vector @ previous_vector / norms) if norms else 0.0
+    return ("rewrite" if similarity >= FAST_PATH_SIMILARITY_THRESHOLD else "direct"), question_vector
+
+def create_llm():
+    """Creates the chat model used for answers, query rewrites and history summaries."""
+    return ChatGoogleGenerativeAI(
         model="gemini-2.5-flash",
         temperature=0.7,
         google_api_key=google_api_key
     )
 
+def create_history_summarizer(llm):
+    """
+    Creates a chain that folds older chat messages into a short running summary.
+    Input: {"summary": previous summary or "", "messages": list of messages}.
+    """
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", "You keep a short running summary of a conversation between a player and a board game rules assistant. "
+                   "Keep the facts that later questions may refer to (cards, numbers, the player's situation). At most 3 sentences."),
+        ("human", "Summary so far:\n{summary}\n\nNew messages:\n{transcript}\n\nWrite the updated summary."),
+    ])
+    to_transcript = RunnableLambda(lambda x: {
+        "summary": x.get("summary") or "(none)",
+        "transcript": "\n".join(
+            f"{'Player' if message.type == 'human' else 'Assistant'}: {message.content}" for message in x["messages"]
+        ),
+    })
+    return to_transcript | prompt | llm.with_config(tags=["stage:summarize"]) | StrOutputParser()
+
+def _pack_context(inputs: dict) -> dict:
+    """Replaces the retrieved documents with their deduplicated, budgeted version."""
+    packed, before, after = pack_documents(inputs["context"], CONTEXT_TOKEN_BUDGET)
+    return {**inputs, "context": packed, "context_tokens": (before, after)}
+
+def get_conversation_chain(vectorstore, game_name: str = "Sea Salt & Paper", fast_path: bool = RAG_FAST_PATH,
+                           retriever=None, llm=None):
+    """
+    Creates a sophisticated, history-aware conversational retrieval chain for one game.
+
+    With `fast_path` enabled, standalone questions skip the LLM query rewrite and
+    go straight to the retriever. The chain output includes `retrieval_path`
+    ("direct" or "rewrite") so callers can see which path each request took.
+    `retriever` defaults to a plain FAISS retriever over `vectorstore`, and
+    `llm` to Gemini. Retrieved chunks are deduplicated and cut to
+    CONTEXT_TOKEN_BUDGET; the output's `context_tokens` holds the token
+    count (before, after). An optional `conversation_summary` input is added
+    to the system prompt, and an optional `question_vector` input (the
+    question's embedding) saves embedding the question again.
+    """
+    llm = llm or create_llm()
+
     # This is the core instruction that defines the bot's personality and behavior.
     system_prompt_template = (
-        "You are a helpful and friendly game master for the card game 'Sea Salt & Paper'. "
+        "You are a helpful and friendly game master for the game '{game_name}'. "
         "Your primary role is to answer players' questions about the game rules based on the provided context. "
         "Answer concisely and clearly. Use markdown for formatting if it helps with clarity (e.g., bullet points for lists).\n\n"
         "BEHAVIOR RULES:\n"
         "- If a user's question is about the game rules, answer it using ONLY the provided context.\n"
-        "- If a user asks a question that is NOT related to the game, politely state that you can only answer questions about 'Sea Salt & Paper'.\n"
+        "- If a user asks a question that is NOT related to the game, politely state that you can only answer questions about '{game_name}'.\n"
         "- If the user says something conversational like 'hello', 'thanks', or 'goodbye', respond in a friendly and natural way without bringing up game rules. For example, if they say 'Thank you', you should say 'You're welcome!' or something similar.\n\n"
+        "{conversation_summary}"
         "CONTEXT:\n{context}"
     )
 
@@ -62,10 +233,11 @@ def get_conversation_chain(vectorstore):
             MessagesPlaceholder("chat_history"),
             ("human", "{input}"),
         ]
-    )
+    ).partial(game_name=game_name, conversation_summary="")
     
     # This chain takes the user's question and the document context and generates an answer.
-    question_answer_chain = create_stuff_documents_chain(llm, prompt)
+    # Stage tags let callbacks (utils.tracing.StageTimer) tell the two LLM calls apart
+    question_answer_chain = create_stuff_documents_chain(llm.with_config(tags=["stage:generate"]), prompt)
 
     # This prompt helps the AI generate a better search query based on conversation history.
     retriever_prompt = ChatPromptTemplate.from_messages([
@@ -74,14 +246,41 @@ def get_conversation_chain(vectorstore):
         ("human", "Given the above conversation, generate a search query to look up information relevant to the conversation.")
     ])
 
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
+    if retriever is None:
+        retriever = vectorstore.as_retriever(search_kwargs={"k": RETRIEVER_K})
     
     # This chain rephrases the user's question to be a better standalone search query.
     history_aware_retriever = create_history_aware_retriever(
-        llm, retriever, retriever_prompt
+        llm.with_config(tags=["stage:rewrite"]), retriever, retriever_prompt
     )
     
+    # Standalone questions are looked up as-is, without the rewrite round trip. A retriever that
+    # accepts `query_vector` (HybridRetriever) reuses the question's vector if one was computed.
+    async def _retrieve_direct(inputs, config):
+        return await retriever.ainvoke(inputs["input"], config, query_vector=inputs.get("question_vector"))
+
+    direct_retriever = RunnableLambda(lambda x, config: retriever.invoke(x["input"], config), afunc=_retrieve_direct)
+    embeddings = vectorstore.embeddings
+
+    async def _choose_path(inputs):
+        path, question_vector = await choose_retrieval_path(inputs, embeddings, fast_path)
+        return {**inputs, "retrieval_path": path, "question_vector": question_vector}
+
+    def _choose_path_sync(inputs):
+        # Sync invocation has no embedding check; only an empty history skips the rewrite.
+        return {**inputs, "retrieval_path": "direct" if not inputs.get("chat_history") else "rewrite"}
+
+    retrieve_documents = RunnableBranch(
+        (lambda x: x["retrieval_path"] == "direct", direct_retriever),
+        history_aware_retriever,
+    )
+
     # This is the final chain that ties everything together.
-    rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
+    retrieve_and_pack = (
+        RunnableLambda(_choose_path_sync, afunc=_choose_path).with_config(run_name="choose_retrieval_path")
+        | RunnablePassthrough.assign(context=retrieve_documents.with_config(run_name="retrieve_documents"))
+        | RunnableLambda(_pack_context).with_config(run_name="pack_context")
+    )
+    rag_chain = retrieve_and_pack.assign(answer=question_answer_chain).with_config(run_name="retrieval_chain")
 
     return rag_chain
\ No newline at end of file
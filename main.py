@@ -1,16 +1,28 @@
+import time
+_import_started = time.perf_counter()
 import os
 import logging
-from knowledge_base_manager import load_vectorstore
+from game_registry import GameRegistry
+from utils.supervisor import WorkerSupervisor
+from utils.tracing import install_log_trace_ids
+from utils.startup import record_stage, startup_stage
 from telegram_handlers import setup_telegram_bot
 from dotenv import load_dotenv
+# Importing LangChain, PTB and friends is a noticeable part of a cold start
+IMPORT_SECONDS = time.perf_counter() - _import_started
 
 load_dotenv()
+# Log lines of sampled requests carry their trace ID
+install_log_trace_ids()
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    format="%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s"
 )
 logger = logging.getLogger(__name__)
 
+# Worker processes serving the webhook port together (1 = serve from this process)
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+
 def main():
     """Initializes and runs the bot."""
     # Get environment variables
@@ -23,14 +35,33 @@ def main():
         logger.error("WEBHOOK_URL environment variable not set!")
         return
 
-    logger.info("Loading knowledge base from disk...")
-    # Load the pre-built vectorstore from the 'faiss_index' folder
-    vectorstore = load_vectorstore()
-    logger.info("Knowledge base is ready.")
+    record_stage("imports", IMPORT_SECONDS)
+    if WEB_WORKERS > 1:
+        run_workers(port, webhook_url)
+        return
+
+    # Only discover the games here; the default game's index and the models load in the
+    # background once the webhook is up (see GameRegistry.warm_up)
+    with startup_stage("registry"):
+        registry = GameRegistry()
 
     logger.info(f"Starting bot on port {port} with webhook URL: {webhook_url}")
-    # Pass the vectorstore, port, and webhook URL to the bot setup
-    setup_telegram_bot(vectorstore, port, webhook_url)
+    # Pass the game registry, port, and webhook URL to the bot setup
+    setup_telegram_bot(registry, port, webhook_url)
+
+def run_workers(port: int, webhook_url: str):
+    """Serves from WEB_WORKERS forked processes, each loading its own models and indexes."""
+    if not os.getenv("PERSISTENCE_PATH"):
+        logger.warning("Running several workers without PERSISTENCE_PATH: a restarted worker forgets its chats' history.")
+
+    def serve(worker_id: int):
+        # Loaded after the fork: model runtimes' thread pools don't survive one
+        registry = GameRegistry()
+        # Every worker serves the port and handles the chats pinned to it; worker 0 registers the webhook
+        setup_telegram_bot(registry, port, webhook_url, worker_id=worker_id, workers=WEB_WORKERS)
+
+    logger.info(f"Starting {WEB_WORKERS} workers on port {port} with webhook URL: {webhook_url}")
+    WorkerSupervisor(WEB_WORKERS, serve).run()
 
 if __name__ == "__main__":
     main()
@@ -1,12 +1,20 @@
+import time
+_import_started = time.perf_counter()
 import os
 import logging
-from knowledge_base_manager import load_vectorstore
+from game_registry import GameRegistry
+from utils.tracing import install_log_trace_ids
+from utils.startup import record_stage, startup_stage
 from telegram_handlers import setup_telegram_bot_local # <-- We will create this new function
+# Importing LangChain, PTB and friends is a noticeable part of a cold start
+IMPORT_SECONDS = time.perf_counter() - _import_started
 
 # Set up logging
+# Log lines of sampled requests carry their trace ID
+install_log_trace_ids()
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    format="%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s"
 )
 logger = logging.getLogger(__name__)
 
@@ -14,12 +22,13 @@ def main_local():
     """Initializes and runs the bot in polling mode for local development."""
     logger.info("Starting bot in LOCAL POLLING mode...")
     
-    logger.info("Loading knowledge base from disk...")
-    vectorstore = load_vectorstore()
-    logger.info("Knowledge base is ready.")
+    record_stage("imports", IMPORT_SECONDS)
+    # The knowledge base loads in the background once polling has started
+    with startup_stage("registry"):
+        registry = GameRegistry()
 
     # Call the new local setup function in telegram_handlers
-    setup_telegram_bot_local(vectorstore)
+    setup_telegram_bot_local(registry)
 
 if __name__ == "__main__":
     main_local()
@@ -1,32 +1,118 @@
 import os
 import re
+import time
+import asyncio
+import functools
 import logging
-from telegram import Update
+from telegram import Update, InlineQueryResultArticle, InputTextMessageContent
 from telegram.constants import ParseMode
 from telegram.ext import (
     Application,
     CommandHandler,
+    InlineQueryHandler,
     MessageHandler,
     ContextTypes,
     filters,
 )
-# New imports for handling conversation history
-from langchain_core.messages import HumanMessage, AIMessage
-from utils.game_logic import calculate_score, calculate_color_bonus
-from knowledge_base_manager import get_conversation_chain
+from utils.game_logic import calculate_score, calculate_color_bonus, get_scoring_engine
+from utils.message_streaming import ProgressiveMessage, render_within_limit
+from utils.concurrency import ChatOrderedUpdateProcessor, LLMWorkerPool, PoolBusyError, SingleFlight
+from utils.persistence import BotData, SQLitePersistence
+from utils.chat_history import HistoryStore
+from utils.outbound import OutboundDispatcher
+from utils.odds import estimate_odds, parse_odds_request
+from utils.score_table import get_score_table, rank_duo_plays
+from utils.tracing import RAG_FALLBACKS, RAG_STAGE_SECONDS, StageTimer, traced_handler
+from utils.webhook_server import serve_webhook
+from utils.context_packer import history_window_start, pack_documents, pack_history
+from utils.resilience import CircuitOpenError
+from knowledge_base_manager import FAISS_INDEX_PATH
+from utils.inline_scoring import INLINE_CACHE_TIME, inline_results, normalize_query
+from utils.intent_router import RULES_INTENT, IntentRouter
 
 logger = logging.getLogger(__name__)
 
+# Stream answers into the "Thinking..." message as they are generated
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "true").lower() == "true"
+# Minimum seconds between two edits of a streamed message (Telegram allows about one per second per chat)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+# Minimum number of new characters before a streamed message is edited again
+STREAM_EDIT_MIN_CHARS = int(os.getenv("STREAM_EDIT_MIN_CHARS", "40"))
+
+# Updates processed at once across all chats (1 = one update at a time, as before)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+# Updates of one chat allowed to run or wait at once; a chat sending more gets BUSY_TEXT for the extra ones
+CHAT_PENDING_LIMIT = int(os.getenv("CHAT_PENDING_LIMIT", "8"))
+# LLM requests running at once, requests allowed to wait for a turn, and how long they may wait
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "4"))
+LLM_QUEUE_LIMIT = int(os.getenv("LLM_QUEUE_LIMIT", "32"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "20"))
+
+# SQLite file shared by all bot processes for chat history and bot data (unset = in memory only)
+PERSISTENCE_PATH = os.getenv("PERSISTENCE_PATH")
+# Seconds between persistence writes
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "1.0"))
+# Seconds a loaded chat is trusted before its stored version is checked again (only other replicas write it)
+PERSISTENCE_REFRESH_TTL = float(os.getenv("PERSISTENCE_REFRESH_TTL", "2.0"))
+
+# Outgoing calls per second (and burst size) allowed per chat and for the whole bot
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1.0"))
+OUTBOUND_CHAT_BURST = float(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+
+# Seconds a rules question asked while the bot warms up is kept, to be answered once it is ready
+WARMUP_WAIT_SECONDS = float(os.getenv("WARMUP_WAIT_SECONDS", "60"))
+
+# Seconds a question may take in total (retrieval and LLM) before the retrieved rules are shown instead
+LLM_REQUEST_DEADLINE = float(os.getenv("LLM_REQUEST_DEADLINE", "25"))
+# Tokens of rules text shown when the LLM can't answer
+FALLBACK_TOKEN_BUDGET = int(os.getenv("FALLBACK_TOKEN_BUDGET", "600"))
+
+# Tokens of recent chat history sent with a question; older exchanges live on in a running summary
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "400"))
+# Chats idle for this long forget their conversation, and all histories together stay under this size
+HISTORY_TTL_SECONDS = float(os.getenv("HISTORY_TTL_SECONDS", str(6 * 60 * 60)))
+HISTORY_MAX_MB = float(os.getenv("HISTORY_MAX_MB", "64"))
+
+# Answer greetings, thanks, off-topic messages and hands of cards without the LLM
+INTENT_ROUTING = os.getenv("INTENT_ROUTING", "true").lower() == "true"
+# How sure the intent router must be before a message skips the RAG chain
+INTENT_MIN_CONFIDENCE = float(os.getenv("INTENT_MIN_CONFIDENCE", "0.9"))
+
+# Replies to messages that don't need the rules
+LOCAL_REPLIES = {
+    "greeting": "Hi! Ask me anything about the rules of {game}, or send me your cards to score them. Use /game to switch games.",
+    "thanks": "You're welcome! Enjoy your game of {game} 🎲",
+    "off_topic": "I can only help with {game}: ask me about its rules, or send me your cards to score them.",
+}
+# Reply when the bot is too busy to take a message (full LLM pool or a chat's backlog at its limit)
+BUSY_TEXT = "⏳ I'm answering a lot of questions right now. Please try again in a moment."
+
 def escape_markdown(text: str) -> str:
     """Escapes special characters for Telegram's MarkdownV2."""
     escape_chars = r'_*[]()~`>#+-=|{}.!'
     return re.sub(f'([{re.escape(escape_chars)}])', r'\\\1', text)
 
+def _outbound(context: ContextTypes.DEFAULT_TYPE):
+    """Returns the rate-limited sender every reply goes through."""
+    return context.application.bot_data["outbound"].bind(context.bot)
+
+async def _reply_busy(application: Application, update: Update):
+    """Tells the user a message was not processed because the bot is overloaded."""
+    if update.effective_message is not None:
+        outbound = application.bot_data["outbound"].bind(application.bot)
+        await outbound.reply_text(update.effective_message, text=BUSY_TEXT)
+
+def _unload_chat(application: Application, chat_id: int, chat_data: dict):
+    """Frees an idle chat's data in memory; persistence reads it again on the chat's next update."""
+    application.persistence.unload_chat_data(chat_id)
+    chat_data.clear()
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Greets the user and tells them the bot is ready."""
-    text = "Hello! I am the Game Master 🤖🎲\nAsk me anything about the rules of the current game or use the /score and /color_bonus commands!"
+    text = "Hello! I am the Game Master 🤖🎲\nAsk me anything about the rules of the current game or use the /score and /color_bonus commands! Use /game to see or change the game."
     escaped_text = escape_markdown(text)
-    await context.bot.send_message(
+    await _outbound(context).send_message(
         chat_id=update.effective_chat.id,
         text=escaped_text,
         parse_mode=ParseMode.MARKDOWN_V2
@@ -34,123 +120,529 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles questions from the user using a history-aware chain."""
-    # Lazy initialization of the RAG chain
-    if "rag_chain" not in context.application.bot_data:
-        vectorstore = context.application.bot_data["vectorstore"]
-        context.application.bot_data["rag_chain"] = get_conversation_chain(vectorstore)
-        logger.info("RAG chain initialized on first use.")
-    
-    rag_chain = context.application.bot_data["rag_chain"]
+    # Greetings, thanks, chatter and hands of cards don't need the chain (or the warm-up)
+    intent_router = context.application.bot_data["intent_router"]
+    if intent_router is not None and await _answer_locally(update, context, intent_router):
+        return
+
+    # The chat's game is loaded on first use and kept until evicted by the registry
+    registry = context.application.bot_data["registry"]
+    if not registry.ready.is_set():
+        # Waiting here would hold the chat's turn and an update slot; the question is queued again once ready
+        text = "🔥 I'm still warming up after a restart. I'll answer in a moment! /score and /color_bonus already work."
+        await _outbound(context).reply_text(update.message, text=escape_markdown(text), parse_mode=ParseMode.MARKDOWN_V2)
+        context.application.create_task(_requeue_when_ready(context, update))
+        return
+    knowledge_base = await registry.aget(context.chat_data.get('game'))
+
+    rag_chain = knowledge_base.rag_chain
     user_question = update.message.text
     
-    # Use context.chat_data to store history for each unique user
-    if 'history' not in context.chat_data:
-        context.chat_data['history'] = []
+    # Each chat's history is a small ring buffer kept in its chat_data
+    history = _history(update, context)
+
+    # Only answers given without prior context are safe to reuse for other chats, and
+    # a follow-up must not get another chat's context-free answer
+    is_standalone = not history
 
-    thinking_message = await context.bot.send_message(
+    # Answer near-duplicates of earlier questions straight from the semantic cache
+    semantic_cache = knowledge_base.semantic_cache
+    question_vector = None
+    if semantic_cache is not None and is_standalone:
+        lookup_started = time.perf_counter()
+        question_vector = await semantic_cache.aembed(user_question)
+        cached_answer = semantic_cache.lookup(question_vector)
+        RAG_STAGE_SECONDS.observe(time.perf_counter() - lookup_started, stage="cache_lookup")
+        if cached_answer is not None:
+            _remember_exchange(update, context, user_question, cached_answer)
+            await _outbound(context).send_message(
+                chat_id=update.effective_chat.id,
+                text=render_within_limit(cached_answer, escape_markdown),
+                parse_mode=ParseMode.MARKDOWN_V2
+            )
+            return
+
+    thinking_message = await _outbound(context).send_message(
         chat_id=update.effective_chat.id,
         text="🤔 Thinking..."
     )
 
+    # Streamed edits go out in the background; the final one is sent once the LLM slot is free
+    progressive_message = ProgressiveMessage(
+        _outbound(context),
+        chat_id=thinking_message.chat_id,
+        message_id=thinking_message.message_id,
+        render=escape_markdown,
+        parse_mode=ParseMode.MARKDOWN_V2,
+        min_interval=STREAM_EDIT_INTERVAL,
+        min_new_chars=STREAM_EDIT_MIN_CHARS
+    )
+
     try:
-        # Invoke the new chain with the user's input and their chat history
-        response = await rag_chain.ainvoke({
+        # Only the most recent exchanges that fit the budget are sent; the summary covers the rest
+        packed_history, history_before, history_after = pack_history(history.messages(), HISTORY_TOKEN_BUDGET)
+        chain_input = {
             "input": user_question,
-            "chat_history": context.chat_data.get('history', [])
-        })
+            "chat_history": packed_history
+        }
+        # The cache lookup already embedded the question; the chain reuses the vector instead of embedding it again
+        if question_vector is not None:
+            chain_input["question_vector"] = question_vector
+        summary = context.chat_data.get('summary')
+        if summary:
+            chain_input["conversation_summary"] = f"Earlier in this conversation: {summary}\n\n"
+        # Times the rewrite, retrieve and generate stages of this request
+        chain_config = {"callbacks": [StageTimer()]}
+
+        async def answer_question():
+            if STREAM_ANSWERS:
+                return await _stream_answer(rag_chain, chain_input, chain_config, progressive_message)
+            # Invoke the new chain with the user's input and their chat history
+            return await rag_chain.ainvoke(chain_input, config=chain_config)
+
+        async def run_chain():
+            # The deadline covers the wait for a slot too: a stuck LLM call or a long queue
+            # must not leave "Thinking..." up forever
+            async with asyncio.timeout(LLM_REQUEST_DEADLINE):
+                # LLM work goes through a bounded pool so one busy moment can't queue up without limit
+                async with context.application.bot_data["llm_pool"].slot():
+                    return await answer_question()
+
+        # The same question asked at the same time (e.g. by players of one group) runs the chain once
+        coalescing_key = _coalescing_key(knowledge_base.info.game_id, chain_input)
+        response, shared = await context.application.bot_data["singleflight"].do(coalescing_key, run_chain)
+        if shared:
+            logger.info("Answered from another chat's in-flight request for the same question.")
+
+        logger.info(f"Answered using the '{response.get('retrieval_path')}' retrieval path.")
+        context_before, context_after = response.get("context_tokens", (0, 0))
+        logger.info(
+            f"Prompt tokens (estimated) before/after packing: history {history_before}/{history_after}, "
+            f"context {context_before}/{context_after}."
+        )
 
         answer = response.get("answer", "I'm not sure how to respond to that.")
         if not answer.strip():
             raise ValueError("Empty response from model")
 
-        # Update the user's chat history with the new exchange
-        context.chat_data['history'].extend([
-            HumanMessage(content=user_question),
-            AIMessage(content=answer)
-        ])
-        
-        # Keep the history from getting too long
-        if len(context.chat_data['history']) > 8:
-            context.chat_data['history'] = context.chat_data['history'][-8:]
-
-        final_text = escape_markdown(str(answer))
-        await context.bot.edit_message_text(
+        _remember_exchange(update, context, user_question, answer)
+        if semantic_cache is not None and is_standalone and not shared:
+            semantic_cache.store(user_question, question_vector, answer)
+
+        # Also cuts the text to Telegram's length limit (a shared answer was streamed to the first asker only)
+        await progressive_message.finish(answer)
+        logger.info(
+            f"Showed answer in {progressive_message.edit_count} edit(s); "
+            f"time to first visible token: {progressive_message.time_to_first_visible}s."
+        )
+    except (asyncio.TimeoutError, CircuitOpenError) as e:
+        progressive_message.cancel()
+        reason = "deadline" if isinstance(e, asyncio.TimeoutError) else "circuit_open"
+        logger.warning(f"No LLM answer ({reason}); showing the retrieved rules instead.")
+        await _show_rules_fallback(context, knowledge_base, user_question, thinking_message, reason)
+    except PoolBusyError:
+        await _outbound(context).edit_message_text(
             chat_id=update.effective_chat.id,
             message_id=thinking_message.message_id,
-            text=final_text,
-            parse_mode=ParseMode.MARKDOWN_V2
+            text=BUSY_TEXT
         )
     except Exception as e:
+        progressive_message.cancel()
         logger.error(f"Error during conversation chain invocation: {e}")
-        await context.bot.edit_message_text(
+        await _outbound(context).edit_message_text(
             chat_id=update.effective_chat.id,
             message_id=thinking_message.message_id,
             text="⚠️ Sorry, I had trouble generating an answer. Please try asking again."
         )
 
+async def _requeue_when_ready(context: ContextTypes.DEFAULT_TYPE, update: Update):
+    """Processes a question asked during warm-up again once the bot is ready, in the background."""
+    try:
+        await asyncio.wait_for(context.application.bot_data["registry"].ready.wait(), WARMUP_WAIT_SECONDS)
+    except asyncio.TimeoutError:
+        text = "🔥 Warming up is taking longer than usual. Please ask me again in a minute!"
+        await _outbound(context).reply_text(update.message, text=escape_markdown(text), parse_mode=ParseMode.MARKDOWN_V2)
+        return
+    await context.application.update_queue.put(update)
+
+async def _show_rules_fallback(context: ContextTypes.DEFAULT_TYPE, knowledge_base, question: str, thinking_message,
+                              reason: str):
+    """Replaces the "Thinking..." message with the rule passages retrieved for the question."""
+    RAG_FALLBACKS.inc(reason=reason)
+    try:
+        documents = await knowledge_base.retriever.ainvoke(question)
+    except Exception as e:
+        logger.error(f"Fallback retrieval failed: {e}")
+        documents = []
+    packed, _, _ = pack_documents(documents, FALLBACK_TOKEN_BUDGET)
+
+    if not packed:
+        text = "⚠️ Sorry, I had trouble generating an answer. Please try asking again."
+    else:
+        intro = (
+            "⏱️ I couldn't finish an answer in time" if reason == "deadline"
+            else "⚠️ I can't reach my AI helper right now"
+        )
+        text = f"{intro}, but these parts of the rules should help:\n\n" + "\n\n---\n\n".join(
+            doc.page_content for doc in packed
+        )
+    # Also cuts the text to Telegram's length limit and waits out edit rate limits
+    progressive_message = ProgressiveMessage(
+        _outbound(context),
+        chat_id=thinking_message.chat_id,
+        message_id=thinking_message.message_id,
+        render=escape_markdown,
+        parse_mode=ParseMode.MARKDOWN_V2
+    )
+    await progressive_message.finish(text)
+
+async def _answer_locally(update: Update, context: ContextTypes.DEFAULT_TYPE, intent_router) -> bool:
+    """Replies to a message the intent router says isn't a rules question; returns whether it did."""
+    info, engine = _scoring_engine(context)
+    intent, _ = intent_router.route(update.message.text, engine)
+    if intent == RULES_INTENT:
+        return False
+    if intent == "score":
+        text, _ = calculate_score(update.message.text, engine, get_score_table(info.game_id))
+    else:
+        text = LOCAL_REPLIES[intent].format(game=info.name)
+    await _outbound(context).reply_text(update.message, text=escape_markdown(text), parse_mode=ParseMode.MARKDOWN_V2)
+    return True
+
+def _coalescing_key(game_id: str, chain_input: dict) -> tuple:
+    """
+    Identifies requests that would get the same answer: the same game and
+    question (ignoring case, spacing and end punctuation), history and
+    summary. The shared call runs with the first asker's history and summary
+    (they also steer the retrieval path), so only requests where those are
+    identical, e.g. both empty, can share it.
+    """
+    question = " ".join(chain_input["input"].lower().split()).rstrip("?!. ")
+    history = tuple((message.type, message.content) for message in chain_input["chat_history"])
+    return game_id, question, history, chain_input.get("conversation_summary", "")
+
+async def _stream_answer(rag_chain, chain_input: dict, chain_config: dict, progressive_message) -> dict:
+    """Streams the chain's answer into the "Thinking..." message and returns the collected response."""
+    response = {}
+    async for chunk in rag_chain.astream(chain_input, config=chain_config):
+        for key, value in chunk.items():
+            if key == "answer":
+                await progressive_message.append(value)
+            else:
+                response[key] = value
+    response["answer"] = progressive_message.text
+    return response
+
+def _history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Returns the chat's history from the store that bounds the memory of all histories."""
+    return context.application.bot_data["history_store"].get(update.effective_chat.id, context.chat_data)
+
+def _remember_exchange(update: Update, context: ContextTypes.DEFAULT_TYPE, question: str, answer: str):
+    """Appends a question/answer pair to the chat history and folds what is no longer sent into the summary."""
+    chat_data = context.chat_data
+    history_store = context.application.bot_data["history_store"]
+    # The first `summarized` messages of the buffer are already in the summary. Whatever falls off the
+    # ring buffer or out of the history budget without being in it yet goes into the summary now
+    summarized = chat_data.get('summarized', 0)
+    dropped = history_store.add_exchange(update.effective_chat.id, chat_data, question, answer)
+    unsummarized = dropped[summarized:]
+    summarized = max(summarized - len(dropped), 0)
+    messages = chat_data['history'].messages()
+    start = history_window_start(messages, HISTORY_TOKEN_BUDGET)
+    unsummarized += messages[summarized:start]
+    chat_data['summarized'] = max(summarized, start)
+    if unsummarized:
+        context.application.create_task(_update_summary(context, update.effective_chat.id, unsummarized))
+
+async def _update_summary(context: ContextTypes.DEFAULT_TYPE, chat_id: int, messages: list):
+    """
+    Folds messages into the chat's running summary, in the background. One
+    update runs per chat at a time; messages arriving meanwhile are folded in
+    by the running one afterwards, so no update overwrites another.
+    """
+    pending = context.application.bot_data["pending_summaries"]
+    if chat_id in pending:
+        pending[chat_id].extend(messages)
+        return
+    pending[chat_id] = list(messages)
+    chat_data = context.chat_data
+    game_id = chat_data.get('game')
+    summarizer = context.application.bot_data["registry"].summarizer
+    try:
+        while pending[chat_id]:
+            messages, pending[chat_id] = pending[chat_id], []
+            try:
+                async with context.application.bot_data["llm_pool"].slot():
+                    summary = await summarizer.ainvoke(
+                        {"summary": chat_data.get('summary', ''), "messages": messages},
+                        config={"callbacks": [StageTimer()]}
+                    )
+            except PoolBusyError:
+                logger.warning("Skipped a history summary update: the LLM pool is busy.")
+                continue
+            except Exception as e:
+                logger.warning(f"Could not update the history summary: {e}")
+                continue
+            # The chat may have switched games while the summary was being written
+            if chat_data.get('game') != game_id:
+                return
+            chat_data['summary'] = summary.strip()
+    finally:
+        del pending[chat_id]
+
+async def game(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Shows the available games, or switches this chat to another game."""
+    registry = context.application.bot_data["registry"]
+    current_game = registry.resolve(context.chat_data.get('game'))
+    requested = update.message.text.partition(' ')[2]
+
+    if not requested:
+        lines = [
+            f"{'▶️' if info.game_id == current_game else '•'} {info.name} ({info.game_id})"
+            for info in sorted(registry.games.values(), key=lambda info: info.name)
+        ]
+        text = "Available games:\n" + "\n".join(lines) + "\n\nSwitch with: /game <name>"
+        await _outbound(context).reply_text(update.message, text=escape_markdown(text), parse_mode=ParseMode.MARKDOWN_V2)
+        return
+
+    info = registry.find(requested)
+    if info is None:
+        text = f"I don't know the game '{requested}'. Send /game to see the list."
+        await _outbound(context).reply_text(update.message, text=escape_markdown(text), parse_mode=ParseMode.MARKDOWN_V2)
+        return
+
+    if info.game_id != current_game:
+        context.chat_data['game'] = info.game_id
+        # The previous conversation was about another game
+        context.application.bot_data["history_store"].forget(update.effective_chat.id, context.chat_data)
+    text = f"Now answering questions about {info.name}!"
+    await _outbound(context).reply_text(update.message, text=escape_markdown(text), parse_mode=ParseMode.MARKDOWN_V2)
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Logs errors."""
     logger.error(f"An error occurred: {context.error}")
 
+def _scoring_engine(context: ContextTypes.DEFAULT_TYPE):
+    """Returns the chat's game and its scoring engine (None if the game has no scoring rules)."""
+    registry = context.application.bot_data["registry"]
+    info = registry.games[registry.resolve(context.chat_data.get('game'))]
+    return info, get_scoring_engine(info.module_name)
+
+async def _reply_no_scoring(update: Update, context: ContextTypes.DEFAULT_TYPE, info):
+    text = f"I can't score {info.name} yet. Ask me about its rules instead!"
+    await _outbound(context).reply_text(update.message, text=escape_markdown(text), parse_mode=ParseMode.MARKDOWN_V2)
+
 async def score(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Calculates the score for a list of cards."""
+    info, engine = _scoring_engine(context)
+    if engine is None:
+        await _reply_no_scoring(update, context, info)
+        return
     user_input = update.message.text.partition(' ')[2]
     if not user_input:
         example_text = "Please list your cards after the command\\. \nExample: `/score 2 crabs, 4 shells`"
-        await update.message.reply_text(text=example_text, parse_mode=ParseMode.MARKDOWN_V2)
+        await _outbound(context).reply_text(update.message, text=example_text, parse_mode=ParseMode.MARKDOWN_V2)
         return
-    response_text, _ = calculate_score(user_input)
+    response_text, _ = calculate_score(user_input, engine, get_score_table(info.game_id))
     escaped_response = escape_markdown(response_text)
-    await update.message.reply_text(text=escaped_response, parse_mode=ParseMode.MARKDOWN_V2)
+    await _outbound(context).reply_text(update.message, text=escaped_response, parse_mode=ParseMode.MARKDOWN_V2)
 
 async def color_bonus(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Calculates the color bonus for a list of cards."""
+    info, engine = _scoring_engine(context)
+    if engine is None or engine.color_bonus_card is None:
+        await _reply_no_scoring(update, context, info)
+        return
     user_input = update.message.text.partition(' ')[2]
     if not user_input:
         example_text = "Please list your cards by color count\\. \nExample: `/color_bonus 4 blue, 3 pink, 1 mermaid`"
-        await update.message.reply_text(text=example_text, parse_mode=ParseMode.MARKDOWN_V2)
+        await _outbound(context).reply_text(update.message, text=example_text, parse_mode=ParseMode.MARKDOWN_V2)
         return
-    response_text = calculate_color_bonus(user_input)
+    response_text = calculate_color_bonus(user_input, engine)
     escaped_response = escape_markdown(response_text)
-    await update.message.reply_text(text=escaped_response, parse_mode=ParseMode.MARKDOWN_V2)
+    await _outbound(context).reply_text(update.message, text=escaped_response, parse_mode=ParseMode.MARKDOWN_V2)
+
+async def odds(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Estimates the win chances of calling STOP or LAST CHANCE with a hand."""
+    info, engine = _scoring_engine(context)
+    if engine is None or engine.deck is None:
+        await _reply_no_scoring(update, context, info)
+        return
+    user_input = update.message.text.partition(' ')[2]
+    if not user_input:
+        example_text = "Please list your cards after the command\\. \nExample: `/odds 2 crabs, 3 shells, 2 boats vs 2 bonus 3`"
+        await _outbound(context).reply_text(update.message, text=example_text, parse_mode=ParseMode.MARKDOWN_V2)
+        return
+
+    try:
+        hand_text, options = parse_odds_request(user_input)
+        # The simulation is CPU-bound, keep it off the event loop
+        result = await asyncio.to_thread(
+            estimate_odds, engine.parse_hand(hand_text), module_name=info.module_name, **options
+        )
+    except ValueError as e:
+        await _outbound(context).reply_text(update.message, text=escape_markdown(str(e)), parse_mode=ParseMode.MARKDOWN_V2)
+        return
+
+    opponents = options.get("opponents", 1)
+    text = (
+        f"Your cards score {result.score} pts. Against {opponents} opponent(s), over {result.samples:,} simulated deals:\n"
+        f"• STOP: yours is the highest score {result.stop_win:.0%} of the time; you score {result.stop_points} pts.\n"
+        f"• LAST CHANCE: you win the bet {result.last_chance_win:.0%} of the time; "
+        f"expected {result.last_chance_points:.1f} pts (color bonus {options.get('color_bonus', 0)})."
+    )
+    if result.score < 7:
+        text += "\n\nYou need at least 7 points to end the round."
+    await _outbound(context).reply_text(update.message, text=escape_markdown(text), parse_mode=ParseMode.MARKDOWN_V2)
 
-def setup_telegram_bot(vectorstore, port: int, webhook_url: str):
-    """Initializes and runs the Telegram bot with webhooks."""
+async def hint(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Suggests which pair to play and which cards to go for."""
+    info, _ = _scoring_engine(context)
+    table = get_score_table(info.game_id)
+    if table is None:
+        await _reply_no_scoring(update, context, info)
+        return
+    user_input = update.message.text.partition(' ')[2]
+    if not user_input:
+        example_text = "Please list your cards after the command\\. \nExample: `/hint 2 crabs, 3 shells, 1 lighthouse`"
+        await _outbound(context).reply_text(update.message, text=example_text, parse_mode=ParseMode.MARKDOWN_V2)
+        return
+
+    card_counts = table.engine.parse_hand(user_input)
+    score_now = table.score(card_counts)
+    if score_now is None:
+        text = "That hand has more copies of a card than the deck does. Check your cards and try again."
+        await _outbound(context).reply_text(update.message, text=escape_markdown(text), parse_mode=ParseMode.MARKDOWN_V2)
+        return
+
+    lines = [f"Your cards score {score_now} pts."]
+    plays = rank_duo_plays(table, card_counts)
+    if plays:
+        lines.append("Pairs you can play:")
+        lines.extend(f"• {rule['name']}: {rule['effect']} (about +{gain:.1f} pts)" for rule, gain in plays)
+        lines.append(f"Best play: {plays[0][0]['name']}.")
+    else:
+        lines.append("You have no pair to play yet.")
+
+    gains = table.gains(card_counts)
+    best_cards = sorted((gain, card) for card, gain in gains.items() if gain > 0)[::-1][:3]
+    if best_cards:
+        lines.append("Cards worth picking up: " + ", ".join(f"{card.title()} (+{gain})" for gain, card in best_cards) + ".")
+    await _outbound(context).reply_text(update.message, text=escape_markdown("\n".join(lines)), parse_mode=ParseMode.MARKDOWN_V2)
+
+async def inline_score(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Scores the hand typed after the bot's name in any chat (e.g. "@bot 2 crabs, 3 shells")."""
+    # Inline queries don't belong to a chat, so they use the default game
+    registry = context.application.bot_data["registry"]
+    info = registry.games[registry.default_game]
+    engine = get_scoring_engine(info.module_name)
+    query = update.inline_query.query
+    if engine is None or not query.strip():
+        await update.inline_query.answer([], cache_time=INLINE_CACHE_TIME)
+        return
+
+    hand, colors = normalize_query(query, engine)
+    results = [
+        InlineQueryResultArticle(
+            id=result_id,
+            title=title,
+            description=description,
+            input_message_content=InputTextMessageContent(escape_markdown(text), parse_mode=ParseMode.MARKDOWN_V2),
+        )
+        for result_id, title, description, text in inline_results(info.module_name, info.game_id, hand, colors)
+    ]
+    # Answered directly: inline answers aren't sent to a chat, so they skip the per-chat outbound queue
+    await update.inline_query.answer(results, cache_time=INLINE_CACHE_TIME)
+
+def build_application(bot_token: str, registry, request=None) -> Application:
+    """Creates the Application with all handlers and shared state registered; `request` replaces the Bot API client."""
+    llm_pool = LLMWorkerPool(LLM_WORKERS, LLM_QUEUE_LIMIT, LLM_QUEUE_TIMEOUT)
+    singleflight = SingleFlight()
+    intent_router = IntentRouter.load(FAISS_INDEX_PATH, INTENT_MIN_CONFIDENCE) if INTENT_ROUTING else None
+    history_store = HistoryStore(ttl_seconds=HISTORY_TTL_SECONDS, max_bytes=int(HISTORY_MAX_MB * 1024 * 1024))
+    pending_summaries = {}
+    outbound = OutboundDispatcher(OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST, OUTBOUND_GLOBAL_RATE, OUTBOUND_GLOBAL_RATE)
+
+    def attach_runtime(application: Application):
+        application.bot_data["registry"] = registry
+        application.bot_data["llm_pool"] = llm_pool
+        application.bot_data["singleflight"] = singleflight
+        application.bot_data["history_store"] = history_store
+        # chat_id -> messages waiting for that chat's running summary update
+        application.bot_data["pending_summaries"] = pending_summaries
+        application.bot_data["intent_router"] = intent_router
+        application.bot_data["outbound"] = outbound
+
+    async def post_init(application: Application):
+        # Loading persisted bot_data replaces the mapping, so attach the runtime objects again
+        attach_runtime(application)
+        # Commands work right away; the RAG stack loads in the background
+        registry.start_warm_up()
+
+    builder = (
+        Application.builder()
+        .token(bot_token)
+        .context_types(ContextTypes(bot_data=BotData))
+        .post_init(post_init)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    if CONCURRENT_UPDATES > 1:
+        # Different chats run in parallel; each chat's messages stay in order
+        builder = builder.concurrent_updates(ChatOrderedUpdateProcessor(CONCURRENT_UPDATES, CHAT_PENDING_LIMIT))
+    if PERSISTENCE_PATH:
+        builder = builder.persistence(
+            SQLitePersistence(PERSISTENCE_PATH, PERSISTENCE_UPDATE_INTERVAL, PERSISTENCE_REFRESH_TTL)
+        )
+    app = builder.build()
+    if isinstance(app.update_processor, ChatOrderedUpdateProcessor):
+        # Updates beyond a chat's backlog limit get the same quick "busy" reply as a full LLM pool
+        app.update_processor.on_drop = functools.partial(_reply_busy, app)
+    if app.persistence is not None:
+        # Chats read from persistence count against the history limits, and idle ones are emptied in
+        # memory only: their stored game and history are read back when they write again
+        app.persistence.on_load = history_store.adopt
+        history_store.on_idle = functools.partial(_unload_chat, app)
+    attach_runtime(app)
+
+    # Every handler is timed and gets a (sampled) trace ID for its log lines
+    app.add_handler(CommandHandler("start", traced_handler("start")(start)))
+    app.add_handler(CommandHandler('score', traced_handler("score")(score)))
+    app.add_handler(CommandHandler('color_bonus', traced_handler("color_bonus")(color_bonus)))
+    app.add_handler(CommandHandler('odds', traced_handler("odds")(odds)))
+    app.add_handler(CommandHandler('hint', traced_handler("hint")(hint)))
+    app.add_handler(CommandHandler('game', traced_handler("game")(game)))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, traced_handler("message")(handle_message)))
+    app.add_handler(InlineQueryHandler(traced_handler("inline_score")(inline_score)))
+    app.add_error_handler(error_handler)
+    return app
+
+def setup_telegram_bot(registry, port: int, webhook_url: str, worker_id: int = 0, workers: int = 1):
+    """Initializes and runs the Telegram bot with webhooks (see serve_webhook for the options)."""
     bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
     if not bot_token:
         raise ValueError("TELEGRAM_BOT_TOKEN environment variable not set!")
 
-    app = Application.builder().token(bot_token).build()
-    app.bot_data["vectorstore"] = vectorstore
-
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler('score', score))
-    app.add_handler(CommandHandler('color_bonus', color_bonus))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-    app.add_error_handler(error_handler)
+    app = build_application(bot_token, registry)
 
     logger.info(f"Starting webhook server on 0.0.0.0:{port}")
-    app.run_webhook(
-        listen="0.0.0.0",
+    # Our own server instead of app.run_webhook, so it can also serve the metrics
+    asyncio.run(serve_webhook(
+        app,
         port=port,
         url_path=bot_token,
-        webhook_url=f"{webhook_url}/{bot_token}"
-    )
+        webhook_url=f"{webhook_url}/{bot_token}",
+        worker_id=worker_id,
+        workers=workers,
+    ))
 
-def setup_telegram_bot_local(vectorstore):
+def setup_telegram_bot_local(registry):
     """Initializes and runs the Telegram bot in polling mode for local development."""
     bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
     if not bot_token:
         raise ValueError("TELEGRAM_BOT_TOKEN environment variable not set!")
 
-    app = Application.builder().token(bot_token).build()
-    app.bot_data["vectorstore"] = vectorstore
-
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler('score', score))
-    app.add_handler(CommandHandler('color_bonus', color_bonus))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-    app.add_error_handler(error_handler)
+    app = build_application(bot_token, registry)
     
     logger.info("Bot is running in polling mode...")
     # This command fetches updates from Telegram directly.
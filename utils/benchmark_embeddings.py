@@ -0,0 +1,88 @@
+"""
+Compares the embedding backends on cold start, query latency, RSS and vector agreement.
+
+Each backend runs in a fresh interpreter so imports and memory are measured from zero:
+
+    python -m utils.benchmark_embeddings
+    python -m utils.benchmark_embeddings --backends onnx --queries 200
+"""
+import sys
+import json
+import argparse
+import subprocess
+import numpy as np
+
+SAMPLE_QUESTIONS = [
+    "How do crabs work?",
+    "What does last chance do?",
+    "How many points are 3 penguins worth?",
+    "What happens if the deck runs out?",
+    "Can I play a shark and a swimmer together?",
+    "How does the color bonus work with two mermaids?",
+]
+
+# Runs inside the child interpreter; prints one JSON line with the measurements.
+CHILD_SCRIPT = """
+import sys, json, time, resource
+start = time.perf_counter()
+from utils.embeddings import get_embeddings
+embeddings = get_embeddings(sys.argv[1])
+loaded = time.perf_counter()
+questions = json.loads(sys.argv[2])
+repeat = int(sys.argv[3])
+first_start = time.perf_counter()
+embeddings.embed_query(questions[0])
+first_done = time.perf_counter()
+query_start = time.perf_counter()
+for i in range(repeat):
+    embeddings.embed_query(questions[i % len(questions)])
+query_done = time.perf_counter()
+print(json.dumps({
+    "startup_seconds": loaded - start,
+    "first_query_ms": (first_done - first_start) * 1000,
+    "mean_query_ms": (query_done - query_start) * 1000 / repeat,
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "torch_imported": "torch" in sys.modules,
+    "vectors": [embeddings.embed_query(q) for q in questions],
+}))
+"""
+
+def run_backend(backend: str, queries: int) -> dict:
+    """Measures one backend in a child process."""
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT, backend, json.dumps(SAMPLE_QUESTIONS), str(queries)],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1] if result.stderr else "failed"}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["huggingface", "onnx"])
+    parser.add_argument("--queries", type=int, default=100, help="Number of timed single-query embeddings.")
+    args = parser.parse_args()
+
+    results = {backend: run_backend(backend, args.queries) for backend in args.backends}
+
+    print(f"{'backend':<12} {'startup s':>10} {'first ms':>9} {'mean ms':>8} {'peak RSS MB':>12} {'torch':>6}")
+    for backend, result in results.items():
+        if "error" in result:
+            print(f"{backend:<12} error: {result['error']}")
+            continue
+        print(
+            f"{backend:<12} {result['startup_seconds']:>10.2f} {result['first_query_ms']:>9.1f} "
+            f"{result['mean_query_ms']:>8.2f} {result['peak_rss_mb']:>12.0f} {str(result['torch_imported']):>6}"
+        )
+
+    # Vectors must agree for the backends to share one FAISS index
+    ok = [backend for backend, result in results.items() if "vectors" in result]
+    for i, first in enumerate(ok):
+        for second in ok[i + 1:]:
+            a = np.asarray(results[first]["vectors"], dtype=np.float32)
+            b = np.asarray(results[second]["vectors"], dtype=np.float32)
+            cosine = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+            print(f"\n{first} vs {second}: min cosine similarity {cosine.min():.5f}, mean {cosine.mean():.5f}")
+
+if __name__ == "__main__":
+    main()
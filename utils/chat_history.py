@@ -0,0 +1,204 @@
+import sys
+import time
+import logging
+from collections import OrderedDict
+from langchain_core.messages import AIMessage, HumanMessage
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Compact role codes, also used for stored chat history
+ROLE_CODES = {"human": "h", "ai": "a"}
+MESSAGE_TYPES = {"h": HumanMessage, "a": AIMessage}
+
+# Messages kept per chat (older ones are folded into the chat's summary)
+HISTORY_MAX_MESSAGES = 8
+# Seconds between two sweeps for idle chats
+EVICT_INTERVAL = 60
+
+HISTORY_CHATS = REGISTRY.gauge("chat_history_chats", "Chats with a conversation history in memory.")
+HISTORY_BYTES = REGISTRY.gauge("chat_history_bytes", "Approximate memory held by chat histories.")
+HISTORY_EVICTIONS = REGISTRY.counter("chat_history_evictions_total", "Chat histories forgotten.", ("reason",))
+
+
+class ChatHistory:
+    """
+    A chat's latest messages, kept in a fixed-size ring buffer.
+
+    Messages are stored as role codes and plain strings; LangChain message
+    objects are only built by `messages()`, when the chain needs them.
+    """
+
+    __slots__ = ("_roles", "_texts", "_start", "_count")
+
+    def __init__(self, capacity: int = HISTORY_MAX_MESSAGES):
+        self._roles = bytearray(capacity)
+        self._texts = [None] * capacity
+        self._start = 0
+        self._count = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self._texts)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, role: str, text: str):
+        """Adds a message ("h" or "a"); returns the (role, text) it pushed out, or None."""
+        capacity = self.capacity
+        dropped = None
+        if self._count == capacity:
+            dropped = (chr(self._roles[self._start]), self._texts[self._start])
+            position = self._start
+            self._start = (self._start + 1) % capacity
+        else:
+            position = (self._start + self._count) % capacity
+            self._count += 1
+        self._roles[position] = ord(role)
+        self._texts[position] = text
+        return dropped
+
+    def add_exchange(self, question: str, answer: str) -> list:
+        """Adds a question and its answer; returns the messages pushed out to make room."""
+        dropped = [self.append("h", question), self.append("a", answer)]
+        return [MESSAGE_TYPES[role](content=text) for role, text in filter(None, dropped)]
+
+    def pairs(self) -> list:
+        """The messages as [role, text] pairs, oldest first."""
+        capacity = self.capacity
+        return [
+            [chr(self._roles[(self._start + i) % capacity]), self._texts[(self._start + i) % capacity]]
+            for i in range(self._count)
+        ]
+
+    def messages(self) -> list:
+        """The messages as LangChain messages, oldest first."""
+        return [MESSAGE_TYPES[role](content=text) for role, text in self.pairs()]
+
+    def clear(self):
+        self._texts = [None] * self.capacity
+        self._start = 0
+        self._count = 0
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the buffer and its strings."""
+        size = sys.getsizeof(self) + sys.getsizeof(self._roles) + sys.getsizeof(self._texts)
+        return size + sum(sys.getsizeof(text) for text in self._texts if text is not None)
+
+    @classmethod
+    def from_pairs(cls, pairs, capacity: int = HISTORY_MAX_MESSAGES) -> "ChatHistory":
+        history = cls(capacity)
+        for role, text in pairs[-capacity:]:
+            history.append(role, text)
+        return history
+
+
+class HistoryStore:
+    """
+    Finds each chat's ChatHistory in its chat_data and bounds their memory.
+
+    Histories of chats idle for `ttl_seconds` are forgotten (checked at most
+    every EVICT_INTERVAL seconds, when a chat is used), and when all
+    histories together exceed `max_bytes` the least recently used chats are
+    forgotten first. Forgetting drops the chat's history and summary, not
+    its other settings; for idle chats `on_idle(chat_id, chat_data)` is
+    called too, so the owner can free the rest of an idle chat's data if it
+    can be read back (see SQLitePersistence.unload_chat_data). Chats loaded
+    from persistence are tracked once passed to `adopt`.
+    """
+
+    def __init__(self, capacity: int = HISTORY_MAX_MESSAGES, ttl_seconds: float = 6 * 60 * 60,
+                 max_bytes: int = 64 * 1024 * 1024, on_idle=None):
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.on_idle = on_idle
+        # chat_id -> [chat_data, last used, size in bytes], least recently used first
+        self._chats = OrderedDict()
+        self._total_bytes = 0
+        self._next_evict_at = time.monotonic() + EVICT_INTERVAL
+
+    def get(self, chat_id: int, chat_data: dict) -> ChatHistory:
+        """Returns the chat's history, creating it (or converting a stored list) if needed."""
+        history = self._history(chat_data)
+        self.touch(chat_id, chat_data)
+        return history
+
+    def add_exchange(self, chat_id: int, chat_data: dict, question: str, answer: str) -> list:
+        """Adds a question and its answer to the chat's history; returns the messages pushed out to make room."""
+        dropped = self._history(chat_data).add_exchange(question, answer)
+        self.touch(chat_id, chat_data)
+        return dropped
+
+    def adopt(self, chat_id: int, chat_data: dict):
+        """Tracks a chat that may already have a history, e.g. one just loaded from persistence."""
+        if chat_data.get("history"):
+            self.get(chat_id, chat_data)
+
+    def _history(self, chat_data: dict) -> ChatHistory:
+        history = chat_data.get("history")
+        if not isinstance(history, ChatHistory):
+            pairs = [[ROLE_CODES.get(m.type, m.type), m.content] for m in history] if history else []
+            history = chat_data["history"] = ChatHistory.from_pairs(pairs, self.capacity)
+        return history
+
+    def touch(self, chat_id: int, chat_data: dict):
+        """Marks the chat as used and updates its size, then enforces the limits."""
+        now = time.monotonic()
+        history = chat_data.get("history")
+        size = history.nbytes if isinstance(history, ChatHistory) else 0
+        entry = self._chats.pop(chat_id, None)
+        if entry is not None:
+            self._total_bytes -= entry[2]
+        self._chats[chat_id] = [chat_data, now, size]
+        self._total_bytes += size
+
+        if now >= self._next_evict_at:
+            self._next_evict_at = now + EVICT_INTERVAL
+            self.evict_idle(now)
+        while self._total_bytes > self.max_bytes and len(self._chats) > 1:
+            self._forget(next(iter(self._chats)), "memory")
+        HISTORY_CHATS.set(len(self._chats))
+        HISTORY_BYTES.set(self._total_bytes)
+
+    def evict_idle(self, now: float = None) -> int:
+        """Forgets the histories of chats idle for longer than the TTL; returns how many."""
+        now = time.monotonic() if now is None else now
+        idle = []
+        for chat_id, (_, last_used, _) in self._chats.items():
+            if now - last_used <= self.ttl_seconds:
+                # Ordered by last use, so every later chat is more recent
+                break
+            idle.append(chat_id)
+        for chat_id in idle:
+            self._forget(chat_id, "idle")
+        if idle:
+            logger.info(f"Forgot the history of {len(idle)} idle chat(s).")
+        HISTORY_CHATS.set(len(self._chats))
+        HISTORY_BYTES.set(self._total_bytes)
+        return len(idle)
+
+    def forget(self, chat_id: int, chat_data: dict):
+        """Drops a chat's history and summary (e.g. when it switches games)."""
+        entry = self._chats.pop(chat_id, None)
+        if entry is not None:
+            self._total_bytes -= entry[2]
+        chat_data.pop("history", None)
+        chat_data.pop("summary", None)
+        chat_data.pop("summarized", None)
+
+    def _forget(self, chat_id: int, reason: str):
+        chat_data = self._chats[chat_id][0]
+        self.forget(chat_id, chat_data)
+        HISTORY_EVICTIONS.inc(reason=reason)
+        if reason == "idle" and self.on_idle is not None:
+            self.on_idle(chat_id, chat_data)
+
+    def __len__(self):
+        return len(self._chats)
+
+    @property
+    def nbytes(self) -> int:
+        return self._total_bytes
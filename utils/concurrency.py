@@ -0,0 +1,182 @@
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+LLM_QUEUE_DEPTH = REGISTRY.gauge("llm_pool_queue_depth", "Requests waiting for an LLM worker slot.")
+LLM_ACTIVE = REGISTRY.gauge("llm_pool_active", "Requests currently holding an LLM worker slot.")
+LLM_QUEUE_WAIT = REGISTRY.histogram("llm_pool_wait_seconds", "Time spent waiting for an LLM worker slot.")
+LLM_REJECTED = REGISTRY.counter("llm_pool_rejected_total", "Requests turned away because the LLM pool was full.", ("reason",))
+UPDATES_DROPPED = REGISTRY.counter(
+    "chat_updates_dropped_total", "Updates dropped because their chat already had too many waiting."
+)
+COALESCED_CALLS = REGISTRY.counter(
+    "singleflight_coalesced_total", "Requests answered by another request's in-flight call instead of their own."
+)
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates from different chats concurrently, one at a time per chat.
+
+    Updates from the same chat wait on that chat's lock (FIFO) before they
+    take one of the `max_concurrent_updates` slots, so handlers that read and
+    write `chat_data` never interleave and a chat flooding the bot only ever
+    holds one slot. At most `max_pending_per_chat` updates of a chat may run
+    or wait; later ones are not processed but passed to `on_drop(update)`
+    (a coroutine function, e.g. one sending a "busy" reply) if it is set.
+    Updates without a chat run without ordering.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_pending_per_chat: int = 8, on_drop=None):
+        super().__init__(max_concurrent_updates)
+        self.max_pending_per_chat = max_pending_per_chat
+        self.on_drop = on_drop
+        self._chat_locks = {}
+
+    async def process_update(self, update, coroutine):
+        chat_id = update.effective_chat.id if isinstance(update, Update) and update.effective_chat else None
+        if chat_id is None:
+            await super().process_update(update, coroutine)
+            return
+
+        # Each entry is [lock, number of updates holding or waiting for it]
+        entry = self._chat_locks.get(chat_id)
+        if entry is None:
+            entry = self._chat_locks[chat_id] = [asyncio.Lock(), 0]
+        if entry[1] >= self.max_pending_per_chat:
+            UPDATES_DROPPED.inc()
+            logger.warning(f"Chat {chat_id} already has {entry[1]} updates pending; dropping update {update.update_id}.")
+            coroutine.close()
+            if self.on_drop is not None:
+                try:
+                    await self.on_drop(update)
+                except Exception as e:
+                    logger.warning(f"Could not tell chat {chat_id} about its dropped update: {e}")
+            return
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            # Forget locks nobody is using, so idle chats don't accumulate
+            if entry[1] == 0:
+                del self._chat_locks[chat_id]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        self._chat_locks.clear()
+
+
+class PoolBusyError(Exception):
+    """Raised when the LLM pool can't take another request."""
+
+
+class LLMWorkerPool:
+    """
+    Bounds how many LLM requests run at once and how many may wait for a turn.
+
+    `slot()` is entered around each LLM call. At most `max_workers` callers
+    hold a slot; up to `max_queue` more wait for one, for at most
+    `max_wait_seconds`. Anyone beyond that gets PoolBusyError right away, so
+    overload turns into a quick "busy" reply instead of growing latency.
+    """
+
+    def __init__(self, max_workers: int = 4, max_queue: int = 32, max_wait_seconds: float = 20.0):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self._semaphore = asyncio.Semaphore(max_workers)
+        self._waiting = 0
+        self._active = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._semaphore.locked() and self._waiting >= self.max_queue:
+            LLM_REJECTED.inc(reason="queue_full")
+            logger.warning(f"LLM pool full ({self._active} active, {self._waiting} queued); rejecting request.")
+            raise PoolBusyError("LLM queue is full")
+
+        started = time.monotonic()
+        self._waiting += 1
+        LLM_QUEUE_DEPTH.set(self._waiting)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_wait_seconds)
+        except asyncio.TimeoutError:
+            LLM_REJECTED.inc(reason="timeout")
+            logger.warning(f"Gave up waiting for an LLM slot after {self.max_wait_seconds}s.")
+            raise PoolBusyError("Timed out waiting for an LLM slot") from None
+        finally:
+            self._waiting -= 1
+            LLM_QUEUE_DEPTH.set(self._waiting)
+        LLM_QUEUE_WAIT.observe(time.monotonic() - started)
+
+        self._active += 1
+        LLM_ACTIVE.set(self._active)
+        try:
+            yield
+        finally:
+            self._active -= 1
+            LLM_ACTIVE.set(self._active)
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        """Returns the current pool occupancy and the wait-time percentiles."""
+        return {
+            "active": self._active,
+            "queued": self._waiting,
+            "wait_p50": LLM_QUEUE_WAIT.percentile(0.5),
+            "wait_p95": LLM_QUEUE_WAIT.percentile(0.95),
+        }
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution.
+
+    The first caller for a key starts `fn()` as a task; callers arriving
+    while it runs wait for the same task and get its result or exception.
+    A waiter that is cancelled only stops waiting; the shared call is
+    cancelled once nobody is waiting for it any more.
+    """
+
+    def __init__(self):
+        # key -> [task, number of callers waiting for it]
+        self._calls = {}
+
+    async def do(self, key, fn):
+        """Returns (result of fn(), whether it was shared with an earlier caller)."""
+        call = self._calls.get(key)
+        shared = call is not None
+        if shared:
+            COALESCED_CALLS.inc()
+        else:
+            call = self._calls[key] = [asyncio.ensure_future(fn()), 0]
+            call[0].add_done_callback(lambda _: self._forget(key, call))
+        call[1] += 1
+        try:
+            return await asyncio.shield(call[0]), shared
+        finally:
+            call[1] -= 1
+            if call[1] == 0 and not call[0].done():
+                # Later callers must not join a call that is being cancelled
+                self._forget(key, call)
+                call[0].cancel()
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def __len__(self):
+        return len(self._calls)
@@ -0,0 +1,99 @@
+import math
+
+# Rough size of a token in characters for English text; good enough for budgeting
+CHARS_PER_TOKEN = 4
+# Shortest repeated text treated as chunk overlap rather than coincidence
+MIN_OVERLAP_CHARS = 20
+# Longest overlap searched for (the splitter's overlap is 150 characters)
+MAX_OVERLAP_CHARS = 400
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate number of LLM tokens in a text."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _overlap(left: str, right: str) -> int:
+    """Length of the longest end of `left` that `right` starts with (0 if shorter than MIN_OVERLAP_CHARS)."""
+    for size in range(min(len(left), len(right), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def remove_overlap(text: str, kept: list) -> str:
+    """Strips from `text` whatever it repeats at the edges of, or entirely within, already kept chunks."""
+    for previous in kept:
+        if text in previous:
+            return ""
+        text = text[_overlap(previous, text):]
+        cut = _overlap(text, previous)
+        if cut:
+            text = text[:-cut]
+    return text.strip()
+
+
+def pack_documents(documents: list, token_budget: int):
+    """
+    Deduplicates retrieved chunks and keeps the most relevant ones that fit
+    in `token_budget`. Documents must be in relevance order. Returns (packed
+    documents, tokens before, tokens after).
+    """
+    before = sum(estimate_tokens(doc.page_content) for doc in documents)
+    kept_texts = []
+    packed = []
+    used = 0
+    for doc in documents:
+        text = remove_overlap(doc.page_content, kept_texts)
+        if not text:
+            continue
+        tokens = estimate_tokens(text)
+        if used + tokens > token_budget:
+            if packed:
+                break
+            # Even the best chunk is too long: keep as much of it as fits
+            text = text[:token_budget * CHARS_PER_TOKEN]
+            tokens = estimate_tokens(text)
+        kept_texts.append(doc.page_content)
+        packed.append(doc.copy(update={"page_content": text}))
+        used += tokens
+    return packed, before, used
+
+
+def history_window_start(messages: list, token_budget: int) -> int:
+    """
+    Index of the oldest message pack_history sends: the most recent whole
+    question/answer pairs that fit in `token_budget`, and at least the latest pair.
+    """
+    used = 0
+    start = len(messages)
+    # Walk back one exchange (human + ai) at a time
+    while start >= 2:
+        tokens = estimate_tokens(messages[start - 2].content) + estimate_tokens(messages[start - 1].content)
+        if used + tokens > token_budget and start < len(messages):
+            break
+        used += tokens
+        start -= 2
+    return start
+
+
+def _truncate(message, token_budget: int):
+    if estimate_tokens(message.content) <= token_budget:
+        return message
+    return message.copy(update={"content": message.content[:max(token_budget, 1) * CHARS_PER_TOKEN - 1].rstrip() + "…"})
+
+
+def pack_history(messages: list, token_budget: int):
+    """
+    Keeps the most recent messages that fit in `token_budget`, always in
+    whole question/answer pairs. The latest pair is always kept, cut down
+    to the budget if it is too long on its own. Returns (messages, tokens
+    before, tokens after).
+    """
+    before = sum(estimate_tokens(message.content) for message in messages)
+    packed = messages[history_window_start(messages, token_budget):]
+    if len(packed) == 2 and sum(estimate_tokens(message.content) for message in packed) > token_budget:
+        # The question gets up to half the budget and the answer the rest
+        question = _truncate(packed[0], token_budget // 2)
+        packed = [question, _truncate(packed[1], token_budget - estimate_tokens(question.content))]
+    return packed, before, sum(estimate_tokens(message.content) for message in packed)
@@ -1,40 +1,170 @@
+import os
+import json
+import hashlib
 import logging
-from langchain_huggingface import HuggingFaceEmbeddings
+import argparse
+import importlib
+from concurrent.futures import ProcessPoolExecutor
 from langchain_community.vectorstores import FAISS
-from langchain.docstore.document import Document
+from langchain_core.embeddings import Embeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from games.sea_salt_and_paper import RULES_TEXT
+from games import DEFAULT_GAME, FAISS_INDEX_PATH, discover_games, get_index_path
+from utils.embeddings import EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND, get_embeddings
+from utils.hybrid_retriever import LEXICAL_INDEX_FILE, LexicalIndex
+from utils.mmap_index import VECTORS_FILE, MmapFlatIndex
+from utils.intent_router import build_intent_model
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Define the folder where the index will be saved
-FAISS_INDEX_PATH = "faiss_index"
+# Records which chunks are in an index and how they were made
+MANIFEST_FILE = "manifest.json"
 
-def create_and_save_knowledge_base():
+# Splitter settings; changing them (or the embedding model) forces a full rebuild
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+# Number of chunks embedded per call
+EMBEDDING_BATCH_SIZE = 64
+
+
+class _LazyEmbeddings(Embeddings):
+    """Loads the embedding model only when something actually needs embedding."""
+
+    def __init__(self):
+        self._embeddings = None
+
+    def _get(self):
+        if self._embeddings is None:
+            # Initialize the embeddings model (this will download it)
+            logger.info("Loading the embedding model. This may take a moment...")
+            self._embeddings = get_embeddings()
+        return self._embeddings
+
+    def embed_documents(self, texts):
+        return self._get().embed_documents(texts)
+
+    def embed_query(self, text):
+        return self._get().embed_query(text)
+
+
+def chunk_id(text: str) -> str:
+    """Content hash used as the chunk's id in the index."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _build_settings() -> dict:
+    return {
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "embedding_model": EMBEDDING_MODEL_NAME,
+    }
+
+def _read_manifest(index_path: str):
+    try:
+        with open(os.path.join(index_path, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _write_manifest(index_path: str, chunk_ids):
+    manifest = {"settings": _build_settings(), "backend": EMBEDDING_BACKEND, "chunks": chunk_ids}
+    with open(os.path.join(index_path, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+def create_and_save_knowledge_base(game_id: str = DEFAULT_GAME, batch_size: int = EMBEDDING_BATCH_SIZE,
+                                   force: bool = False) -> dict:
     """
-    Creates the vector store from the game rules and saves it to disk.
+    Creates or updates a game's vector store from its rules and saves it to disk.
+
+    Chunks are identified by content hash. Only chunks that are not in the
+    existing index get embedded; chunks that disappeared from the rules are
+    deleted. When nothing changed the index on disk is left untouched.
+    Returns the number of added, removed and unchanged chunks.
     """
-    logger.info("Setting up knowledge base for the selected game...")
+    logger.info(f"Setting up knowledge base for '{game_id}'...")
+    rules_text = importlib.import_module(f"games.{game_id}").RULES_TEXT
+    index_path = get_index_path(game_id)
+
+    # 1. Split the rules text into manageable chunks, keyed by content hash
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    chunks = {}
+    for chunk in splitter.split_text(rules_text):
+        chunks.setdefault(chunk_id(chunk), chunk)
+    if not chunks:
+        raise ValueError(f"The rules of '{game_id}' are empty; there is nothing to index.")
+    logger.info(f"Split rules into {len(chunks)} documents.")
+
+    # 2. Reuse the existing index if it was built the same way
+    embeddings = _LazyEmbeddings()
+    manifest = _read_manifest(index_path)
+    vectorstore = None
+    existing_ids = set()
+    if not force and manifest is not None and manifest.get("settings") == _build_settings():
+        vectorstore = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+        existing_ids = set(manifest["chunks"])
+    else:
+        logger.info("No compatible manifest found; building the index from scratch.")
 
-    # 1. Split the rules text into manageable chunks
-    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
-    chunks = splitter.split_text(RULES_TEXT)
-    docs = [Document(page_content=chunk) for chunk in chunks]
-    logger.info(f"Split rules into {len(docs)} documents.")
+    new_ids = [cid for cid in chunks if cid not in existing_ids]
+    removed_ids = [cid for cid in existing_ids if cid not in chunks]
+    stats = {"added": len(new_ids), "removed": len(removed_ids), "unchanged": len(chunks) - len(new_ids)}
 
-    # 2. Initialize the embeddings model (this will download it)
-    logger.info("Loading sentence-transformer model. This may take a moment...")
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+    if vectorstore is not None and not new_ids and not removed_ids:
+        if not os.path.exists(os.path.join(index_path, LEXICAL_INDEX_FILE)):
+            LexicalIndex.from_vectorstore(vectorstore).save(index_path)
+            logger.info("Built the missing lexical index.")
+        if not os.path.exists(os.path.join(index_path, VECTORS_FILE)) and MmapFlatIndex.save(vectorstore.index, index_path):
+            logger.info("Wrote the missing memory-mapped vectors.")
+        logger.info(f"'{game_id}' is up to date; nothing to do.")
+        return stats
 
-    # 3. Create the FAISS vector store from the documents and embeddings
-    logger.info("Creating FAISS vector store...")
-    vectorstore = FAISS.from_documents(docs, embeddings)
+    # 3. Drop chunks that are no longer in the rules
+    if removed_ids:
+        vectorstore.delete(removed_ids)
+        logger.info(f"Removed {len(removed_ids)} outdated chunk(s).")
 
-    # 4. Save the vector store to a local folder
-    vectorstore.save_local(FAISS_INDEX_PATH)
-    logger.info(f"Knowledge base created and saved to '{FAISS_INDEX_PATH}'.")
+    # 4. Embed only the new chunks, a batch at a time
+    for start in range(0, len(new_ids), batch_size):
+        batch_ids = new_ids[start:start + batch_size]
+        texts = [chunks[cid] for cid in batch_ids]
+        text_embeddings = list(zip(texts, embeddings.embed_documents(texts)))
+        if vectorstore is None:
+            vectorstore = FAISS.from_embeddings(text_embeddings, embeddings, ids=batch_ids)
+        else:
+            vectorstore.add_embeddings(text_embeddings, ids=batch_ids)
+        logger.info(f"Embedded {start + len(batch_ids)}/{len(new_ids)} new chunk(s).")
+
+    # 5. Save the vector store, its vectors for memory mapping, its keyword (BM25) index and its manifest to a local folder
+    vectorstore.save_local(index_path)
+    MmapFlatIndex.save(vectorstore.index, index_path)
+    LexicalIndex.from_vectorstore(vectorstore).save(index_path)
+    _write_manifest(index_path, list(chunks))
+    logger.info(f"Knowledge base saved to '{index_path}' ({stats}).")
     logger.info("You can now commit this folder to your repository.")
+    return stats
+
+def build_knowledge_bases(game_ids, workers: int = 1, batch_size: int = EMBEDDING_BATCH_SIZE, force: bool = False):
+    """Builds several games' indexes, in parallel worker processes when `workers` > 1."""
+    if workers <= 1 or len(game_ids) <= 1:
+        return {game_id: create_and_save_knowledge_base(game_id, batch_size, force) for game_id in game_ids}
+
+    # Each worker loads its own copy of the embedding model
+    with ProcessPoolExecutor(max_workers=min(workers, len(game_ids))) as executor:
+        futures = {
+            game_id: executor.submit(create_and_save_knowledge_base, game_id, batch_size, force)
+            for game_id in game_ids
+        }
+        return {game_id: future.result() for game_id, future in futures.items()}
 
 if __name__ == "__main__":
-    create_and_save_knowledge_base()
+    parser = argparse.ArgumentParser(description="Builds or updates the FAISS index of each game.")
+    parser.add_argument("games", nargs="*", help=f"Game ids to build (default: {DEFAULT_GAME}).")
+    parser.add_argument("--all", action="store_true", help="Build every game under games/.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Games built in parallel.")
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE, help="Chunks per embedding call.")
+    parser.add_argument("--force", action="store_true", help="Ignore the manifest and rebuild from scratch.")
+    args = parser.parse_args()
+
+    game_ids = list(discover_games()) if args.all else (args.games or [DEFAULT_GAME])
+    build_knowledge_bases(game_ids, workers=args.workers, batch_size=args.batch_size, force=args.force)
+    # The intent router is shared by every game; it takes milliseconds to train
+    build_intent_model(FAISS_INDEX_PATH)
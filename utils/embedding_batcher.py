@@ -0,0 +1,103 @@
+import time
+import asyncio
+import logging
+from langchain_core.embeddings import Embeddings
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BATCH_SIZE = REGISTRY.histogram(
+    "embedding_batch_size", "Number of queries encoded per embedding call.",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+EMBEDDING_QUEUE_DELAY = REGISTRY.histogram(
+    "embedding_queue_delay_seconds", "Time a query waited before its batch started encoding.",
+    buckets=(0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+EMBEDDING_BATCH_SECONDS = REGISTRY.histogram("embedding_batch_seconds", "Time spent encoding one batch.")
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Groups concurrent `aembed_query` calls into one `embed_documents` call.
+
+    A query waits at most `max_wait` seconds for others to join its batch, or
+    less if `max_batch_size` queries arrive first. Batches are encoded in a
+    worker thread, one at a time; queries arriving while a batch runs are
+    sent together as soon as it finishes. Synchronous calls go straight to
+    the wrapped model.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch_size: int = 16, max_wait: float = 0.005):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending = []
+        self._timer = None
+        self._encoding = False
+        self._encode_task = None
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+    async def aembed_documents(self, texts):
+        return await asyncio.get_running_loop().run_in_executor(None, self.embeddings.embed_documents, texts)
+
+    async def aembed_query(self, text):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future, time.monotonic()))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._dispatch()
+        elif self._timer is None and not self._encoding:
+            self._timer = loop.call_later(self.max_wait, self._dispatch)
+        return await future
+
+    def _dispatch(self):
+        """Sends the queued queries off as one batch (called from the event loop)."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._encoding or not self._pending:
+            # The running batch picks up whatever queued meanwhile when it finishes
+            return
+        batch, self._pending = self._pending[:self.max_batch_size], self._pending[self.max_batch_size:]
+        self._encoding = True
+        self._encode_task = asyncio.get_running_loop().create_task(self._encode(batch))
+
+    async def _encode(self, batch):
+        try:
+            # Queries whose caller gave up don't need encoding
+            batch = [item for item in batch if not item[1].done()]
+            if batch:
+                await self._encode_batch(batch)
+        finally:
+            self._encoding = False
+            self._dispatch()
+
+    async def _encode_batch(self, batch):
+        started = time.monotonic()
+        for _, _, queued_at in batch:
+            EMBEDDING_QUEUE_DELAY.observe(started - queued_at)
+        EMBEDDING_BATCH_SIZE.observe(len(batch))
+
+        try:
+            vectors = await asyncio.get_running_loop().run_in_executor(
+                None, self.embeddings.embed_documents, [text for text, _, _ in batch]
+            )
+        except Exception as e:
+            logger.error(f"Embedding batch of {len(batch)} failed: {e}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            EMBEDDING_BATCH_SECONDS.observe(time.monotonic() - started)
+
+        for (_, future, _), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
@@ -0,0 +1,30 @@
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
+# "huggingface" uses sentence-transformers (pulls in torch); "onnx" runs the same model on onnxruntime.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "huggingface").lower()
+# ONNX backend options (see utils/onnx_embeddings.py)
+ONNX_MODEL_FILE = os.getenv("ONNX_MODEL_FILE", "onnx/model.onnx")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR")
+
+def get_embeddings(backend: str = None):
+    """
+    Returns the all-MiniLM-L6-v2 embeddings for the selected backend.
+
+    Imports are done here so that the ONNX backend never imports torch.
+    """
+    backend = (backend or EMBEDDING_BACKEND).lower()
+    logger.info(f"Using the '{backend}' embedding backend.")
+
+    if backend == "huggingface":
+        from langchain_huggingface import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+    if backend == "onnx":
+        from utils.onnx_embeddings import OnnxMiniLMEmbeddings
+        return OnnxMiniLMEmbeddings(model_file=ONNX_MODEL_FILE, model_dir=ONNX_MODEL_DIR)
+
+    raise ValueError(f"Unknown embedding backend '{backend}'. Use 'huggingface' or 'onnx'.")
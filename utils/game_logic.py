@@ -1,134 +1,252 @@
 # In game_logic.py
 
 import re
+import bisect
+import importlib
+from functools import lru_cache
 from collections import defaultdict
+import numpy as np
 
-# Points for collector cards based on count (index 0 is for 0 cards)
-SHELL_POINTS = [0, 0, 2, 4, 6, 8, 10]
-OCTOPUS_POINTS = [0, 0, 3, 6, 9, 12]
-PENGUIN_POINTS = [0, 1, 3, 5]
-SAILOR_POINTS = [0, 0, 5]
-
-# Canonical names to handle user input variations (plural, typos, etc.)
-CARD_MAP = {
-    "crab": "crab", "crabs": "crab",
-    "boat": "boat", "boats": "boat",
-    "fish": "fish",
-    "swimmer": "swimmer",
-    "shark": "shark",
-    "shell": "shell", "shells": "shell",
-    "octopus": "octopus", "octopuses": "octopus",
-    "penguin": "penguin", "penguins": "penguin",
-    "sailor": "sailor", "sailors": "sailor",
-    "lighthouse": "lighthouse",
-    "shoal": "shoal", "shoal of fish": "shoal",
-    "colony": "colony", "penguin colony": "colony",
-    "captain": "captain",
-}
-
-def calculate_score(card_text: str):
-    """Parses a string of cards and calculates the total score."""
-    card_counts = defaultdict(int)
-    
-    # Simple regex to find "number card_name" patterns
-    pattern = re.compile(r"(\d+)\s+([a-zA-Z\s]+)")
-    matches = pattern.findall(card_text.lower())
+# Game whose scoring rules are used when no engine is given
+DEFAULT_SCORING_MODULE = "games.sea_salt_and_paper"
 
-    if not matches:
+# "number card_name" patterns in /score and /color_bonus messages
+CARD_PATTERN = re.compile(r"(\d+)\s+([a-zA-Z\s]+)")
+COLOR_PATTERN = re.compile(r"(\d+)\s+([a-zA-Z]+)")
+AND_SUFFIX = re.compile(r"\s+and\s*$")
+
+
+class ScoringEngine:
+    """
+    Scores hands from a game's SCORING_RULES table.
+
+    The rules are compiled once into card indexes and lookup tables. A hand
+    can be scored from a {card: count} mapping (`score_hand`, with a
+    breakdown) or many hands at once as rows of a count matrix whose columns
+    follow `cards` (`score_counts`).
+    """
+
+    def __init__(self, rules: dict):
+        self.rules = rules
+        self.aliases = dict(rules.get("aliases", {}))
+        self.collectors = rules.get("collectors", [])
+        self.duos = rules.get("duos", [])
+        self.multipliers = rules.get("multipliers", [])
+        self.color_bonus_card = rules.get("color_bonus", {}).get("card")
+        self.deck = rules.get("deck")
+
+        cards = list(dict.fromkeys(self.aliases.values()))
+        cards.extend(self.deck or ())
+        for rule in self.collectors:
+            cards.append(rule["card"])
+        for rule in self.duos:
+            cards.extend(rule["cards"])
+        for rule in self.multipliers:
+            cards.extend((rule["card"], rule["target"]))
+        self.cards = tuple(dict.fromkeys(cards))
+        self.card_index = {card: i for i, card in enumerate(self.cards)}
+        # Every name a card can be written as, sorted for prefix lookups while a name is being typed
+        self._names = tuple(sorted(set(self.aliases) | set(self.card_index)))
+
+        # Collector tables padded to one matrix; counts are capped at each table's last entry
+        width = max((len(rule["points"]) for rule in self.collectors), default=1)
+        self._collector_columns = np.array([self.card_index[rule["card"]] for rule in self.collectors], dtype=np.intp)
+        self._collector_caps = np.array([len(rule["points"]) - 1 for rule in self.collectors], dtype=np.int64)
+        self._collector_table = np.zeros((len(self.collectors), width), dtype=np.int64)
+        for row, rule in enumerate(self.collectors):
+            self._collector_table[row, :len(rule["points"])] = rule["points"]
+
+        self._duo_columns = [np.array([self.card_index[card] for card in rule["cards"]], dtype=np.intp) for rule in self.duos]
+        self._multiplier_columns = np.array(
+            [(self.card_index[rule["card"]], self.card_index[rule["target"]]) for rule in self.multipliers], dtype=np.intp
+        ).reshape(-1, 2)
+        self._multiplier_points = np.array([rule["points"] for rule in self.multipliers], dtype=np.int64)
+
+    @property
+    def names(self) -> tuple:
+        """Every name a card can be written as (card names and aliases)."""
+        return self._names
+
+    def canonical(self, name: str):
+        """Returns the card a player's name for it refers to, or None."""
+        name = name.strip().lower()
+        return self.aliases.get(name, name if name in self.card_index else None)
+
+    def complete(self, prefix: str):
+        """Returns the card a partly typed name can only refer to, or None."""
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return None
+        start = bisect.bisect_left(self._names, prefix)
+        end = bisect.bisect_left(self._names, prefix + "\x7f")
+        cards = {self.canonical(name) for name in self._names[start:end]}
+        return cards.pop() if len(cards) == 1 else None
+
+    def parse_hand(self, card_text: str, partial: bool = False) -> dict:
+        """
+        Reads "2 crabs, 3 shells" style text into {card: count}; unknown names
+        are ignored. With `partial`, a name that is the start of only one
+        card's name (e.g. "2 cr") counts as that card.
+        """
+        card_counts = defaultdict(int)
+        for count, name in CARD_PATTERN.findall(card_text.lower()):
+            # "2 crabs and 3 shells": the name runs up to the next number
+            name = AND_SUFFIX.sub("", name)
+            card = self.canonical(name) or (self.complete(name) if partial else None)
+            if card:
+                card_counts[card] += int(count)
+        return card_counts
+
+    def score_hand(self, card_counts: dict):
+        """Scores one hand; returns (total, [(label, points), ...]) for the rules the hand touches."""
+        total = 0
+        breakdown = []
+
+        for rule in self.collectors:
+            if rule["card"] in card_counts:
+                count = min(card_counts[rule["card"]], len(rule["points"]) - 1)
+                points = rule["points"][count]
+                total += points
+                breakdown.append((rule["label"].format(n=count), points))
+
+        for rule in self.duos:
+            if not all(card in card_counts for card in rule["cards"]):
+                continue
+            sets = self._sets(rule["cards"], [card_counts[card] for card in rule["cards"]])
+            if sets > 0:
+                points = sets * rule["points"]
+                total += points
+                breakdown.append((rule["label"].format(n=sets), points))
+
+        for rule in self.multipliers:
+            if rule["card"] in card_counts and rule["target"] in card_counts:
+                points = card_counts[rule["card"]] * card_counts[rule["target"]] * rule["points"]
+                total += points
+                breakdown.append((rule["label"], points))
+
+        return total, breakdown
+
+    @staticmethod
+    def _sets(cards: list, counts: list) -> int:
+        """Number of scoring sets: pairs of one card, or one of each of several cards."""
+        return counts[0] // 2 if len(cards) == 1 else min(counts)
+
+    def counts_matrix(self, hands) -> np.ndarray:
+        """Turns {card: count} mappings into a count matrix for score_counts()."""
+        matrix = np.zeros((len(hands), len(self.cards)), dtype=np.int64)
+        for row, hand in enumerate(hands):
+            for card, count in hand.items():
+                matrix[row, self.card_index[card]] = count
+        return matrix
+
+    def score_counts(self, counts: np.ndarray) -> np.ndarray:
+        """Scores every row of an (n_hands, len(cards)) count matrix; returns the totals."""
+        counts = np.asarray(counts, dtype=np.int64)
+        totals = np.zeros(counts.shape[0], dtype=np.int64)
+
+        if len(self.collectors):
+            capped = np.minimum(counts[:, self._collector_columns], self._collector_caps)
+            totals += self._collector_table[np.arange(len(self.collectors)), capped].sum(axis=1)
+
+        for rule, columns in zip(self.duos, self._duo_columns):
+            held = counts[:, columns]
+            sets = held[:, 0] // 2 if len(columns) == 1 else held.min(axis=1)
+            totals += sets * rule["points"]
+
+        if len(self.multipliers):
+            products = counts[:, self._multiplier_columns[:, 0]] * counts[:, self._multiplier_columns[:, 1]]
+            totals += products @ self._multiplier_points
+
+        return totals
+
+    def deck_counts(self) -> np.ndarray:
+        """Copies of each card in the full deck, in `cards` order (None if the rules list no deck)."""
+        if self.deck is None:
+            return None
+        return np.array([self.deck.get(card, 0) for card in self.cards], dtype=np.int64)
+
+    @property
+    def rule_list(self) -> list:
+        """Every scoring rule as (kind, rule), in breakdown order."""
+        return (
+            [("collector", rule) for rule in self.collectors]
+            + [("duo", rule) for rule in self.duos]
+            + [("multiplier", rule) for rule in self.multipliers]
+        )
+
+    @staticmethod
+    def rule_cards(kind: str, rule: dict) -> list:
+        """The cards a rule looks at."""
+        if kind == "collector":
+            return [rule["card"]]
+        if kind == "duo":
+            return list(rule["cards"])
+        return [rule["card"], rule["target"]]
+
+    def score_rules(self, counts: np.ndarray):
+        """
+        Scores every rule separately for each row of a count matrix.
+
+        Returns (points, n), both (n_hands, len(rule_list)): the points each
+        rule gives and the number its label shows (cards counted or sets made).
+        """
+        counts = np.asarray(counts, dtype=np.int64)
+        points = np.zeros((counts.shape[0], len(self.rule_list)), dtype=np.int64)
+        n = np.zeros_like(points)
+        for column, (kind, rule) in enumerate(self.rule_list):
+            held = counts[:, [self.card_index[card] for card in self.rule_cards(kind, rule)]]
+            if kind == "collector":
+                n[:, column] = np.minimum(held[:, 0], len(rule["points"]) - 1)
+                points[:, column] = np.asarray(rule["points"])[n[:, column]]
+            elif kind == "duo":
+                n[:, column] = held[:, 0] // 2 if held.shape[1] == 1 else held.min(axis=1)
+                points[:, column] = n[:, column] * rule["points"]
+            else:
+                points[:, column] = held[:, 0] * held[:, 1] * rule["points"]
+        return points, n
+
+    def color_bonus(self, color_counts: list, key_cards: int):
+        """Scores the largest `key_cards` color groups; returns (total, scored group sizes)."""
+        scored = sorted(color_counts, reverse=True)[:key_cards]
+        return sum(scored), scored
+
+
+@lru_cache(maxsize=None)
+def get_scoring_engine(module_name: str = DEFAULT_SCORING_MODULE):
+    """Returns the engine for a game module's SCORING_RULES, or None if it has none."""
+    rules = getattr(importlib.import_module(module_name), "SCORING_RULES", None)
+    return ScoringEngine(rules) if rules else None
+
+
+def calculate_score(card_text: str, engine: ScoringEngine = None, table=None):
+    """Parses a string of cards and calculates the total score (from the precomputed `table` when given)."""
+    engine = engine or get_scoring_engine()
+    if not CARD_PATTERN.search(card_text.lower()):
         return "Please list your cards in the format: `/score 2 crabs, 3 shells, 1 lighthouse`", {}
 
-    for count, name in matches:
-        name = name.strip()
-        canonical_name = CARD_MAP.get(name)
-        if canonical_name:
-            card_counts[canonical_name] += int(count)
-
-    total_score = 0
-    score_breakdown = []
-
-    # --- Calculate Score ---
-
-    # 1. Collector Cards
-    if "shell" in card_counts:
-        count = min(card_counts["shell"], len(SHELL_POINTS) - 1)
-        points = SHELL_POINTS[count]
-        total_score += points
-        score_breakdown.append(f"{count} Shells: {points} pts")
-
-    if "octopus" in card_counts:
-        count = min(card_counts["octopus"], len(OCTOPUS_POINTS) - 1)
-        points = OCTOPUS_POINTS[count]
-        total_score += points
-        score_breakdown.append(f"{count} Octopuses: {points} pts")
-        
-    if "penguin" in card_counts:
-        count = min(card_counts["penguin"], len(PENGUIN_POINTS) - 1)
-        points = PENGUIN_POINTS[count]
-        total_score += points
-        score_breakdown.append(f"{count} Penguins: {points} pts")
-
-    if "sailor" in card_counts:
-        count = min(card_counts["sailor"], len(SAILOR_POINTS) - 1)
-        points = SAILOR_POINTS[count]
-        total_score += points
-        score_breakdown.append(f"{count} Sailors: {points} pts")
-
-    # 2. Duo Cards (1 point per pair)
-    for card in ["crab", "boat", "fish"]:
-        if card in card_counts:
-            pairs = card_counts[card] // 2
-            if pairs > 0:
-                total_score += pairs
-                score_breakdown.append(f"{pairs} pair(s) of {card.capitalize()}s: {pairs} pts")
-
-    # Shark + Swimmer combo (different from regular pairs)
-    # Shark + Swimmer combo (1 point per combination of different cards)
-    if "shark" in card_counts and "swimmer" in card_counts:
-        combos = min(card_counts["shark"], card_counts["swimmer"])
-        if combos > 0:
-            total_score += combos
-            score_breakdown.append(f"{combos} Shark+Swimmer combo(s): {combos} pts")
-    elif "shark" in card_counts or "swimmer" in card_counts:
-        # If player only has sharks OR swimmers (not both), no points
-        pass
-
-
-    # 3. Multiplier Cards
-    if "lighthouse" in card_counts and "boat" in card_counts:
-        points = card_counts["lighthouse"] * card_counts["boat"]
-        total_score += points
-        score_breakdown.append(f"Lighthouse + Boats: {points} pts")
-
-    if "shoal" in card_counts and "fish" in card_counts:
-        points = card_counts["shoal"] * card_counts["fish"]
-        total_score += points
-        score_breakdown.append(f"Shoal + Fish: {points} pts")
-
-    if "colony" in card_counts and "penguin" in card_counts:
-        points = card_counts["colony"] * card_counts["penguin"] * 2
-        total_score += points
-        score_breakdown.append(f"Colony + Penguins: {points} pts")
-        
-    if "captain" in card_counts and "sailor" in card_counts:
-        points = card_counts["captain"] * card_counts["sailor"] * 3
-        total_score += points
-        score_breakdown.append(f"Captain + Sailors: {points} pts")
+    card_counts = engine.parse_hand(card_text)
+    # The table only covers hands the deck can produce
+    scored = table.score_hand(card_counts) if table is not None else None
+    total_score, score_breakdown = scored or engine.score_hand(card_counts)
+
+    return format_score(total_score, score_breakdown), card_counts
 
-    # --- Format final response ---
+def format_score(total_score: int, score_breakdown: list) -> str:
+    """Writes a score and its breakdown as the bot's reply."""
     if not score_breakdown:
-        return "I couldn't find any scorable cards in your message. Try again! If you were trying to score a mermaid card, do it under /color_bonus. A Mermaid card's only role in scoring is to act as a key that unlocks your ability to claim a color bonus. The points from the bonus come from your colored cards, not from the Mermaid itself.", {}
+        return "I couldn't find any scorable cards in your message. Try again! If you were trying to score a mermaid card, do it under /color_bonus. A Mermaid card's only role in scoring is to act as a key that unlocks your ability to claim a color bonus. The points from the bonus come from your colored cards, not from the Mermaid itself."
         
     response_text = "Here's your score breakdown:\n"
-    response_text += "\n".join(f"• {item}" for item in score_breakdown)
+    response_text += "\n".join(f"• {label}: {points} pts" for label, points in score_breakdown)
     response_text += f"\n\n**Total Score: {total_score}**"
     
-    return response_text, card_counts
+    return response_text
 
-def calculate_color_bonus(card_text: str):
+def calculate_color_bonus(card_text: str, engine: ScoringEngine = None):
     """Parses a string of colors and mermaids to calculate the color bonus."""
-    
-    pattern = re.compile(r"(\d+)\s+([a-zA-Z]+)")
-    matches = pattern.findall(card_text.lower())
+    engine = engine or get_scoring_engine()
+    key_card = engine.color_bonus_card or "mermaid"
+    matches = COLOR_PATTERN.findall(card_text.lower())
 
     if not matches:
         # Return plain text with no backslashes
@@ -139,23 +257,25 @@ def calculate_color_bonus(card_text: str):
 
     for count_str, name in matches:
         count = int(count_str)
-        if "mermaid" in name:
+        if key_card in name:
             mermaid_count = count
         else:
             color_counts.append(count)
     
+    return format_color_bonus(mermaid_count, color_counts, engine)
+
+def format_color_bonus(mermaid_count: int, color_counts: list, engine: ScoringEngine = None) -> str:
+    """Scores the color groups a number of mermaids unlock and writes the bot's reply."""
+    engine = engine or get_scoring_engine()
     if mermaid_count == 0:
         return "You need at least **1 Mermaid** to score a color bonus."
 
-    color_counts.sort(reverse=True)
-    groups_to_score = min(mermaid_count, len(color_counts))
+    total_bonus, final_scores = engine.color_bonus(color_counts, mermaid_count)
+    groups_to_score = len(final_scores)
     
     if groups_to_score == 0:
         return f"You have **{mermaid_count} Mermaid(s)** but no colors listed. Your bonus is 0."
 
-    final_scores = color_counts[:groups_to_score]
-    total_bonus = sum(final_scores)
-
     breakdown = " + ".join(map(str, final_scores))
     # This string now returns plain text with parentheses
     response = (
@@ -164,4 +284,4 @@ def calculate_color_bonus(card_text: str):
         f"**Total Color Bonus: {total_bonus}**"
     )
     
-    return response
\ No newline at end of file
+    return response
@@ -0,0 +1,178 @@
+import os
+import re
+import json
+import math
+import logging
+from collections import Counter
+from typing import Any, List, Optional
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+logger = logging.getLogger(__name__)
+
+# Saved next to index.faiss/index.pkl in each game's index folder
+LEXICAL_INDEX_FILE = "lexical_index.json"
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i if in is it its me my of on or the "
+    "that this to was what when where which who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercases, drops stopwords and folds simple plurals ("crabs" -> "crab", "octopuses" -> "octopus")."""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 4 and token.endswith("uses"):
+            token = token[:-2]
+        elif len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us")):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class LexicalIndex:
+    """A precomputed BM25 inverted index over the chunks of one vector store."""
+
+    def __init__(self, doc_ids: List[str], postings: dict, doc_lengths: List[int], k1: float = 1.5, b: float = 0.75):
+        self.doc_ids = doc_ids
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.avg_doc_length = sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0.0
+        count = len(doc_ids)
+        self.idf = {
+            term: math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in postings.items()
+        }
+
+    @classmethod
+    def build(cls, documents: dict) -> "LexicalIndex":
+        """Builds the index from a {docstore id: text} mapping."""
+        doc_ids, doc_lengths, postings = [], [], {}
+        for position, (doc_id, text) in enumerate(documents.items()):
+            tokens = tokenize(text)
+            doc_ids.append(doc_id)
+            doc_lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                postings.setdefault(term, []).append([position, frequency])
+        return cls(doc_ids, postings, doc_lengths)
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore) -> "LexicalIndex":
+        """Builds the index over every chunk in a FAISS vector store."""
+        return cls.build({
+            doc_id: vectorstore.docstore.search(doc_id).page_content
+            for doc_id in vectorstore.index_to_docstore_id.values()
+        })
+
+    def save(self, index_path: str):
+        with open(os.path.join(index_path, LEXICAL_INDEX_FILE), "w") as f:
+            json.dump({"doc_ids": self.doc_ids, "doc_lengths": self.doc_lengths, "postings": self.postings}, f)
+
+    @classmethod
+    def load(cls, index_path: str) -> Optional["LexicalIndex"]:
+        """Loads the index saved in a game's index folder, or returns None if there is none."""
+        try:
+            with open(os.path.join(index_path, LEXICAL_INDEX_FILE)) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        return cls(data["doc_ids"], data["postings"], data["doc_lengths"])
+
+    def search(self, query: str, k: int):
+        """Returns up to k (docstore id, BM25 score) pairs, best first."""
+        scores = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for position, frequency in self.postings[term]:
+                length_norm = 1 - self.b + self.b * self.doc_lengths[position] / (self.avg_doc_length or 1)
+                score = idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+                scores[position] = scores.get(position, 0.0) + score
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.doc_ids[position], score) for position, score in best]
+
+
+def _min_max(scores: dict) -> dict:
+    if not scores:
+        return {}
+    low, high = min(scores.values()), max(scores.values())
+    if high == low:
+        return {key: 1.0 for key in scores}
+    return {key: (value - low) / (high - low) for key, value in scores.items()}
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Fuses BM25 keyword scores with FAISS similarity scores.
+
+    Both score lists are min-max normalized over the candidates and combined as
+    `vector_weight * dense + (1 - vector_weight) * lexical`. If
+    `lexical_shortcut_score` is set and the best BM25 score reaches it, the
+    lexical hits are returned directly and the query is never embedded.
+    A `query_vector` passed to invoke() is used instead of embedding the query.
+    """
+
+    vectorstore: VectorStore
+    lexical_index: Any
+    k: int = 3
+    fetch_k: int = 10
+    vector_weight: float = 0.5
+    lexical_shortcut_score: Optional[float] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _lexical_candidates(self, query: str):
+        hits = self.lexical_index.search(query, self.fetch_k)
+        if self.lexical_shortcut_score is not None and hits and hits[0][1] >= self.lexical_shortcut_score:
+            logger.info(f"Lexical shortcut taken (BM25 {hits[0][1]:.2f}); skipping the embedding call.")
+            return hits, True
+        return hits, False
+
+    def _fuse(self, lexical_hits, dense_hits) -> List[Document]:
+        lexical = _min_max(dict(lexical_hits))
+        # FAISS returns L2 distances; a smaller distance means a better match
+        dense = _min_max({doc_id: -distance for doc_id, distance in dense_hits})
+        fused = {
+            doc_id: self.vector_weight * dense.get(doc_id, 0.0) + (1 - self.vector_weight) * lexical.get(doc_id, 0.0)
+            for doc_id in set(lexical) | set(dense)
+        }
+        best = sorted(fused, key=fused.get, reverse=True)[:self.k]
+        return [self.vectorstore.docstore.search(doc_id) for doc_id in best]
+
+    def _dense_hits(self, query_vector) -> list:
+        """Searches the FAISS index directly so hits come back with their docstore ids."""
+        distances, positions = self.vectorstore.index.search(np.asarray([query_vector], dtype=np.float32), self.fetch_k)
+        return [
+            (self.vectorstore.index_to_docstore_id[position], float(distance))
+            for distance, position in zip(distances[0], positions[0])
+            if position != -1
+        ]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+                                query_vector=None) -> List[Document]:
+        lexical_hits, shortcut = self._lexical_candidates(query)
+        if shortcut:
+            return [self.vectorstore.docstore.search(doc_id) for doc_id, _ in lexical_hits[:self.k]]
+        if query_vector is None:
+            query_vector = self.vectorstore.embeddings.embed_query(query)
+        return self._fuse(lexical_hits, self._dense_hits(query_vector))
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun,
+                                       query_vector=None) -> List[Document]:
+        lexical_hits, shortcut = self._lexical_candidates(query)
+        if shortcut:
+            return [self.vectorstore.docstore.search(doc_id) for doc_id, _ in lexical_hits[:self.k]]
+        if query_vector is None:
+            query_vector = await self.vectorstore.embeddings.aembed_query(query)
+        return self._fuse(lexical_hits, self._dense_hits(query_vector))
@@ -0,0 +1,63 @@
+import os
+from functools import lru_cache
+from utils.game_logic import COLOR_PATTERN, format_score, format_color_bonus, get_scoring_engine
+from utils.score_table import get_score_table
+
+# Distinct hands whose inline results are kept (queries arrive on every keystroke)
+INLINE_CACHE_SIZE = int(os.getenv("INLINE_CACHE_SIZE", "4096"))
+# Seconds Telegram may reuse an inline answer for the same query text
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))
+
+
+def normalize_query(text: str, engine):
+    """
+    Reduces an inline query to what its results depend on: the hand as sorted
+    (card, count) pairs and, if the color bonus card is mentioned, its count
+    plus the color group sizes. Partly typed card names are completed.
+    """
+    hand = tuple(sorted(
+        (card, count) for card, count in engine.parse_hand(text, partial=True).items()
+        if card != engine.color_bonus_card
+    ))
+    colors = None
+    if engine.color_bonus_card is not None:
+        key_cards = 0
+        color_counts = []
+        for count, name in COLOR_PATTERN.findall(text.lower()):
+            card = engine.canonical(name) or engine.complete(name)
+            if card == engine.color_bonus_card:
+                key_cards += int(count)
+            elif card is None:
+                color_counts.append(int(count))
+        if key_cards:
+            colors = (key_cards, tuple(sorted(color_counts, reverse=True)))
+    return hand, colors
+
+
+@lru_cache(maxsize=INLINE_CACHE_SIZE)
+def inline_results(module_name: str, game_id: str, hand: tuple, colors: tuple) -> tuple:
+    """Returns the (id, title, description, text) results for a normalized query."""
+    engine = get_scoring_engine(module_name)
+    results = []
+    if hand:
+        card_counts = dict(hand)
+        table = get_score_table(game_id)
+        # The table only covers hands the deck can produce
+        total, breakdown = (table.score_hand(card_counts) if table is not None else None) or engine.score_hand(card_counts)
+        cards = ", ".join(f"{count} {card}" for card, count in hand)
+        results.append((
+            "score",
+            f"Score: {total} pts",
+            ", ".join(f"{label}: {points}" for label, points in breakdown) or cards,
+            f"{cards}\n\n" + format_score(total, breakdown),
+        ))
+    if colors:
+        key_cards, color_counts = colors
+        total, _ = engine.color_bonus(list(color_counts), key_cards)
+        results.append((
+            "color_bonus",
+            f"Color bonus: {total} pts",
+            f"{key_cards} {engine.color_bonus_card}(s), color groups {', '.join(map(str, color_counts)) or 'none'}",
+            format_color_bonus(key_cards, list(color_counts), engine),
+        ))
+    return tuple(results)
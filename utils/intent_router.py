@@ -0,0 +1,224 @@
+import os
+import re
+import json
+import math
+import time
+import hashlib
+import logging
+from functools import lru_cache
+from collections import Counter
+from typing import Optional
+from utils.metrics import REGISTRY
+from utils.tracing import RAG_STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Saved at the top of faiss_index/, next to the games' index folders
+INTENT_MODEL_FILE = "intent_router.json"
+# Labeled messages the model is trained on; card names are written as {card}
+INTENT_EXAMPLES_PATH = os.path.join(os.path.dirname(__file__), "intent_examples.jsonl")
+# The intent of everything that should go to the RAG chain
+RULES_INTENT = "rules"
+
+TOKEN_PATTERN = re.compile(r"\{card\}|[a-z0-9']+")
+CLAUSE_PATTERN = re.compile(r"[,.;:!?]+")
+CARD_TOKEN = "<card>"
+NUMBER_TOKEN = "<n>"
+
+# A clause starting with one of these, or ending in "?", is a question
+QUESTION_WORDS = frozenset((
+    "what", "what's", "whats", "how", "why", "when", "where", "who", "which", "can", "could", "should", "is",
+    "are", "do", "does", "did", "will", "would", "may", "must",
+))
+# Words that make a question about the game rather than chatter (card names count too)
+GAME_WORDS = frozenset((
+    "game", "games", "turn", "turns", "round", "rounds", "rule", "rules", "strategy", "tactic", "tactics",
+    "card", "cards", "deck", "pile", "piles", "discard", "draw", "hand", "score", "scoring", "points", "point",
+    "win", "winning", "lose", "play", "playing", "player", "players", "stop", "chance", "bonus", "duo", "duos",
+    "collector", "multiplier", "setup", "fun",
+))
+
+INTENT_ROUTES = REGISTRY.counter("intent_routes_total", "Messages by the intent they were routed to.", ("intent",))
+
+
+def features(text: str, engine=None) -> list:
+    """Words and word pairs of a message, with numbers and the game's card names generalized."""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token == "{card}" or (engine is not None and engine.canonical(token)):
+            token = CARD_TOKEN
+        elif token.isdigit():
+            token = NUMBER_TOKEN
+        tokens.append(token)
+    return tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+
+
+def load_examples(path: str = INTENT_EXAMPLES_PATH) -> list:
+    """Reads {"intent", "text"} lines into (intent, text) pairs, skipping blank lines."""
+    with open(path, encoding="utf-8") as f:
+        return [(entry["intent"], entry["text"]) for entry in (json.loads(line) for line in f if line.strip())]
+
+
+def examples_hash(path: str = INTENT_EXAMPLES_PATH) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class IntentModel:
+    """A multinomial naive Bayes classifier over the features of short messages."""
+
+    def __init__(self, log_priors: dict, log_likelihoods: dict, examples_sha: str = None, words: dict = None):
+        self.log_priors = log_priors
+        self.log_likelihoods = log_likelihoods
+        self.examples_sha = examples_sha
+        # intent -> the words its examples use
+        self.words = {intent: set(intent_words) for intent, intent_words in (words or {}).items()}
+
+    @classmethod
+    def train(cls, examples: list, alpha: float = 0.1, examples_sha: str = None) -> "IntentModel":
+        """Trains on (intent, text) pairs with Laplace smoothing `alpha`."""
+        counts = {}
+        for intent, text in examples:
+            counts.setdefault(intent, Counter()).update(features(text))
+        vocabulary = set().union(*counts.values())
+        log_priors, log_likelihoods, words = {}, {}, {}
+        for intent, feature_counts in counts.items():
+            # Every intent is equally likely up front, however many examples it has
+            log_priors[intent] = -math.log(len(counts))
+            denominator = sum(feature_counts.values()) + alpha * len(vocabulary)
+            log_likelihoods[intent] = {
+                feature: math.log((feature_counts[feature] + alpha) / denominator) for feature in vocabulary
+            }
+            words[intent] = sorted(feature for feature in feature_counts if " " not in feature)
+        return cls(log_priors, log_likelihoods, examples_sha, words)
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump({
+                "examples_sha": self.examples_sha,
+                "log_priors": self.log_priors,
+                "log_likelihoods": self.log_likelihoods,
+                "words": {intent: sorted(intent_words) for intent, intent_words in self.words.items()},
+            }, f)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["IntentModel"]:
+        """Loads a saved model, or returns None if there is none."""
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        return cls(data["log_priors"], data["log_likelihoods"], data.get("examples_sha"), data.get("words"))
+
+    def classify(self, text: str, engine=None):
+        """Returns the most likely intent and its probability. Words never seen in training are ignored."""
+        scores = dict(self.log_priors)
+        for feature in features(text, engine):
+            for intent, likelihoods in self.log_likelihoods.items():
+                score = likelihoods.get(feature)
+                if score is not None:
+                    scores[intent] += score
+        best = max(scores, key=scores.get)
+        total = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1.0 / total
+
+
+def leave_one_out_accuracy(examples: list) -> float:
+    """Share of the examples classified correctly by a model trained on all the others."""
+    correct = 0
+    for i, (intent, text) in enumerate(examples):
+        model = IntentModel.train(examples[:i] + examples[i + 1:])
+        correct += model.classify(text)[0] == intent
+    return correct / len(examples)
+
+
+def build_intent_model(index_root: str, examples_path: str = INTENT_EXAMPLES_PATH) -> IntentModel:
+    """Trains the intent model on the labeled examples and saves it in the index folder."""
+    examples = load_examples(examples_path)
+    model = IntentModel.train(examples, examples_sha=examples_hash(examples_path))
+    os.makedirs(index_root, exist_ok=True)
+    model.save(os.path.join(index_root, INTENT_MODEL_FILE))
+    logger.info(
+        f"Intent model trained on {len(examples)} examples "
+        f"(leave-one-out accuracy {leave_one_out_accuracy(examples):.0%}) and saved to '{index_root}'."
+    )
+    return model
+
+
+class IntentRouter:
+    """
+    Decides whether a message needs the RAG chain.
+
+    Greetings, thanks, off-topic chatter and hands of cards can be answered
+    locally. Anything the model isn't at least `min_confidence` sure about
+    is treated as a rules question, and so is:
+
+    - a "hand" that is more than a list of the game's cards with the words
+      of the score examples around it ("2 crabs, 3 shells, can I stop?"),
+    - a greeting, thanks or off-topic message that asks a question about
+      the game ("Is it my turn?") or has a clause that reads otherwise
+      ("Hi! What does a shark do?").
+    """
+
+    def __init__(self, model: IntentModel, min_confidence: float = 0.9):
+        self.model = model
+        self.min_confidence = min_confidence
+
+    @classmethod
+    def load(cls, index_root: str, min_confidence: float = 0.9,
+             examples_path: str = INTENT_EXAMPLES_PATH) -> "IntentRouter":
+        """Uses the model built with the indexes, or trains one now if it is missing or out of date."""
+        model = IntentModel.load(os.path.join(index_root, INTENT_MODEL_FILE))
+        sha = examples_hash(examples_path)
+        if model is None or model.examples_sha != sha:
+            logger.warning(f"No up-to-date intent model in '{index_root}'; training it from '{examples_path}'.")
+            model = IntentModel.train(load_examples(examples_path), examples_sha=sha)
+        return cls(model, min_confidence)
+
+    def route(self, text: str, engine=None):
+        """Returns the intent to handle the message as and the model's confidence."""
+        started = time.perf_counter()
+        intent, confidence = self.model.classify(text, engine)
+        if intent != RULES_INTENT and confidence < self.min_confidence:
+            intent = RULES_INTENT
+        elif intent == "score":
+            if engine is None or not self._is_card_list(text, engine):
+                intent = RULES_INTENT
+        elif intent != RULES_INTENT:
+            clauses = [clause for clause in CLAUSE_PATTERN.split(text) if clause.strip()]
+            if _asks_about_game(text, engine) or (
+                len(clauses) > 1 and any(self.model.classify(clause, engine)[0] != intent for clause in clauses)
+            ):
+                intent = RULES_INTENT
+        elapsed = time.perf_counter() - started
+        RAG_STAGE_SECONDS.observe(elapsed, stage="route")
+        INTENT_ROUTES.inc(intent=intent)
+        logger.info(f"Routed message as '{intent}' (confidence {confidence:.2f}) in {elapsed * 1000:.2f}ms.")
+        return intent, confidence
+
+    def _is_card_list(self, text: str, engine) -> bool:
+        """True if the text lists cards the engine knows, with nothing but words of the score examples around them."""
+        if not engine.parse_hand(text):
+            return False
+        rest = _card_mentions(engine.names).sub(" ", text.lower())
+        score_words = self.model.words.get("score", set())
+        return all(token in score_words for token in TOKEN_PATTERN.findall(rest))
+
+
+@lru_cache(maxsize=16)
+def _card_mentions(names: tuple):
+    """Matches "2 crabs" style mentions of the given card names."""
+    alternatives = "|".join(re.escape(name) for name in sorted(names, key=len, reverse=True))
+    return re.compile(rf"\b\d+\s+(?:{alternatives})\b")
+
+
+def _asks_about_game(text: str, engine=None) -> bool:
+    """True if a clause of the text is a question mentioning the game, its rules or its cards."""
+    for clause in re.split(r"(?<=[,.;:!?])", text.lower()):
+        tokens = TOKEN_PATTERN.findall(clause)
+        if not tokens or not (clause.rstrip().endswith("?") or tokens[0] in QUESTION_WORDS):
+            continue
+        if any(token in GAME_WORDS or (engine is not None and engine.canonical(token)) for token in tokens):
+            return True
+    return False
@@ -0,0 +1,119 @@
+import time
+import asyncio
+import logging
+from telegram.error import BadRequest
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects messages longer than this (after entity parsing)
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+
+
+def render_within_limit(text: str, render) -> str:
+    """Renders the text, cutting the raw text (never the escaped output) to fit Telegram's limit."""
+    rendered = render(text)
+    while len(rendered) > TELEGRAM_MAX_MESSAGE_LENGTH:
+        overflow = len(rendered) - TELEGRAM_MAX_MESSAGE_LENGTH
+        text = text[:len(text) - max(overflow // 2, 1)]
+        rendered = render(text)
+    return rendered
+
+
+class ProgressiveMessage:
+    """
+    Grows an already-sent message as streamed text arrives.
+
+    The first chunk is shown immediately. After that, edits are coalesced so
+    there is at most one edit every `min_interval` seconds, and only once at
+    least `min_new_chars` new characters have arrived. Every edit renders the
+    full text seen so far through `render` (e.g. a MarkdownV2 escaper), so each
+    intermediate message is as valid as the final one.
+
+    Streamed edits are sent in the background, one at a time, so the caller
+    (which may hold an LLM slot) never waits for Telegram's rate limits;
+    `bot` is expected to wait out flood control itself (see OutboundDispatcher).
+    """
+
+    def __init__(self, bot, chat_id: int, message_id: int, render, parse_mode=None,
+                 min_interval: float = 1.0, min_new_chars: int = 40):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.render = render
+        self.parse_mode = parse_mode
+        self.min_interval = min_interval
+        self.min_new_chars = min_new_chars
+
+        self.text = ""
+        self.edit_count = 0
+        self.first_visible_at = None
+        self._started_at = time.monotonic()
+        self._sent_text = None
+        self._sent_length = 0
+        self._next_edit_at = 0.0
+        self._edit_task = None
+
+    async def append(self, chunk: str):
+        """Adds streamed text and starts an edit if none is in flight and the edit budget allows it."""
+        if not chunk:
+            return
+        self.text += chunk
+
+        if self._edit_task is not None and not self._edit_task.done():
+            return
+        if time.monotonic() < self._next_edit_at:
+            return
+        if self.edit_count and len(self.text) - self._sent_length < self.min_new_chars:
+            return
+        self._edit_task = asyncio.get_running_loop().create_task(self._edit_in_background(self.text))
+
+    async def finish(self, text: str = None):
+        """Shows the complete text, regardless of the edit budget, once the streamed edit in flight is done."""
+        if text is not None:
+            self.text = text
+        if self._edit_task is not None:
+            await asyncio.wait([self._edit_task])
+        delay = self._next_edit_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self._edit(self.text)
+
+    def cancel(self):
+        """Stops the streamed edit in flight, e.g. before the message gets other text."""
+        if self._edit_task is not None:
+            self._edit_task.cancel()
+
+    @property
+    def time_to_first_visible(self):
+        """Seconds between creating the message and showing the first streamed text."""
+        if self.first_visible_at is None:
+            return None
+        return self.first_visible_at - self._started_at
+
+    async def _edit(self, text: str):
+        rendered = render_within_limit(text, self.render)
+        if not rendered or rendered == self._sent_text:
+            return
+        try:
+            await self.bot.edit_message_text(
+                chat_id=self.chat_id,
+                message_id=self.message_id,
+                text=rendered,
+                parse_mode=self.parse_mode
+            )
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        self._sent_text = rendered
+        self._sent_length = len(text)
+        self._next_edit_at = time.monotonic() + self.min_interval
+        self.edit_count += 1
+        if self.first_visible_at is None:
+            self.first_visible_at = time.monotonic()
+
+    async def _edit_in_background(self, text: str):
+        try:
+            await self._edit(text)
+        except Exception as e:
+            # The final edit shows the whole text anyway
+            logger.warning(f"Streamed edit failed in chat {self.chat_id}: {e}")
@@ -0,0 +1,183 @@
+import bisect
+import threading
+
+# Default histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Metric:
+    """Base for a named metric with optional labels; one child value per label combination."""
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"Metric '{self.name}' expects labels {self.label_names}, got {tuple(labels)}.")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _child(self, labels: dict):
+        key = self._key(labels)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def samples(self):
+        """Returns (label values, child) pairs."""
+        return list(self._children.items())
+
+
+class Counter(_Metric):
+    """A value that only goes up."""
+    type_name = "counter"
+
+    def _new_child(self):
+        return [0.0]
+
+    def inc(self, amount: float = 1.0, **labels):
+        child = self._child(labels)
+        with self._lock:
+            child[0] += amount
+
+    def value(self, **labels) -> float:
+        return self._child(labels)[0]
+
+
+class Gauge(_Metric):
+    """A value that can go up and down."""
+    type_name = "gauge"
+
+    def _new_child(self):
+        return [0.0]
+
+    def set(self, value: float, **labels):
+        self._child(labels)[0] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        child = self._child(labels)
+        with self._lock:
+            child[0] += amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._child(labels)[0]
+
+
+class _HistogramValue:
+    __slots__ = ("bucket_counts", "sum", "count")
+
+    def __init__(self, bucket_count: int):
+        # One extra slot for observations above the largest bucket (+Inf)
+        self.bucket_counts = [0] * (bucket_count + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    """Counts observations into fixed buckets, Prometheus style."""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(len(self.buckets))
+
+    def observe(self, value: float, **labels):
+        child = self._child(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            child.bucket_counts[index] += 1
+            child.sum += value
+            child.count += 1
+
+    def percentile(self, fraction: float, **labels):
+        """Estimates a percentile as the upper bound of the bucket it falls in (None if empty)."""
+        child = self._child(labels)
+        if not child.count:
+            return None
+        target = fraction * child.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.bucket_counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+class MetricsRegistry:
+    """Holds every metric in the process; asking twice for the same name returns the same metric."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, label_names, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, documentation, label_names, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric '{name}' is already registered as a {metric.type_name}.")
+            return metric
+
+    def counter(self, name: str, documentation: str, label_names=()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, label_names)
+
+    def gauge(self, name: str, documentation: str, label_names=()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, label_names)
+
+    def histogram(self, name: str, documentation: str, label_names=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, label_names, buckets=buckets)
+
+    def metrics(self):
+        return list(self._metrics.values())
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in sorted(self.metrics(), key=lambda metric: metric.name):
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation, quote=False)}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for label_values, child in sorted(metric.samples()):
+                labels = dict(zip(metric.label_names, label_values))
+                if isinstance(metric, Histogram):
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (float("inf"),), child.bucket_counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(float(bound))
+                        lines.append(f"{metric.name}_bucket{_format_labels({**labels, 'le': le})} {cumulative}")
+                    lines.append(f"{metric.name}_sum{_format_labels(labels)} {child.sum}")
+                    lines.append(f"{metric.name}_count{_format_labels(labels)} {child.count}")
+                else:
+                    lines.append(f"{metric.name}{_format_labels(labels)} {child[0]}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str, quote: bool = True) -> str:
+    value = value.replace("\\", "\\\\").replace("\n", "\\n")
+    return value.replace('"', '\\"') if quote else value
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+# Process-wide registry used by the bot's modules
+REGISTRY = MetricsRegistry()
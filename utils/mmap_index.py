@@ -0,0 +1,64 @@
+import os
+import logging
+from typing import Optional
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Saved next to index.faiss/index.pkl in each game's index folder
+VECTORS_FILE = "vectors.npy"
+
+
+class MmapFlatIndex:
+    """
+    A read-only exact L2 index over vectors memory-mapped from a .npy file.
+
+    It answers `search` like faiss.IndexFlatL2 (squared distances, -1 for
+    missing hits), so it can stand in for the index of a LangChain FAISS
+    store. FAISS copies flat indexes into memory even with IO_FLAG_MMAP;
+    here the vectors stay in the page cache, shared by every worker process
+    that maps the same file. Only the row norms are held per process.
+    """
+
+    def __init__(self, vectors: np.ndarray):
+        self.vectors = vectors
+        self.ntotal, self.d = vectors.shape
+        self._norms = np.einsum("ij,ij->i", vectors, vectors)
+
+    @staticmethod
+    def save(index, index_path: str) -> bool:
+        """Writes a flat L2 FAISS index's vectors to the index folder; returns False for other index types."""
+        if not isinstance(index, faiss.IndexFlatL2):
+            logger.warning(f"{type(index).__name__} can't be served memory-mapped; keeping only index.faiss.")
+            return False
+        np.save(os.path.join(index_path, VECTORS_FILE), index.reconstruct_n(0, index.ntotal).astype(np.float32))
+        return True
+
+    @classmethod
+    def load(cls, index_path: str) -> Optional["MmapFlatIndex"]:
+        """Maps the vectors saved in a game's index folder, or returns None if there are none."""
+        try:
+            vectors = np.load(os.path.join(index_path, VECTORS_FILE), mmap_mode="r")
+        except FileNotFoundError:
+            return None
+        return cls(vectors)
+
+    def search(self, queries: np.ndarray, k: int):
+        """Returns (distances, positions) of the k nearest vectors to each query, as faiss does."""
+        queries = np.asarray(queries, dtype=np.float32)
+        # |q - v|^2 = |v|^2 - 2 q.v + |q|^2
+        distances = self._norms[None, :] - 2 * (queries @ self.vectors.T)
+        distances += np.einsum("ij,ij->i", queries, queries)[:, None]
+        found = min(k, self.ntotal)
+        best = np.argpartition(distances, found - 1, axis=1)[:, :found] if found else np.empty((len(queries), 0), int)
+        best_distances = np.take_along_axis(distances, best, axis=1)
+        order = np.argsort(best_distances, axis=1)
+        out_distances = np.full((len(queries), k), np.finfo(np.float32).max, dtype=np.float32)
+        out_positions = np.full((len(queries), k), -1, dtype=np.int64)
+        out_distances[:, :found] = np.maximum(np.take_along_axis(best_distances, order, axis=1), 0)
+        out_positions[:, :found] = np.take_along_axis(best, order, axis=1)
+        return out_distances, out_positions
+
+    def reconstruct(self, position: int) -> np.ndarray:
+        return np.array(self.vectors[position])
@@ -0,0 +1,84 @@
+import os
+import logging
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# The sentence-transformers repo ships ONNX exports of the model next to the PyTorch weights.
+DEFAULT_MODEL_REPO = "sentence-transformers/all-MiniLM-L6-v2"
+# Full-precision export. Quantized alternatives: "onnx/model_quint8_avx2.onnx", "onnx/model_qint8_avx512.onnx".
+DEFAULT_MODEL_FILE = "onnx/model.onnx"
+# Same truncation as the sentence-transformers model (max_seq_length)
+DEFAULT_MAX_LENGTH = 256
+
+
+class OnnxMiniLMEmbeddings(Embeddings):
+    """
+    all-MiniLM-L6-v2 sentence embeddings computed with onnxruntime, without importing torch.
+
+    Reproduces the sentence-transformers pipeline (transformer -> mean pooling ->
+    L2 normalization), so the vectors can be used with an index built by
+    HuggingFaceEmbeddings. `model_dir` may point at a local copy containing
+    `tokenizer.json` and the ONNX file; otherwise both are fetched from the Hub.
+    """
+
+    def __init__(self, model_repo: str = DEFAULT_MODEL_REPO, model_file: str = DEFAULT_MODEL_FILE,
+                 model_dir: str = None, max_length: int = DEFAULT_MAX_LENGTH, batch_size: int = 32,
+                 intra_op_threads: int = 0):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        tokenizer_path = self._resolve_file(model_repo, model_dir, "tokenizer.json")
+        model_path = self._resolve_file(model_repo, model_dir, model_file)
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        self.batch_size = batch_size
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = onnxruntime.InferenceSession(
+            model_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {model_input.name for model_input in self.session.get_inputs()}
+        logger.info(f"Loaded ONNX embedding model from '{model_path}'.")
+
+    @staticmethod
+    def _resolve_file(model_repo: str, model_dir: str, filename: str) -> str:
+        if model_dir:
+            return os.path.join(model_dir, filename)
+        from huggingface_hub import hf_hub_download
+        return hf_hub_download(repo_id=model_repo, filename=filename)
+
+    def embed_documents(self, texts):
+        """Embeds a list of texts, `batch_size` at a time."""
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._encode(texts[start:start + self.batch_size]).tolist())
+        return vectors
+
+    def embed_query(self, text: str):
+        """Embeds a single query."""
+        return self._encode([text])[0].tolist()
+
+    def _encode(self, texts) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(list(texts))
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+        token_embeddings = self.session.run(None, feeds)[0]
+
+        # Mean pooling over real (non-padding) tokens, then L2 normalization
+        mask = attention_mask[:, :, None].astype(np.float32)
+        summed = (token_embeddings * mask).sum(axis=1)
+        counts = np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled = summed / counts
+        norms = np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return (pooled / norms).astype(np.float32)
@@ -0,0 +1,222 @@
+import time
+import asyncio
+import logging
+from functools import partial
+from telegram.error import RetryAfter
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Seconds between sweeps that forget the rate limit state of idle chats
+PRUNE_INTERVAL = 60.0
+
+OUTBOUND_QUEUE_SECONDS = REGISTRY.histogram(
+    "outbound_queue_seconds", "Time an outgoing Telegram call waited for its rate limit slot.", ("kind",)
+)
+OUTBOUND_CALL_SECONDS = REGISTRY.histogram("outbound_call_seconds", "Duration of outgoing Telegram calls.", ("kind",))
+OUTBOUND_QUEUE_DEPTH = REGISTRY.gauge("outbound_queue_depth", "Outgoing Telegram calls waiting to be sent.")
+OUTBOUND_SENT = REGISTRY.counter("outbound_sent_total", "Outgoing Telegram calls made.", ("kind",))
+OUTBOUND_COALESCED = REGISTRY.counter("outbound_coalesced_edits_total", "Edits merged into a newer edit of the same message.")
+OUTBOUND_RETRY_AFTER = REGISTRY.counter("outbound_retry_after_total", "Flood-control errors answered with a scheduled resend.")
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average, with bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    def reserve(self) -> float:
+        """Takes a token and returns how many seconds to wait before using it."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.paused_until - now)
+
+    def is_idle(self, now: float) -> bool:
+        """True once the bucket has refilled completely, i.e. forgetting it changes nothing."""
+        return now >= self.paused_until and self.tokens + (now - self.updated_at) * self.rate >= self.capacity
+
+    def pause(self, seconds: float):
+        """Blocks the bucket, e.g. after Telegram answered with RetryAfter."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class _PendingEdit:
+    __slots__ = ("kwargs", "future")
+
+    def __init__(self, kwargs: dict, future: asyncio.Future):
+        self.kwargs = kwargs
+        self.future = future
+
+
+class OutboundDispatcher:
+    """
+    The single way handlers talk to Telegram.
+
+    Calls for one chat are sent in order. Each call takes a token from its
+    chat's bucket (Telegram allows about one message per second per chat)
+    and from a global bucket (about 30 per second per bot). An edit of a
+    message that already has an edit waiting replaces that edit's text
+    instead of queueing another one. RetryAfter errors pause the chat and
+    resend the call after the requested delay, up to `max_retries` times.
+    Telegram doesn't say whether a RetryAfter is about one chat or the whole
+    bot, so when a second chat gets one while the first is still paused,
+    the global bucket is paused too.
+    """
+
+    def __init__(self, chat_rate: float = 1.0, chat_burst: float = 3, global_rate: float = 30.0,
+                 global_burst: float = 30, max_retries: int = 3):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global_bucket = TokenBucket(global_rate, global_burst)
+        # chat_id -> [lock, bucket, number of calls queued or in flight]; idle chats are pruned lazily
+        self._chats = {}
+        self._pending_edits = {}
+        # chat_id -> when its last RetryAfter pause ends
+        self._flood_paused = {}
+        self._queued = 0
+        self._pruned_at = time.monotonic()
+
+    async def send_message(self, bot, chat_id: int, text: str, **kwargs):
+        return await self._submit(chat_id, "send", partial(bot.send_message, chat_id=chat_id, text=text, **kwargs))
+
+    async def reply_text(self, message, text: str, **kwargs):
+        return await self._submit(message.chat_id, "send", partial(message.reply_text, text=text, **kwargs))
+
+    async def edit_message_text(self, bot, chat_id: int, message_id: int, text: str, **kwargs):
+        key = (chat_id, message_id)
+        pending = self._pending_edits.get(key)
+        if pending is not None:
+            # An older edit of this message hasn't gone out yet: send the newest text instead
+            pending.kwargs.update(text=text, **kwargs)
+            OUTBOUND_COALESCED.inc()
+            return await asyncio.shield(pending.future)
+
+        pending = _PendingEdit(dict(text=text, **kwargs), asyncio.get_running_loop().create_future())
+        self._pending_edits[key] = pending
+
+        async def call():
+            # From here on, newer edits queue up behind this one instead of merging into it
+            if self._pending_edits.get(key) is pending:
+                del self._pending_edits[key]
+            return await bot.edit_message_text(chat_id=chat_id, message_id=message_id, **pending.kwargs)
+
+        try:
+            result = await self._submit(chat_id, "edit", call)
+        except asyncio.CancelledError:
+            pending.future.cancel()
+            raise
+        except Exception as e:
+            if not pending.future.done():
+                pending.future.set_exception(e)
+                # Mark the exception as retrieved when no merged edit is waiting on it
+                pending.future.exception()
+            raise
+        finally:
+            if self._pending_edits.get(key) is pending:
+                del self._pending_edits[key]
+        if not pending.future.done():
+            pending.future.set_result(result)
+        return result
+
+    async def _submit(self, chat_id: int, kind: str, call):
+        self._prune_idle_chats()
+        entry = self._chats.get(chat_id)
+        if entry is None:
+            entry = self._chats[chat_id] = [asyncio.Lock(), TokenBucket(self.chat_rate, self.chat_burst), 0]
+        lock, bucket, _ = entry
+        entry[2] += 1
+        self._queued += 1
+        OUTBOUND_QUEUE_DEPTH.set(self._queued)
+        queued_at = time.monotonic()
+        waiting = True
+        try:
+            async with lock:
+                for attempt in range(self.max_retries + 1):
+                    # The global token is only taken once the chat may send, so waiting chats don't hold any
+                    for limiter in (bucket, self._global_bucket):
+                        delay = limiter.reserve()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                    if waiting:
+                        waiting = False
+                        self._queued -= 1
+                        OUTBOUND_QUEUE_DEPTH.set(self._queued)
+                        OUTBOUND_QUEUE_SECONDS.observe(time.monotonic() - queued_at, kind=kind)
+                    call_started = time.monotonic()
+                    try:
+                        result = await call()
+                        OUTBOUND_SENT.inc(kind=kind)
+                        return result
+                    except RetryAfter as e:
+                        if attempt == self.max_retries:
+                            raise
+                        retry_after = float(getattr(e.retry_after, "total_seconds", lambda: e.retry_after)())
+                        OUTBOUND_RETRY_AFTER.inc()
+                        logger.warning(f"Flood control in chat {chat_id}; resending in {retry_after}s.")
+                        bucket.pause(retry_after)
+                        self._on_flood(chat_id, retry_after)
+                    finally:
+                        OUTBOUND_CALL_SECONDS.observe(time.monotonic() - call_started, kind=kind)
+        finally:
+            if waiting:
+                self._queued -= 1
+                OUTBOUND_QUEUE_DEPTH.set(self._queued)
+            entry[2] -= 1
+
+    def _on_flood(self, chat_id: int, retry_after: float):
+        """Pauses every chat when another chat is already waiting out a RetryAfter."""
+        now = time.monotonic()
+        self._flood_paused = {other: until for other, until in self._flood_paused.items() if until > now}
+        if any(other != chat_id for other in self._flood_paused):
+            logger.warning(f"Flood control in several chats; pausing all outgoing calls for {retry_after}s.")
+            self._global_bucket.pause(retry_after)
+        self._flood_paused[chat_id] = now + retry_after
+
+    def _prune_idle_chats(self):
+        """Forgets chats with nothing queued whose bucket has refilled, at most once every PRUNE_INTERVAL."""
+        now = time.monotonic()
+        if now - self._pruned_at < PRUNE_INTERVAL:
+            return
+        self._pruned_at = now
+        idle = [chat_id for chat_id, (_, bucket, count) in self._chats.items() if not count and bucket.is_idle(now)]
+        for chat_id in idle:
+            del self._chats[chat_id]
+
+    def bind(self, bot) -> "BoundDispatcher":
+        """Returns an object with Bot-like send/edit methods that go through this dispatcher."""
+        return BoundDispatcher(self, bot)
+
+    def stats(self) -> dict:
+        """Returns the queue size and queue-latency percentiles."""
+        return {
+            "queued": self._queued,
+            "chats": len(self._chats),
+            "send_p95": OUTBOUND_QUEUE_SECONDS.percentile(0.95, kind="send"),
+            "edit_p95": OUTBOUND_QUEUE_SECONDS.percentile(0.95, kind="edit"),
+        }
+
+
+class BoundDispatcher:
+    """A dispatcher paired with a bot, so it can stand in where a Bot is expected."""
+
+    def __init__(self, dispatcher: OutboundDispatcher, bot):
+        self.dispatcher = dispatcher
+        self.bot = bot
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        return await self.dispatcher.send_message(self.bot, chat_id, text, **kwargs)
+
+    async def edit_message_text(self, text: str, chat_id: int, message_id: int, **kwargs):
+        return await self.dispatcher.edit_message_text(self.bot, chat_id, message_id, text, **kwargs)
+
+    async def reply_text(self, message, text: str, **kwargs):
+        return await self.dispatcher.reply_text(message, text, **kwargs)
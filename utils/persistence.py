@@ -0,0 +1,298 @@
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from copy import deepcopy
+from telegram.ext import BasePersistence, PersistenceInput
+from utils.chat_history import HISTORY_MAX_MESSAGES, ROLE_CODES, ChatHistory
+
+logger = logging.getLogger(__name__)
+
+
+def _is_json_value(value) -> bool:
+    try:
+        json.dumps(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+class BotData(dict):
+    """
+    The bot_data mapping. Runtime objects kept in it (game registry, pools,
+    ...) are left out of the copies PTB makes for persistence, so only plain
+    JSON-compatible values are ever stored.
+    """
+
+    def __deepcopy__(self, memo):
+        return BotData({key: deepcopy(value, memo) for key, value in self.items() if _is_json_value(value)})
+
+
+def encode_chat_data(chat_data: dict) -> str:
+    """Serializes chat_data to JSON, storing the history as compact [role, text] pairs."""
+    encoded = {}
+    for key, value in chat_data.items():
+        if key == "history":
+            if isinstance(value, ChatHistory):
+                value = value.pairs()
+            else:
+                value = [[ROLE_CODES.get(message.type, message.type), message.content] for message in value]
+        elif not _is_json_value(value):
+            logger.debug(f"Not persisting chat_data['{key}']: not JSON serializable.")
+            continue
+        encoded[key] = value
+    return json.dumps(encoded, separators=(",", ":"), ensure_ascii=False)
+
+def decode_chat_data(text: str) -> dict:
+    """Inverse of encode_chat_data: rebuilds the history's ring buffer from the stored pairs."""
+    chat_data = json.loads(text)
+    if "history" in chat_data:
+        chat_data["history"] = ChatHistory.from_pairs(chat_data["history"])
+    return chat_data
+
+
+def merge_chat_data(stored: str, ours: str) -> str:
+    """
+    Merges the chat_data this process wants to write into the newer one
+    another process stored meanwhile. Our values win, except the history:
+    the exchanges only we have are appended to the stored ones.
+    """
+    merged, ours = json.loads(stored), json.loads(ours)
+    stored_history = merged.get("history", [])
+    known = {tuple(map(tuple, stored_history[i:i + 2])) for i in range(0, len(stored_history), 2)}
+    history = list(stored_history)
+    our_history = ours.pop("history", [])
+    for i in range(0, len(our_history), 2):
+        exchange = our_history[i:i + 2]
+        if tuple(map(tuple, exchange)) not in known:
+            history.extend(exchange)
+    merged.update(ours)
+    if history:
+        merged["history"] = history[-HISTORY_MAX_MESSAGES:]
+    return json.dumps(merged, separators=(",", ":"), ensure_ascii=False)
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Stores chat_data and bot_data in an SQLite database that several bot
+    processes can share.
+
+    Writes coming from PTB's periodic persistence run are buffered and
+    committed together in one transaction. Each chat row carries a version
+    number. A write only replaces the version this process last saw; if
+    another process wrote the chat meanwhile, both versions are merged (see
+    merge_chat_data) and the merged chat is reloaded before its next update.
+    A delete only removes the version this process last saw.
+
+    Chats are read through: nothing is loaded at startup, a chat is read on
+    its first update (`on_load(chat_id, chat_data)` is then called if set),
+    and after that the stored version is checked again at most every
+    `refresh_ttl` seconds, so a burst of messages costs no round trips.
+    Since each chat is served by one worker (see utils.webhook_server), a
+    newer version only comes from another replica. `unload_chat_data`
+    makes the next update read the chat again, e.g. after its memory was
+    freed.
+    """
+
+    def __init__(self, path: str, update_interval: float = 1.0, refresh_ttl: float = 2.0):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=True, user_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self.refresh_ttl = refresh_ttl
+        self.on_load = None
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS chat_data ("
+            "chat_id INTEGER PRIMARY KEY, data TEXT NOT NULL, version INTEGER NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE TABLE IF NOT EXISTS bot_data (id INTEGER PRIMARY KEY CHECK (id = 0), data TEXT NOT NULL)")
+
+        # Version of each chat as last seen by this process, and when it was last checked (loaded chats only)
+        self._versions = {}
+        self._checked_at = {}
+        # Pending writes: chat_id -> encoded data (None = delete); bot data kept separately
+        self._pending_chats = {}
+        self._pending_bot_data = None
+        # The bot data as last read or written, so unchanged bot data isn't written again
+        self._stored_bot_data = None
+        self._flush_task = None
+
+    # --- Database access (blocking; called through asyncio.to_thread) ---
+
+    def _execute(self, sql: str, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def _write_batch(self, chats: dict, versions: dict, bot_data):
+        """
+        Commits a batch of writes in one transaction. `versions` holds the
+        version each chat is expected to have in the database. Returns the
+        version this process now knows of each chat: the written one, or for
+        merged chats the other process's one, so the merge gets reloaded.
+        """
+        known = {}
+        merged = 0
+        now = time.time()
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                for chat_id, data in chats.items():
+                    if data is None:
+                        # A version we never saw (another process wrote it, or we never loaded it) is kept
+                        cursor.execute(
+                            "DELETE FROM chat_data WHERE chat_id = ? AND version = ?", (chat_id, versions.get(chat_id, 0))
+                        )
+                        continue
+                    row = cursor.execute("SELECT data, version FROM chat_data WHERE chat_id = ?", (chat_id,)).fetchone()
+                    version = row[1] if row else 0
+                    if row is not None and version != versions.get(chat_id, 0):
+                        # Another process wrote this chat since we loaded it
+                        data = merge_chat_data(row[0], data)
+                        known[chat_id] = version
+                        merged += 1
+                    else:
+                        known[chat_id] = version + 1
+                    cursor.execute(
+                        "INSERT INTO chat_data (chat_id, data, version, updated_at) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(chat_id) DO UPDATE SET data = excluded.data, "
+                        "version = excluded.version, updated_at = excluded.updated_at",
+                        (chat_id, data, version + 1, now),
+                    )
+                if bot_data is not None:
+                    cursor.execute(
+                        "INSERT INTO bot_data (id, data) VALUES (0, ?) ON CONFLICT(id) DO UPDATE SET data = excluded.data",
+                        (bot_data,),
+                    )
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        if merged:
+            logger.info(f"Merged {merged} chat(s) written by another process meanwhile.")
+        return known
+
+    # --- Write batching ---
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_pending())
+
+    async def _flush_pending(self):
+        # Let the rest of this persistence run queue its writes first
+        await asyncio.sleep(0)
+        chats, self._pending_chats = self._pending_chats, {}
+        bot_data, self._pending_bot_data = self._pending_bot_data, None
+        if not chats and bot_data is None:
+            return
+        versions = {chat_id: self._versions.get(chat_id, 0) for chat_id in chats}
+        known = await asyncio.to_thread(self._write_batch, chats, versions, bot_data)
+        for chat_id, data in chats.items():
+            if data is None:
+                self._versions.pop(chat_id, None)
+                self._checked_at.pop(chat_id, None)
+            elif known[chat_id] != versions[chat_id] + 1:
+                # Merged with another process's write: check again on the chat's next update
+                self._checked_at.pop(chat_id, None)
+        self._versions.update(known)
+        logger.debug(f"Persisted {len(chats)} chat(s){' and bot data' if bot_data is not None else ''}.")
+
+    # --- BasePersistence interface ---
+
+    async def get_chat_data(self):
+        # Chats are read on their first update (see refresh_chat_data)
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        self._pending_chats[chat_id] = encode_chat_data(data)
+        self._schedule_flush()
+
+    async def drop_chat_data(self, chat_id):
+        self._pending_chats[chat_id] = None
+        self._schedule_flush()
+
+    def unload_chat_data(self, chat_id):
+        """Forgets what this process knows of a chat, so its next update reads it from the database again."""
+        self._checked_at.pop(chat_id, None)
+        if chat_id not in self._pending_chats:
+            self._versions.pop(chat_id, None)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        now = time.monotonic()
+        loaded = chat_id in self._checked_at
+        if loaded and now - self._checked_at[chat_id] < self.refresh_ttl:
+            return
+        if chat_id in self._pending_chats and self._flush_task is not None:
+            # Our own write goes first; if it had to be merged, the merge is loaded below
+            await asyncio.wait([self._flush_task])
+        rows = await asyncio.to_thread(
+            self._execute, "SELECT data, version FROM chat_data WHERE chat_id = ? AND version > ?",
+            (chat_id, self._versions.get(chat_id, 0) if loaded else 0),
+        )
+        self._checked_at[chat_id] = now
+        if rows:
+            # First update of the chat in this process, or another process changed it since
+            data, version = rows[0]
+            chat_data.clear()
+            chat_data.update(decode_chat_data(data))
+            self._versions[chat_id] = version
+            if self.on_load is not None:
+                self.on_load(chat_id, chat_data)
+
+    async def get_bot_data(self):
+        rows = await asyncio.to_thread(self._execute, "SELECT data FROM bot_data WHERE id = 0")
+        if not rows:
+            return BotData()
+        self._stored_bot_data = rows[0][0]
+        return BotData(json.loads(self._stored_bot_data))
+
+    async def update_bot_data(self, data):
+        encoded = json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+        if encoded == self._stored_bot_data:
+            return
+        self._pending_bot_data = self._stored_bot_data = encoded
+        self._schedule_flush()
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._flush_pending()
+        with self._lock:
+            self._connection.close()
+
+    # User data, callback data and conversations are not used by this bot
+
+    async def get_user_data(self):
+        return {}
+
+    async def update_user_data(self, user_id, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
@@ -0,0 +1,241 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, AsyncIterator, Iterator, List, Optional
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.pydantic_v1 import Field
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Send a duplicate LLM request when the first hasn't answered by this percentile of recent latency
+LLM_HEDGING = os.getenv("LLM_HEDGING", "true").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+# Hedge delay used until enough latencies have been seen, and the smallest delay ever used
+LLM_HEDGE_INITIAL_DELAY = float(os.getenv("LLM_HEDGE_INITIAL_DELAY", "3.0"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+# Recent latencies kept per call kind, and how many are needed before the percentile is trusted
+LATENCY_WINDOW = 200
+LATENCY_MIN_SAMPLES = 20
+
+# The circuit opens when at least this share of the calls in the window failed...
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+# ...out of at least this many calls in the last BREAKER_WINDOW_SECONDS
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "10"))
+BREAKER_WINDOW_SECONDS = float(os.getenv("BREAKER_WINDOW_SECONDS", "60"))
+# Seconds the circuit stays open before one trial call is let through
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", "30"))
+
+LLM_HEDGED = REGISTRY.counter("llm_hedged_requests_total", "Duplicate LLM requests sent, by which one answered first.", ("winner",))
+LLM_CIRCUIT_OPEN = REGISTRY.gauge("llm_circuit_open", "1 while the LLM circuit breaker is failing calls fast.")
+LLM_CIRCUIT_REJECTED = REGISTRY.counter("llm_circuit_rejected_total", "LLM calls failed fast by the open circuit breaker.")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the LLM while the circuit breaker is open."""
+
+
+class LatencyTracker:
+    """Keeps the latest latencies of each kind of call and their percentiles."""
+
+    def __init__(self, window: int = LATENCY_WINDOW, min_samples: int = LATENCY_MIN_SAMPLES):
+        self.min_samples = min_samples
+        self._window = window
+        self._samples = {}
+
+    def record(self, kind: str, seconds: float):
+        self._samples.setdefault(kind, deque(maxlen=self._window)).append(seconds)
+
+    def percentile(self, kind: str, fraction: float):
+        """Returns the latency percentile, or None until `min_samples` calls were recorded."""
+        samples = self._samples.get(kind)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        return float(np.percentile(samples, fraction * 100))
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast while the LLM is failing.
+
+    Outcomes of the calls in the last `window_seconds` are kept. Once at
+    least `min_calls` were made and `failure_rate` of them failed, the
+    circuit opens and calls raise CircuitOpenError. After `cooldown_seconds`
+    one trial call is let through (half-open): success closes the circuit,
+    failure keeps it open for another cooldown.
+    """
+
+    def __init__(self, failure_rate: float = BREAKER_FAILURE_RATE, min_calls: int = BREAKER_MIN_CALLS,
+                 window_seconds: float = BREAKER_WINDOW_SECONDS, cooldown_seconds: float = BREAKER_COOLDOWN_SECONDS):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self._outcomes = deque()
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def before_call(self):
+        """Raises CircuitOpenError if the call must not be made."""
+        if self._opened_at is None:
+            return
+        if self._trial_running or time.monotonic() - self._opened_at < self.cooldown_seconds:
+            LLM_CIRCUIT_REJECTED.inc()
+            raise CircuitOpenError("The LLM is failing; not calling it for now.")
+        self._trial_running = True
+
+    def record(self, success: bool):
+        now = time.monotonic()
+        if self._opened_at is not None:
+            if not self._trial_running:
+                # A call that started before the circuit opened
+                return
+            self._trial_running = False
+            if success:
+                logger.info("LLM circuit closed: the trial call succeeded.")
+                self._opened_at = None
+                self._outcomes.clear()
+                LLM_CIRCUIT_OPEN.set(0)
+            else:
+                self._opened_at = now
+            return
+
+        self._outcomes.append((now, success))
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+        failures = sum(1 for _, ok in self._outcomes if not ok)
+        if len(self._outcomes) >= self.min_calls and failures >= self.failure_rate * len(self._outcomes):
+            logger.warning(f"LLM circuit opened: {failures} of the last {len(self._outcomes)} calls failed.")
+            self._opened_at = now
+            LLM_CIRCUIT_OPEN.set(1)
+
+
+def _latency_kind(run_manager, default: str) -> str:
+    """The call's `stage:<name>` tag (rewrite, generate, ...), so each stage is hedged on its own latency."""
+    for tag in getattr(run_manager, "tags", None) or ():
+        if tag.startswith("stage:"):
+            return tag[len("stage:"):]
+    return default
+
+
+class ResilientChatModel(BaseChatModel):
+    """
+    Wraps a chat model with request hedging and a circuit breaker.
+
+    If the wrapped model hasn't answered (for streams: sent its first chunk)
+    by the `hedge_percentile` of recent latency, the same request is sent
+    again; whichever answers first is used and the other is cancelled.
+    Latency is tracked per stage tag, so quick query rewrites and long
+    answers don't share one percentile. Every
+    call's outcome feeds `breaker`, which fails calls fast with
+    CircuitOpenError while the model is failing.
+    """
+
+    model: BaseChatModel
+    hedging: bool = LLM_HEDGING
+    hedge_percentile: float = LLM_HEDGE_PERCENTILE
+    latencies: Any = Field(default_factory=LatencyTracker)
+    breaker: Any = Field(default_factory=CircuitBreaker)
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _llm_type(self) -> str:
+        return f"resilient-{self.model._llm_type}"
+
+    def _hedge_delay(self, kind: str) -> float:
+        delay = self.latencies.percentile(kind, self.hedge_percentile)
+        return max(LLM_HEDGE_MIN_DELAY, LLM_HEDGE_INITIAL_DELAY if delay is None else delay)
+
+    async def _race(self, kind: str, attempt, discard=None):
+        """
+        Runs `attempt()` and, if it is slow, a second copy; returns the first
+        successful result. `discard` releases a result that lost the race.
+        """
+        self.breaker.before_call()
+        started = time.monotonic()
+        tasks = [asyncio.ensure_future(attempt())]
+        success = False
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self._hedge_delay(kind))
+            if not done and self.hedging:
+                logger.info(f"No LLM answer after {time.monotonic() - started:.2f}s; sending a hedged request.")
+                tasks.append(asyncio.ensure_future(attempt()))
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winners = [task for task in tasks if task in done and not task.cancelled() and task.exception() is None]
+                if winners:
+                    break
+                if not pending:
+                    # Every attempt failed: raise the first one's error
+                    raise tasks[0].exception()
+            if len(tasks) > 1:
+                LLM_HEDGED.inc(winner="primary" if winners[0] is tasks[0] else "hedge")
+            for loser in winners[1:]:
+                if discard is not None:
+                    await discard(loser.result())
+            self.latencies.record(kind, time.monotonic() - started)
+            success = True
+            return winners[0].result()
+        finally:
+            # A call cut off by the caller (e.g. the request deadline) counts as failed
+            self.breaker.record(success)
+            for task in tasks:
+                if task.done() and not task.cancelled():
+                    # Mark a loser's error as seen so asyncio doesn't log it
+                    task.exception()
+                task.cancel()
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        self.breaker.before_call()
+        try:
+            result = self.model._generate(messages, stop=stop, **kwargs)
+        except Exception:
+            self.breaker.record(False)
+            raise
+        self.breaker.record(True)
+        return result
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        return await self._race(
+            _latency_kind(run_manager, "generate"), lambda: self.model._agenerate(messages, stop=stop, **kwargs)
+        )
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        yield from self.model._stream(messages, stop=stop, **kwargs)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        async def open_stream():
+            stream = self.model._astream(messages, stop=stop, **kwargs)
+            try:
+                return stream, await stream.__anext__()
+            except BaseException:
+                await stream.aclose()
+                raise
+
+        async def close_stream(opened):
+            await opened[0].aclose()
+
+        kind = f"{_latency_kind(run_manager, 'generate')}:first_token"
+        stream, first_chunk = await self._race(kind, open_stream, discard=close_stream)
+        try:
+            yield first_chunk
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
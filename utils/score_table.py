@@ -0,0 +1,261 @@
+import os
+import json
+import hashlib
+import logging
+import argparse
+from functools import lru_cache
+import numpy as np
+from utils.game_logic import get_scoring_engine
+
+logger = logging.getLogger(__name__)
+
+# Folder holding one precomputed table per game: <game_id>.npy plus its <game_id>.json header
+SCORE_TABLE_PATH = os.getenv("SCORE_TABLE_PATH", "score_tables")
+
+
+def _rules_fingerprint(engine) -> str:
+    """Hash of everything the table depends on, so a stale table is never served."""
+    relevant = {
+        # Bumped when the record layout changes
+        "format": 2,
+        "rules": [[kind, engine.rule_cards(kind, rule), rule["points"]] for kind, rule in engine.rule_list],
+        "deck": engine.deck,
+    }
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _components(engine) -> list:
+    """
+    Groups cards that score together (a duo's cards, a multiplier and its
+    target). A hand's score is the sum of its groups' scores, so each group
+    gets its own small table instead of one table over every possible hand.
+    """
+    parent = {}
+
+    def find(card):
+        while parent.setdefault(card, card) != card:
+            card = parent[card]
+        return card
+
+    for kind, rule in engine.rule_list:
+        cards = engine.rule_cards(kind, rule)
+        for card in cards:
+            parent[find(card)] = find(cards[0])
+
+    groups = {}
+    for card in engine.cards:
+        if card in parent:
+            groups.setdefault(find(card), []).append(card)
+    components = []
+    for cards in groups.values():
+        rules = [i for i, (kind, rule) in enumerate(engine.rule_list) if engine.rule_cards(kind, rule)[0] in cards]
+        components.append({"cards": cards, "rules": rules})
+    return components
+
+
+def _strides(shape: list) -> list:
+    """Record offset of one more copy of each card of a group (C order, as np.indices lays them out)."""
+    return np.cumprod([1] + shape[:0:-1])[::-1].tolist()
+
+
+def build_score_table(game_id: str) -> str:
+    """
+    Precomputes every reachable hand's score for a game and writes the table; returns its path.
+
+    Each record also holds what drawing one more of each of its group's
+    cards would add (`gains`), which /hint ranks the duo plays with.
+    """
+    engine = get_scoring_engine(f"games.{game_id}")
+    if engine is None or engine.deck is None:
+        raise ValueError(f"'{game_id}' has no SCORING_RULES with a deck list.")
+
+    components = _components(engine)
+    width = max(len(component["rules"]) for component in components)
+    card_width = max(len(component["cards"]) for component in components)
+    dtype = np.dtype([
+        ("score", "<i2"), ("points", "<i2", (width,)), ("n", "u1", (width,)), ("gains", "<i2", (card_width,)),
+    ])
+
+    blocks = []
+    offset = 0
+    for component in components:
+        # Every count from 0 up to the number of copies in the deck, for each card of the group
+        shape = [engine.deck[card] + 1 for card in component["cards"]]
+        states = np.indices(shape).reshape(len(shape), -1).T
+        counts = np.zeros((len(states), len(engine.cards)), dtype=np.int64)
+        counts[:, [engine.card_index[card] for card in component["cards"]]] = states
+
+        points, n = engine.score_rules(counts)
+        block = np.zeros(len(states), dtype=dtype)
+        block["points"][:, :len(component["rules"])] = points[:, component["rules"]]
+        block["n"][:, :len(component["rules"])] = n[:, component["rules"]]
+        block["score"] = block["points"].sum(axis=1)
+        # Scores are additive over groups, so a card's gain only depends on its own group's counts
+        rows = np.arange(len(states))
+        for slot, stride in enumerate(_strides(shape)):
+            has_next = states[:, slot] < shape[slot] - 1
+            block["gains"][has_next, slot] = block["score"][rows[has_next] + stride] - block["score"][has_next]
+        blocks.append(block)
+
+        component.update(shape=shape, offset=offset)
+        offset += len(states)
+
+    os.makedirs(SCORE_TABLE_PATH, exist_ok=True)
+    path = os.path.join(SCORE_TABLE_PATH, f"{game_id}.npy")
+    np.save(path, np.concatenate(blocks))
+    header = {"fingerprint": _rules_fingerprint(engine), "components": components}
+    with open(os.path.join(SCORE_TABLE_PATH, f"{game_id}.json"), "w", encoding="utf-8") as f:
+        json.dump(header, f, indent=1)
+    logger.info(f"Score table for '{game_id}' saved to '{path}' ({offset} entries).")
+    return path
+
+
+class ScoreTable:
+    """
+    Read-only lookup of precomputed scores, memory-mapped so every bot
+    process shares the same pages.
+
+    Hands are looked up one card group at a time: the group's counts index
+    straight into its block of records. Hands the deck can't produce (more
+    copies than exist) return None so the caller can fall back to the engine.
+    """
+
+    def __init__(self, records: np.ndarray, header: dict, engine):
+        self.records = records
+        self.scores = records["score"]
+        self.engine = engine
+        self.components = header["components"]
+        for component in self.components:
+            component["strides"] = _strides(component["shape"])
+
+    def _indexes(self, card_counts: dict):
+        """Record index of every card group, or None if a count is out of range."""
+        indexes = []
+        for component in self.components:
+            index = component["offset"]
+            for card, size, stride in zip(component["cards"], component["shape"], component["strides"]):
+                count = card_counts.get(card, 0)
+                if not 0 <= count < size:
+                    return None
+                index += count * stride
+            indexes.append(index)
+        return indexes
+
+    def _lookup(self, card_counts: dict):
+        """Returns (component, record) for every card group, or None if a count is out of range."""
+        indexes = self._indexes(card_counts)
+        if indexes is None:
+            return None
+        return [(component, self.records[index]) for component, index in zip(self.components, indexes)]
+
+    def score(self, card_counts: dict):
+        """Total score of a hand, or None if it is out of range."""
+        indexes = self._indexes(card_counts)
+        return None if indexes is None else int(self.scores[indexes].sum())
+
+    def score_hand(self, card_counts: dict):
+        """Same result as ScoringEngine.score_hand, from the table; None if the hand is out of range."""
+        found = self._lookup(card_counts)
+        if found is None:
+            return None
+        rule_list = self.engine.rule_list
+        scored = {}
+        for component, record in found:
+            for slot, rule_index in enumerate(component["rules"]):
+                scored[rule_index] = (int(record["points"][slot]), int(record["n"][slot]))
+
+        total = 0
+        breakdown = []
+        for rule_index, (kind, rule) in enumerate(rule_list):
+            points, n = scored[rule_index]
+            # Rules only show up for cards the player mentioned, as in ScoringEngine.score_hand
+            if not all(card in card_counts for card in self.engine.rule_cards(kind, rule)):
+                continue
+            if kind == "duo" and n == 0:
+                continue
+            total += points
+            breakdown.append((rule["label"].format(n=n), points))
+        return total, breakdown
+
+    def gains(self, card_counts: dict) -> dict:
+        """Points gained by adding one more of each card still in the deck, read from the precomputed gains."""
+        found = self._lookup(card_counts)
+        if found is None:
+            return {}
+        # Cards no rule scores add nothing; cards with every copy in the hand can't be added
+        scored = {}
+        for component, record in found:
+            for slot, (card, size) in enumerate(zip(component["cards"], component["shape"])):
+                scored[card] = int(record["gains"][slot]) if card_counts.get(card, 0) + 1 < size else None
+        return {card: scored.get(card, 0) for card in self.engine.cards if scored.get(card, 0) is not None}
+
+    def playable_duos(self, card_counts: dict) -> list:
+        """The duo rules the hand has at least one set for."""
+        found = self._lookup(card_counts)
+        if found is None:
+            return []
+        playable = []
+        for component, record in found:
+            for slot, rule_index in enumerate(component["rules"]):
+                kind, rule = self.engine.rule_list[rule_index]
+                if kind == "duo" and record["n"][slot] > 0:
+                    playable.append(rule)
+        return playable
+
+
+def rank_duo_plays(table: ScoreTable, card_counts: dict) -> list:
+    """
+    Orders the hand's playable duos by the points their effect is expected to add.
+
+    Drawing or stealing gets a random unseen card; picking from a discard pile
+    can get the best one; an extra turn draws two and keeps the better. Returns
+    [(rule, expected points), ...], best first. The per-card gains come from
+    the table; only weighting them by the unseen cards, which depends on the
+    whole hand, is done here.
+    """
+    engine = table.engine
+    gains = table.gains(card_counts)
+    unseen = {card: engine.deck.get(card, 0) - card_counts.get(card, 0) for card in gains}
+    unseen = {card: count for card, count in unseen.items() if count > 0}
+    total = sum(unseen.values())
+    if not total:
+        return []
+
+    values = np.array([gains[card] for card in unseen], dtype=np.float64)
+    weights = np.array(list(unseen.values()), dtype=np.float64) / total
+    order = np.argsort(values)
+    # P(best of two draws <= value) = P(one draw <= value) squared
+    below = np.cumsum(weights[order])
+    best_of_two = float(np.sum(values[order] * np.diff(np.concatenate(([0.0], below ** 2)))))
+    expected = {
+        "draw": float(values @ weights),
+        "steal": float(values @ weights),
+        "pick": float(values.max()),
+        "turn": best_of_two,
+    }
+    plays = [(rule, expected.get(rule.get("action"), 0.0)) for rule in table.playable_duos(card_counts)]
+    return sorted(plays, key=lambda play: play[1], reverse=True)
+
+
+@lru_cache(maxsize=None)
+def get_score_table(game_id: str):
+    """Loads a game's table on first use; None if it was never built or is out of date."""
+    path = os.path.join(SCORE_TABLE_PATH, f"{game_id}.npy")
+    if not os.path.exists(path):
+        return None
+    engine = get_scoring_engine(f"games.{game_id}")
+    with open(os.path.join(SCORE_TABLE_PATH, f"{game_id}.json"), encoding="utf-8") as f:
+        header = json.load(f)
+    if engine is None or header["fingerprint"] != _rules_fingerprint(engine):
+        logger.warning(f"Score table for '{game_id}' is out of date; run `python -m utils.score_table {game_id}`.")
+        return None
+    return ScoreTable(np.load(path, mmap_mode="r"), header, engine)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Precomputes the score lookup table of each game.")
+    parser.add_argument("games", nargs="+", help="Game ids to build.")
+    args = parser.parse_args()
+    for game_id in args.games:
+        build_score_table(game_id)
@@ -0,0 +1,198 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+import numpy as np
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+CACHE_LOOKUPS = REGISTRY.counter("semantic_cache_lookups_total", "Semantic cache lookups by result.", ("result",))
+
+# Rough per-entry bookkeeping cost (dict slot, tuple, floats) on top of the payload.
+ENTRY_OVERHEAD_BYTES = 256
+
+
+class _CacheEntry:
+    __slots__ = ("question", "answer", "vector", "row", "created_at", "size")
+
+    def __init__(self, question: str, answer: str, vector: np.ndarray, row: int):
+        self.question = question
+        self.answer = answer
+        self.vector = vector
+        self.row = row
+        self.created_at = time.monotonic()
+        self.size = (
+            vector.nbytes
+            + len(question.encode("utf-8"))
+            + len(answer.encode("utf-8"))
+            + ENTRY_OVERHEAD_BYTES
+        )
+
+
+class SemanticCache:
+    """
+    Caches answers by question meaning rather than exact text.
+
+    A question is embedded with the same model as the vector store and compared
+    (cosine similarity) against previously answered questions. A match above
+    `threshold` returns the stored answer without calling the LLM. Entries are
+    evicted least-recently-used first once `max_entries` or `max_bytes` is
+    exceeded, and expire after `ttl_seconds`. The whole cache is dropped when
+    the files in `index_path` change, i.e. when the knowledge base is rebuilt.
+
+    The vectors live in one matrix, a row per entry, so a lookup is a single
+    matrix product. Rows of removed entries are zeroed and reused.
+    """
+
+    def __init__(self, embeddings, index_path: str, threshold: float = 0.92,
+                 max_entries: int = 1000, max_bytes: int = 8 * 1024 * 1024,
+                 ttl_seconds: float = 24 * 60 * 60):
+        self.embeddings = embeddings
+        self.index_path = index_path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._entries = OrderedDict()
+        self._next_key = 0
+        self._matrix = None
+        # Key of the entry in each matrix row (None for a free row), and the free rows
+        self._row_keys = []
+        self._free_rows = []
+        self._bytes = 0
+        self._index_fingerprint = self._read_index_fingerprint()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def embed(self, question: str) -> np.ndarray:
+        """Embeds a question as a unit-length float32 vector. Blocking; run it off the event loop."""
+        return self._normalize(self.embeddings.embed_query(question))
+
+    async def aembed(self, question: str) -> np.ndarray:
+        """Async version of embed(); lets batching embeddings group it with other queries."""
+        return self._normalize(await self.embeddings.aembed_query(question))
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, vector: np.ndarray):
+        """Returns the cached answer closest to `vector`, or None if nothing is similar enough."""
+        self._check_index()
+        self._expire()
+
+        if not self._entries:
+            self.misses += 1
+            CACHE_LOOKUPS.inc(result="miss")
+            return None
+
+        similarities = self._matrix[:len(self._row_keys)] @ vector
+        best = int(np.argmax(similarities))
+        key = self._row_keys[best]
+
+        if key is None or similarities[best] < self.threshold:
+            self.misses += 1
+            CACHE_LOOKUPS.inc(result="miss")
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        CACHE_LOOKUPS.inc(result="hit")
+        logger.info(f"Semantic cache hit (similarity {similarities[best]:.3f}).")
+        return self._entries[key].answer
+
+    def store(self, question: str, vector: np.ndarray, answer: str):
+        """Adds an answered question to the cache, evicting old entries if needed."""
+        self._check_index()
+        entry = _CacheEntry(question, answer, vector, row=-1)
+        if entry.size > self.max_bytes:
+            return
+
+        key = self._next_key
+        self._next_key += 1
+        entry.row = self._take_row(key, vector)
+        self._entries[key] = entry
+        self._bytes += entry.size
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def clear(self):
+        """Removes every entry."""
+        self._entries.clear()
+        self._bytes = 0
+        self._matrix = None
+        self._row_keys = []
+        self._free_rows = []
+
+    def _take_row(self, key: int, vector: np.ndarray) -> int:
+        """Writes `vector` into a free matrix row (growing the matrix if needed); returns the row."""
+        if self._free_rows:
+            row = self._free_rows.pop()
+            self._row_keys[row] = key
+        else:
+            row = len(self._row_keys)
+            self._row_keys.append(key)
+            if self._matrix is None or row == len(self._matrix):
+                grown = np.zeros((max(16, 2 * row), vector.shape[0]), dtype=np.float32)
+                if self._matrix is not None:
+                    grown[:row] = self._matrix
+                self._matrix = grown
+        self._matrix[row] = vector
+        return row
+
+    def _remove(self, key: int):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        # A zero row is never similar enough to match
+        self._matrix[entry.row] = 0.0
+        self._row_keys[entry.row] = None
+        self._free_rows.append(entry.row)
+
+    def stats(self) -> dict:
+        """Returns the cache counters."""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def _expire(self):
+        """Drops entries older than the TTL. Entries are in LRU order, so check them all."""
+        now = time.monotonic()
+        expired = [key for key, entry in self._entries.items() if now - entry.created_at > self.ttl_seconds]
+        for key in expired:
+            self._remove(key)
+            self.evictions += 1
+
+    def _check_index(self):
+        """Clears the cache if the FAISS index on disk was rebuilt since the last check."""
+        fingerprint = self._read_index_fingerprint()
+        if fingerprint != self._index_fingerprint:
+            logger.info(f"Index at '{self.index_path}' changed; clearing semantic cache.")
+            self._index_fingerprint = fingerprint
+            self.invalidations += 1
+            self.clear()
+
+    def _read_index_fingerprint(self):
+        fingerprint = []
+        for name in ("index.faiss", "index.pkl"):
+            try:
+                stat = os.stat(os.path.join(self.index_path, name))
+                fingerprint.append((name, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                fingerprint.append((name, None, None))
+        return tuple(fingerprint)
@@ -0,0 +1,22 @@
+import time
+import logging
+from contextlib import contextmanager
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+STARTUP_SECONDS = REGISTRY.gauge("startup_stage_seconds", "Time each startup stage took.", ("stage",))
+
+
+def record_stage(stage: str, seconds: float):
+    """Reports how long a startup stage took, in the log and as a metric."""
+    STARTUP_SECONDS.set(seconds, stage=stage)
+    logger.info(f"Startup stage '{stage}' took {seconds:.2f}s.")
+
+
+@contextmanager
+def startup_stage(stage: str):
+    """Times the enclosed block as a startup stage."""
+    started = time.perf_counter()
+    yield
+    record_stage(stage, time.perf_counter() - started)
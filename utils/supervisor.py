@@ -0,0 +1,121 @@
+import os
+import gc
+import sys
+import time
+import signal
+import logging
+import multiprocessing
+from multiprocessing.connection import wait
+
+logger = logging.getLogger(__name__)
+
+# Delay before restarting a worker that crashed soon after starting; doubles while it keeps crashing
+RESTART_BACKOFF_SECONDS = 1.0
+RESTART_BACKOFF_MAX_SECONDS = 30.0
+# A worker that ran at least this long is restarted right away
+STABLE_SECONDS = 60.0
+# Seconds the workers get to finish after SIGTERM before they are killed
+SHUTDOWN_TIMEOUT = 20.0
+
+
+def _limit_threads(workers: int):
+    """Splits the cores between the workers instead of each using all of them (read when torch is imported)."""
+    threads = str(max(1, (os.cpu_count() or 1) // workers))
+    for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ.setdefault(variable, threads)
+
+
+class WorkerSupervisor:
+    """
+    Runs `target(worker_id)` in `workers` forked processes and restarts the
+    ones that exit.
+
+    Each worker loads its own models: forking a process whose torch or
+    onnxruntime thread pools are already running can deadlock the child, so
+    nothing of the kind may be loaded before `run()`. The imported modules
+    are shared (forked memory is only copied when written to, and they are
+    frozen out of the garbage collector so it doesn't write to them).
+    SIGINT or SIGTERM stops the workers and returns.
+    """
+
+    def __init__(self, workers: int, target):
+        self.workers = workers
+        self.target = target
+        self._context = multiprocessing.get_context("fork")
+        # worker id -> (process, started at)
+        self._processes = {}
+        # worker id -> (restart at, next backoff)
+        self._restarts = {}
+        self._backoff = {}
+        self._stopping = False
+
+    def run(self):
+        if "torch" in sys.modules or "onnxruntime" in sys.modules:
+            logger.warning("A model runtime was imported before forking; the workers must load their own models.")
+        gc.freeze()
+        previous = {sig: signal.signal(sig, self._request_stop) for sig in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            for worker_id in range(self.workers):
+                self._start(worker_id)
+            while not self._stopping:
+                now = time.monotonic()
+                for worker_id, restart_at in list(self._restarts.items()):
+                    if restart_at <= now:
+                        del self._restarts[worker_id]
+                        self._start(worker_id)
+                sentinels = {process.sentinel: worker_id for worker_id, (process, _) in self._processes.items()}
+                for sentinel in wait(list(sentinels), timeout=1.0):
+                    self._on_exit(sentinels[sentinel])
+        finally:
+            self._stop_all()
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+
+    def _request_stop(self, signum, frame):
+        logger.info(f"Received signal {signum}; stopping {len(self._processes)} worker(s).")
+        self._stopping = True
+
+    def _start(self, worker_id: int):
+        process = self._context.Process(target=self._run_worker, args=(worker_id,), name=f"worker-{worker_id}")
+        process.start()
+        self._processes[worker_id] = (process, time.monotonic())
+        logger.info(f"Started worker {worker_id} (pid {process.pid}).")
+
+    def _run_worker(self, worker_id: int):
+        # The worker installs its own handlers; until then a signal just ends it
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, signal.SIG_DFL)
+        _limit_threads(self.workers)
+        self.target(worker_id)
+
+    def _on_exit(self, worker_id: int):
+        process, started_at = self._processes.pop(worker_id)
+        process.join()
+        if self._stopping:
+            return
+        ran = time.monotonic() - started_at
+        if ran >= STABLE_SECONDS:
+            delay = 0.0
+            self._backoff[worker_id] = RESTART_BACKOFF_SECONDS
+        else:
+            delay = self._backoff.get(worker_id, RESTART_BACKOFF_SECONDS)
+            self._backoff[worker_id] = min(delay * 2, RESTART_BACKOFF_MAX_SECONDS)
+        logger.error(
+            f"Worker {worker_id} (pid {process.pid}) exited with code {process.exitcode} after {ran:.0f}s; "
+            f"restarting it in {delay:.0f}s."
+        )
+        self._restarts[worker_id] = time.monotonic() + delay
+
+    def _stop_all(self):
+        processes = [process for process, _ in self._processes.values()]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Worker pid {process.pid} didn't stop in time; killing it.")
+                process.kill()
+                process.join()
+        self._processes.clear()
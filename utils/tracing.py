@@ -0,0 +1,144 @@
+import os
+import time
+import random
+import secrets
+import logging
+import functools
+import contextvars
+from langchain_core.callbacks import AsyncCallbackHandler
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Share of requests that get a trace ID and per-stage log lines (metrics cover every request)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+
+HANDLER_SECONDS = REGISTRY.histogram("handler_seconds", "Time spent in each Telegram handler.", ("handler",))
+HANDLER_ERRORS = REGISTRY.counter("handler_errors_total", "Handler calls that raised.", ("handler",))
+RAG_STAGE_SECONDS = REGISTRY.histogram(
+    "rag_stage_seconds", "Time spent in each RAG stage (rewrite, retrieve, generate).", ("stage",)
+)
+RAG_TOKENS = REGISTRY.counter("rag_llm_tokens_total", "LLM tokens used per RAG stage.", ("stage", "direction"))
+RAG_FALLBACKS = REGISTRY.counter(
+    "rag_fallback_answers_total", "Questions answered with the retrieved rules because the LLM couldn't answer.", ("reason",)
+)
+
+# Trace ID of the request being handled ("-" when the request isn't sampled)
+current_trace_id = contextvars.ContextVar("trace_id", default="-")
+
+
+def install_log_trace_ids():
+    """Gives every log record a `trace_id` attribute, so formats can include %(trace_id)s."""
+    factory = logging.getLogRecordFactory()
+    if getattr(factory, "adds_trace_id", False):
+        return
+
+    def record_factory(*args, **kwargs):
+        record = factory(*args, **kwargs)
+        record.trace_id = current_trace_id.get()
+        return record
+
+    record_factory.adds_trace_id = True
+    logging.setLogRecordFactory(record_factory)
+
+
+def start_trace() -> str:
+    """Starts a trace for the current request if it is sampled; returns its ID or "-"."""
+    trace_id = secrets.token_hex(8) if random.random() < TRACE_SAMPLE_RATE else "-"
+    current_trace_id.set(trace_id)
+    return trace_id
+
+
+def traced_handler(name: str):
+    """Wraps a Telegram handler with a trace ID, a timing histogram and an error counter."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update, context):
+            trace_id = start_trace()
+            started = time.perf_counter()
+            try:
+                return await handler(update, context)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=name)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                HANDLER_SECONDS.observe(elapsed, handler=name)
+                if trace_id != "-":
+                    logger.info(f"Handler '{name}' took {elapsed:.3f}s.")
+        return wrapper
+    return decorator
+
+
+class StageTimer(AsyncCallbackHandler):
+    """
+    Times the RAG chain's stages from LangChain callbacks.
+
+    LLM calls are attributed to a stage by their `stage:<name>` tag (set in
+    get_conversation_chain); retriever calls are the "retrieve" stage.
+    Token usage reported by the model is counted per stage, falling back to
+    the number of streamed chunks when the model reports none.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._started = {}
+        self._streamed = {}
+
+    @staticmethod
+    def _stage(tags) -> str:
+        for tag in tags or ():
+            if tag.startswith("stage:"):
+                return tag[len("stage:"):]
+        return "llm"
+
+    def _start(self, run_id, stage: str):
+        self._started[run_id] = (stage, time.perf_counter())
+
+    def _end(self, run_id):
+        started = self._started.pop(run_id, None)
+        if started is None:
+            return None
+        stage, at = started
+        elapsed = time.perf_counter() - at
+        RAG_STAGE_SECONDS.observe(elapsed, stage=stage)
+        self.stages[stage] = self.stages.get(stage, 0.0) + elapsed
+        if current_trace_id.get() != "-":
+            logger.info(f"Stage '{stage}' took {elapsed:.3f}s.")
+        return stage
+
+    async def on_chat_model_start(self, serialized, messages, *, run_id, tags=None, **kwargs):
+        self._start(run_id, self._stage(tags))
+
+    async def on_llm_start(self, serialized, prompts, *, run_id, tags=None, **kwargs):
+        self._start(run_id, self._stage(tags))
+
+    async def on_llm_new_token(self, token, *, run_id, **kwargs):
+        self._streamed[run_id] = self._streamed.get(run_id, 0) + 1
+
+    async def on_llm_end(self, response, *, run_id, **kwargs):
+        streamed = self._streamed.pop(run_id, 0)
+        stage = self._end(run_id)
+        if stage is None:
+            return
+        input_tokens = output_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+        RAG_TOKENS.inc(input_tokens, stage=stage, direction="input")
+        RAG_TOKENS.inc(output_tokens or streamed, stage=stage, direction="output")
+
+    async def on_llm_error(self, error, *, run_id, **kwargs):
+        self._streamed.pop(run_id, None)
+        self._end(run_id)
+
+    async def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._start(run_id, "retrieve")
+
+    async def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id)
+
+    async def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
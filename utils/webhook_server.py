@@ -0,0 +1,164 @@
+import os
+import hmac
+import json
+import time
+import signal
+import asyncio
+import logging
+import tornado.web
+import tornado.httpserver
+from tornado.httpclient import AsyncHTTPClient
+from telegram import Update
+from utils.metrics import REGISTRY
+from utils.startup import record_stage
+
+logger = logging.getLogger(__name__)
+
+# Path of the Prometheus endpoint
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+# Bearer token a scraper must send to read the metrics on the public webhook port (unset = not served there)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# Internal address serving the metrics without a token, e.g. for a scraper on the same host (unset port = off)
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# With several workers, worker N also listens on 127.0.0.1:(WORKER_PORT_BASE + N) for updates forwarded to it
+WORKER_PORT_BASE = int(os.getenv("WORKER_PORT_BASE", "9400"))
+# Seconds a forwarded update may take before the receiving worker processes it itself
+FORWARD_TIMEOUT = float(os.getenv("FORWARD_TIMEOUT", "5"))
+
+UPDATES_FORWARDED = REGISTRY.counter(
+    "webhook_updates_forwarded_total", "Updates passed to the worker that owns their chat.", ("result",)
+)
+
+
+def owner_worker(update: Update, workers: int):
+    """The worker that handles all updates of the update's chat, or None if it has no chat."""
+    chat = update.effective_chat
+    return chat.id % workers if chat is not None else None
+
+
+class TelegramUpdateHandler(tornado.web.RequestHandler):
+    """
+    Receives updates from Telegram and queues them for the Application.
+
+    With several workers, an update whose chat belongs to another worker
+    (see owner_worker) is forwarded to that worker's internal port, so each
+    chat's updates are processed in order by one process. If the owner
+    can't take it, it is processed here instead of being lost.
+    """
+
+    def initialize(self, bot_application, secret_token, worker_id: int = 0, workers: int = 1):
+        self.bot_application = bot_application
+        self.secret_token = secret_token
+        self.worker_id = worker_id
+        self.workers = workers
+
+    async def post(self):
+        if self.secret_token and self.request.headers.get("X-Telegram-Bot-Api-Secret-Token") != self.secret_token:
+            raise tornado.web.HTTPError(403)
+        try:
+            update = Update.de_json(json.loads(self.request.body), self.bot_application.bot)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Ignoring malformed update: {e}")
+            raise tornado.web.HTTPError(400)
+        owner = owner_worker(update, self.workers) if self.workers > 1 else None
+        if owner is not None and owner != self.worker_id and await self._forward(owner):
+            self.set_status(200)
+            return
+        await self.bot_application.update_queue.put(update)
+        self.set_status(200)
+
+    async def _forward(self, owner: int) -> bool:
+        try:
+            await AsyncHTTPClient().fetch(
+                f"http://127.0.0.1:{WORKER_PORT_BASE + owner}{self.request.path}",
+                method="POST",
+                body=self.request.body,
+                headers={"X-Telegram-Bot-Api-Secret-Token": self.secret_token or ""},
+                request_timeout=FORWARD_TIMEOUT,
+            )
+        except Exception as e:
+            UPDATES_FORWARDED.inc(result="failed")
+            logger.warning(f"Could not forward an update to worker {owner} ({e}); processing it here.")
+            return False
+        UPDATES_FORWARDED.inc(result="forwarded")
+        return True
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Serves the process metrics in the Prometheus text format, to holders of `token` if one is given."""
+
+    def initialize(self, token=None):
+        self.token = token
+
+    def get(self):
+        if self.token and not hmac.compare_digest(
+            self.request.headers.get("Authorization", "").encode(), f"Bearer {self.token}".encode()
+        ):
+            raise tornado.web.HTTPError(401)
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(REGISTRY.render())
+
+
+async def serve_webhook(application, port: int, url_path: str, webhook_url: str, secret_token: str = None,
+                        listen: str = "0.0.0.0", worker_id: int = 0, workers: int = 1):
+    """
+    Runs the bot behind our own webhook server instead of `run_webhook`,
+    so the metrics can be served too: on the public port to scrapers sending
+    METRICS_TOKEN, and without a token on METRICS_LISTEN:METRICS_PORT.
+    Blocks until SIGINT or SIGTERM, then stops the Application cleanly.
+
+    With several `workers`, each one calls this with its `worker_id`: they
+    all listen on the ports (the kernel spreads connections between them),
+    pass updates on to the worker owning their chat, and worker 0 registers
+    the webhook with Telegram.
+    """
+    started = time.perf_counter()
+    reuse_port = workers > 1
+    update_path = f"/{url_path.lstrip('/')}"
+    handler_options = {
+        "bot_application": application, "secret_token": secret_token, "worker_id": worker_id, "workers": workers,
+    }
+    routes = [(update_path, TelegramUpdateHandler, handler_options)]
+    if METRICS_TOKEN:
+        routes.append((METRICS_PATH, MetricsHandler, {"token": METRICS_TOKEN}))
+    web_app = tornado.web.Application(routes)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        if worker_id == 0:
+            await application.bot.set_webhook(url=webhook_url, allowed_updates=Update.ALL_TYPES, secret_token=secret_token)
+        await application.start()
+
+        servers = [tornado.httpserver.HTTPServer(web_app, xheaders=True)]
+        servers[0].listen(port, listen, reuse_port=reuse_port)
+        logger.info(
+            f"Webhook server listening on {listen}:{port}"
+            f"{f' (metrics at {METRICS_PATH} with METRICS_TOKEN)' if METRICS_TOKEN else ''}."
+        )
+        if workers > 1:
+            # Forwarded updates are this worker's own, so they are never passed on again
+            internal = tornado.web.Application([(update_path, TelegramUpdateHandler, dict(handler_options, workers=1))])
+            servers.append(tornado.httpserver.HTTPServer(internal))
+            servers[-1].listen(WORKER_PORT_BASE + worker_id, "127.0.0.1")
+        if METRICS_PORT:
+            servers.append(tornado.httpserver.HTTPServer(tornado.web.Application([(METRICS_PATH, MetricsHandler)])))
+            servers[-1].listen(METRICS_PORT, METRICS_LISTEN, reuse_port=reuse_port)
+            logger.info(f"Metrics served at {METRICS_LISTEN}:{METRICS_PORT}{METRICS_PATH}.")
+        record_stage("webhook", time.perf_counter() - started)
+        try:
+            await stop.wait()
+        finally:
+            for server in servers:
+                server.stop()
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)